@@ -0,0 +1,413 @@
+"""
+Micro-benchmarks of individual components: transforms, volume loaders, dataset
+containers (Zip, ZipReject, Concatenate), segmentation metrics and Dice criteria.
+
+Every benchmark is timed in a loop (for at least `--min-time` seconds, best of
+`--repeats`), and one more call is traced with `tracemalloc` to measure:
+
+    * peak_allocated_bytes: the peak of the memory allocated during a call (on top of
+      what was allocated before).
+    * retained_bytes: the memory still allocated after the call (e.g. caches, leaks).
+
+`tracemalloc` sees allocations of python objects and numpy arrays, but not those of
+torch tensors.
+
+Usage (from the root of the repository)::
+
+    python -m benchmarks.components --output components.json
+    python -m benchmarks.components --baseline components.json transform.volume
+"""
+import argparse
+import os
+import tempfile
+import time
+import traceback
+import tracemalloc
+
+import numpy as np
+import torch
+
+from . import utils
+
+IMAGE_SHAPE = (512, 512)
+VOLUME_SHAPE = (64, 128, 128)
+WINDOW_SIZE = [16, 64, 64]
+STRIDE = [8, 32, 32]
+
+# Name: function that takes a working directory and returns the callable to benchmark
+BENCHMARKS = {}
+
+
+def register(name):
+    def decorator(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return decorator
+
+
+def _random_state():
+    return np.random.RandomState(42)
+
+
+def _image():
+    return _random_state().rand(*IMAGE_SHAPE).astype('float32')
+
+
+def _label_image(num_classes=5):
+    return _random_state().randint(0, num_classes, size=IMAGE_SHAPE).astype('int64')
+
+
+def _volume():
+    return _random_state().rand(*VOLUME_SHAPE).astype('float32')
+
+
+def _segmentation(shape, num_segments=50):
+    # Blocky segmentation (like a supervoxel over-segmentation)
+    coarse = _random_state().randint(1, num_segments, size=[size // 8 for size in shape])
+    for axis in range(len(shape)):
+        coarse = np.repeat(coarse, 8, axis=axis)
+    return coarse.astype('int64')
+
+
+# ---------------------------------------------------------------------------------------
+# Transforms
+# ---------------------------------------------------------------------------------------
+
+def _register_transform(name, build_transform, build_inputs):
+    def setup(_):
+        transform = build_transform()
+        inputs = build_inputs()
+        return lambda: transform(*inputs)
+    register(name)(setup)
+
+
+def _register_image_transforms():
+    from inferno.io.transform import image as image_transforms
+    from PIL import Image
+
+    def image():
+        return _image(),
+
+    def label():
+        return _label_image(),
+
+    def binary_image():
+        return (_image() > 0.5).astype('float32'),
+
+    def image_and_label():
+        return _image()[None], _label_image()[None]
+
+    for name, build_transform, build_inputs in [
+            ('AdditiveGaussianNoise',
+             lambda: image_transforms.AdditiveGaussianNoise(sigma=0.1), image),
+            ('BinaryMorphology',
+             lambda: image_transforms.BinaryMorphology(mode='dilate'), binary_image),
+            ('BinaryDilation', lambda: image_transforms.BinaryDilation(), binary_image),
+            ('BinaryErosion', lambda: image_transforms.BinaryErosion(), binary_image),
+            ('CenterCrop', lambda: image_transforms.CenterCrop(size=256), image),
+            ('ElasticTransform',
+             lambda: image_transforms.ElasticTransform(alpha=2000., sigma=50.), image),
+            ('FineRandomRotations',
+             lambda: image_transforms.FineRandomRotations(angle_range=30), image_and_label),
+            ('PILImage2NumPyArray', lambda: image_transforms.PILImage2NumPyArray(),
+             lambda: (Image.fromarray((_image() * 255).astype('uint8')),)),
+            ('RandomCrop',
+             lambda: image_transforms.RandomCrop(output_image_shape=(256, 256)), image),
+            ('RandomFlip', lambda: image_transforms.RandomFlip(), image),
+            ('RandomGammaCorrection', lambda: image_transforms.RandomGammaCorrection(),
+             image),
+            ('RandomRotate', lambda: image_transforms.RandomRotate(), image),
+            ('RandomScaleSegmentation',
+             lambda: image_transforms.RandomScaleSegmentation(scale_range=(0.8, 1.2)),
+             image_and_label),
+            ('RandomSizedCrop',
+             lambda: image_transforms.RandomSizedCrop(ratio_between=(0.5, 1.)), image),
+            ('RandomTranspose', lambda: image_transforms.RandomTranspose(), image),
+            ('Scale', lambda: image_transforms.Scale(output_image_shape=(256, 256)), image),
+            ('Scale.label',
+             lambda: image_transforms.Scale(output_image_shape=(256, 256),
+                                            interpolation_order=0), label)]:
+        _register_transform('transform.image.{}'.format(name), build_transform, build_inputs)
+
+
+def _register_volume_transforms():
+    from inferno.io.transform import volume as volume_transforms
+
+    def volume():
+        return _volume(),
+
+    for name, build_transform, build_inputs in [
+            ('AdditiveNoise', lambda: volume_transforms.AdditiveNoise(sigma=0.1), volume),
+            ('AdditiveRandomNoise3D',
+             lambda: volume_transforms.AdditiveRandomNoise3D(shape=VOLUME_SHAPE, std=0.1),
+             volume),
+            ('CentralSlice', lambda: volume_transforms.CentralSlice(), volume),
+            ('RandomFlip3D', lambda: volume_transforms.RandomFlip3D(), volume),
+            ('RandomRot3D', lambda: volume_transforms.RandomRot3D(rot_range=30, p=1.),
+             volume),
+            ('Slices2Channels', lambda: volume_transforms.Slices2Channels(num_channels=5),
+             lambda: (_volume()[:5], _volume()[:5])),
+            ('VolumeAsymmetricCrop',
+             lambda: volume_transforms.VolumeAsymmetricCrop(crop_left=(4, 16, 16),
+                                                            crop_right=(4, 16, 16)),
+             volume),
+            ('VolumeCenterCrop',
+             lambda: volume_transforms.VolumeCenterCrop(size=(32, 64, 64)), volume)]:
+        _register_transform('transform.volume.{}'.format(name), build_transform, build_inputs)
+
+
+def _register_generic_transforms():
+    from inferno.io.transform import generic as generic_transforms
+
+    def image():
+        return _image(),
+
+    def label():
+        return _label_image(),
+
+    for name, build_transform, build_inputs in [
+            ('AsTorchBatch', lambda: generic_transforms.AsTorchBatch(dimensionality=2), image),
+            ('Cast', lambda: generic_transforms.Cast('double'), image),
+            ('Label2OneHot', lambda: generic_transforms.Label2OneHot(num_classes=5), label),
+            ('Normalize', lambda: generic_transforms.Normalize(), image),
+            ('NormalizeRange', lambda: generic_transforms.NormalizeRange(), image),
+            ('Project',
+             lambda: generic_transforms.Project(projection={0: 1, 1: 0, 2: 3, 3: 2}), label)]:
+        _register_transform('transform.generic.{}'.format(name), build_transform,
+                            build_inputs)
+
+
+_register_image_transforms()
+_register_volume_transforms()
+_register_generic_transforms()
+
+
+# ---------------------------------------------------------------------------------------
+# Volume loaders
+# ---------------------------------------------------------------------------------------
+
+def _indexer(dataset):
+    """Returns a callable that fetches the next item of `dataset` (round robin)."""
+    state = {'index': 0}
+
+    def fetch():
+        item = dataset[state['index']]
+        state['index'] = (state['index'] + 1) % len(dataset)
+        return item
+    return fetch
+
+
+@register('loader.VolumeLoader')
+def volume_loader(_):
+    from inferno.io.volumetric import VolumeLoader
+    return _indexer(VolumeLoader(_volume(), window_size=WINDOW_SIZE, stride=STRIDE))
+
+
+@register('loader.VolumeLoader.padded')
+def padded_volume_loader(_):
+    from inferno.io.volumetric import VolumeLoader
+    return _indexer(VolumeLoader(_volume(), window_size=WINDOW_SIZE, stride=STRIDE,
+                                 padding=[[4, 4], [16, 16], [16, 16]]))
+
+
+@register('loader.LazyHDF5VolumeLoader')
+def lazy_hdf5_volume_loader(directory):
+    import h5py
+    from inferno.io.volumetric import LazyHDF5VolumeLoader
+    path = os.path.join(directory, 'volume.h5')
+    with h5py.File(path, 'w') as f:
+        f.create_dataset('data', data=_volume(), chunks=(8, 32, 32))
+    return _indexer(LazyHDF5VolumeLoader(path, 'data', window_size=WINDOW_SIZE,
+                                         stride=STRIDE))
+
+
+# ---------------------------------------------------------------------------------------
+# Dataset containers
+# ---------------------------------------------------------------------------------------
+
+def _volume_loaders(num_loaders):
+    from inferno.io.volumetric import VolumeLoader
+    return [VolumeLoader(_volume(), window_size=WINDOW_SIZE, stride=STRIDE)
+            for _ in range(num_loaders)]
+
+
+@register('core.Zip')
+def zip_(_):
+    from inferno.io.core import Zip
+    return _indexer(Zip(*_volume_loaders(2), sync=True))
+
+
+@register('core.ZipReject')
+def zip_reject(_):
+    from inferno.io.core import ZipReject
+    # Rejects about half the windows
+    return _indexer(ZipReject(*_volume_loaders(2), sync=True,
+                              rejection_dataset_indices=0,
+                              rejection_criterion=lambda window: window.mean() < 0.5))
+
+
+@register('core.Concatenate')
+def concatenate(_):
+    from inferno.io.core import Concatenate
+    return _indexer(Concatenate(*_volume_loaders(3)))
+
+
+# ---------------------------------------------------------------------------------------
+# Metrics
+# ---------------------------------------------------------------------------------------
+
+def _segmentation_pair(batch_size, shape):
+    target = np.stack([_segmentation(shape)] * batch_size)
+    # Merge some segments and split others
+    prediction = np.where(target % 7 == 0, 1, target)
+    prediction[..., :shape[-1] // 2] += 1000
+    return (torch.from_numpy(prediction)[:, None],
+            torch.from_numpy(target)[:, None])
+
+
+@register('metric.ArandScore.2d')
+def arand_score_2d(_):
+    from inferno.extensions.metrics import ArandScore
+    prediction, target = _segmentation_pair(4, IMAGE_SHAPE)
+    metric = ArandScore()
+    return lambda: metric(prediction, target)
+
+
+@register('metric.ArandScore.3d')
+def arand_score_3d(_):
+    from inferno.extensions.metrics import ArandScore
+    prediction, target = _segmentation_pair(1, VOLUME_SHAPE)
+    metric = ArandScore(average_slices=False)
+    return lambda: metric(prediction, target)
+
+
+@register('metric.VoiScore')
+def voi_score(_):
+    from inferno.extensions.metrics.voi import VoiScore
+    prediction, target = _segmentation_pair(1, VOLUME_SHAPE)
+    metric = VoiScore()
+    return lambda: metric(prediction, target)
+
+
+@register('metric.IOU')
+def iou(_):
+    from inferno.extensions.metrics import IOU
+    prediction = torch.rand(4, 5, *IMAGE_SHAPE)
+    target = torch.from_numpy(np.stack([_label_image()] * 4))
+    metric = IOU()
+    return lambda: metric(prediction, target)
+
+
+# ---------------------------------------------------------------------------------------
+# Criteria
+# ---------------------------------------------------------------------------------------
+
+def _register_dice(name, criterion_class, **criterion_kwargs):
+    def setup(_):
+        prediction = torch.rand(2, 5, *VOLUME_SHAPE[1:], requires_grad=True)
+        target = (torch.rand(2, 5, *VOLUME_SHAPE[1:]) > 0.5).float()
+        criterion = criterion_class(**criterion_kwargs)
+
+        def forward_and_backward():
+            criterion(prediction, target).backward()
+            prediction.grad = None
+        return forward_and_backward
+    register(name)(setup)
+
+
+def _register_dice_criteria():
+    from inferno.extensions.criteria import SorensenDiceLoss, GeneralizedDiceLoss
+    _register_dice('criterion.SorensenDiceLoss', SorensenDiceLoss)
+    _register_dice('criterion.SorensenDiceLoss.global', SorensenDiceLoss, channelwise=False)
+    _register_dice('criterion.GeneralizedDiceLoss', GeneralizedDiceLoss)
+    _register_dice('criterion.GeneralizedDiceLoss.channelwise', GeneralizedDiceLoss,
+                   channelwise=True)
+
+
+_register_dice_criteria()
+
+
+# ---------------------------------------------------------------------------------------
+# Harness
+# ---------------------------------------------------------------------------------------
+
+def measure(function, min_time=0.2, repeats=3):
+    """Times `function` and traces the memory it allocates (see module docstring)."""
+    # Warm up (and fail early)
+    function()
+    best_ops_per_second = 0.
+    num_calls = 0
+    for _ in range(repeats):
+        calls_in_repeat = 0
+        tic = time.perf_counter()
+        while True:
+            function()
+            calls_in_repeat += 1
+            elapsed = time.perf_counter() - tic
+            if elapsed >= min_time:
+                break
+        num_calls += calls_in_repeat
+        best_ops_per_second = max(best_ops_per_second, calls_in_repeat / elapsed)
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        allocated_before, _ = tracemalloc.get_traced_memory()
+        result = function()
+        allocated_after, peak = tracemalloc.get_traced_memory()
+        del result
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return {'ops_per_second': best_ops_per_second,
+            'seconds_per_op': 1. / best_ops_per_second,
+            'num_calls': num_calls,
+            'peak_allocated_bytes': peak - allocated_before,
+            'retained_bytes': allocated_after - allocated_before}
+
+
+def run_benchmark(name, directory, min_time=0.2, repeats=3):
+    """Sets up and runs the benchmark `name` (in this process)."""
+    np.random.seed(42)
+    torch.manual_seed(42)
+    return measure(BENCHMARKS[name](directory), min_time=min_time, repeats=repeats)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="Minimum time (in seconds) to run every benchmark for, per "
+                             "repeat (default: %(default)s).")
+    parser.add_argument('--repeats', type=int, default=3,
+                        help="Number of repeats (default: %(default)s).")
+    utils.add_report_arguments(parser, 'ops_per_second')
+    args = parser.parse_args(argv)
+    names = utils.select(sorted(BENCHMARKS), args.benchmarks)
+    if args.list:
+        print('\n'.join(names))
+        return
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for name in names:
+            try:
+                results[name] = result = run_benchmark(name, directory,
+                                                       min_time=args.min_time,
+                                                       repeats=args.repeats)
+            except Exception:
+                results[name] = {'error': traceback.format_exc()}
+                print("{:<48} failed".format(name))
+                continue
+            print("{:<48} {:12.1f} ops/s {:12.3f} ms/op {:10.2f} MiB peak allocated"
+                  .format(name, result['ops_per_second'], 1e3 * result['seconds_per_op'],
+                          result['peak_allocated_bytes'] / 1024 ** 2))
+    utils.finish(args, results, 'ops_per_second',
+                 min_time=args.min_time, repeats=args.repeats,
+                 image_shape=IMAGE_SHAPE, volume_shape=VOLUME_SHAPE)
+
+
+if __name__ == '__main__':
+    main()
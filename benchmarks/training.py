@@ -0,0 +1,178 @@
+"""
+End-to-end training benchmarks.
+
+Every benchmark fits a stock model with `Trainer.fit` on synthetic data, on the CPU, in a
+fresh process, and measures:
+
+    * time_to_first_iteration: seconds from calling `fit` to the end of the first
+      iteration (includes starting the loaders and the first forward/backward pass).
+    * iterations_per_second and samples_per_second: throughput after the warm-up
+      iterations.
+    * peak_rss_mib: peak resident memory of the process.
+
+Usage (from the root of the repository)::
+
+    python -m benchmarks.training --output results.json
+    python -m benchmarks.training --baseline baseline.json --threshold 0.1
+    python -m benchmarks.training unet2d resunet3d
+
+The second command exits with status 1 if `samples_per_second` of any benchmark dropped
+by more than 10% compared to the baseline.
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from inferno.trainers.basic import Trainer
+from inferno.trainers.callbacks.base import Callback
+
+from . import utils
+
+# Name: (model, dimensionality)
+BENCHMARKS = {'unet2d': ('unet', 2),
+              'unet3d': ('unet', 3),
+              'resunet2d': ('resunet', 2),
+              'resunet3d': ('resunet', 3),
+              'graph2d': ('graph', 2),
+              'graph3d': ('graph', 3)}
+NUM_CLASSES = 2
+
+
+class IterationClock(Callback):
+    """Records the (wall) time at the end of every training iteration."""
+    def __init__(self):
+        super(IterationClock, self).__init__()
+        self.times = []
+
+    def end_of_training_iteration(self, **_):
+        self.times.append(time.perf_counter())
+
+
+def build_model(model_name, dim, initial_features=8):
+    if model_name == 'unet':
+        from inferno.extensions.models import UNet
+        return UNet(in_channels=1, out_channels=NUM_CLASSES, dim=dim, depth=2,
+                    initial_features=initial_features)
+    elif model_name == 'resunet':
+        from inferno.extensions.models import ResBlockUNet
+        return nn.Sequential(
+            nn.Conv2d(1, initial_features, 3, padding=1) if dim == 2 else
+            nn.Conv3d(1, initial_features, 3, padding=1),
+            ResBlockUNet(in_channels=initial_features, dim=dim, out_channels=NUM_CLASSES,
+                         unet_kwargs=dict(depth=2)))
+    elif model_name == 'graph':
+        from inferno.extensions.containers.graph import Graph
+        from inferno.extensions.layers import ConvELU2D, ConvELU3D, Conv2D, Conv3D, Cat
+        conv_elu, conv = (ConvELU2D, Conv2D) if dim == 2 else (ConvELU3D, Conv3D)
+        return Graph()\
+            .add_input_node('input')\
+            .add_node('conv0', conv_elu(1, initial_features, 3), previous='input')\
+            .add_node('conv1_0', conv_elu(initial_features, initial_features, 3),
+                      previous='conv0')\
+            .add_node('conv1_1', conv_elu(initial_features, initial_features, 5),
+                      previous='conv0')\
+            .add_node('cat', Cat(), previous=['conv1_0', 'conv1_1'])\
+            .add_node('conv2', conv(2 * initial_features, NUM_CLASSES, 1), previous='cat')\
+            .add_output_node('output', previous='conv2')
+    else:
+        raise ValueError("Unknown model: {}".format(model_name))
+
+
+def build_loader(dim, batch_size, num_workers):
+    if dim == 2:
+        # 2D data is generated on the fly
+        from inferno.io.box.binary_blobs import BinaryBlobs
+        dataset = BinaryBlobs(size=64, length=64, n_dim=2)
+    else:
+        # 3D data comes from (in-memory) volumes
+        from inferno.io.core import Zip
+        from inferno.io.volumetric import VolumeLoader
+        from inferno.io.transform.generic import AsTorchBatch
+        random_state = np.random.RandomState(42)
+        raw = random_state.rand(32, 96, 96).astype('float32')
+        labels = (raw > 0.5).astype('int64')
+        slicing_config = dict(window_size=[16, 32, 32], stride=[8, 16, 16])
+        dataset = Zip(VolumeLoader(raw, transforms=AsTorchBatch(3), **slicing_config),
+                      VolumeLoader(labels, **slicing_config),
+                      sync=True)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=num_workers)
+
+
+def run_benchmark(name, num_iterations=20, num_warmup_iterations=3, batch_size=2,
+                  num_workers=0, num_threads=None):
+    """Runs the benchmark `name` (in this process) and returns the measurements."""
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    torch.manual_seed(42)
+    np.random.seed(42)
+    model_name, dim = BENCHMARKS[name]
+    clock = IterationClock()
+    trainer = Trainer(build_model(model_name, dim))\
+        .build_criterion('CrossEntropyLoss')\
+        .build_optimizer('Adam')\
+        .bind_loader('train', build_loader(dim, batch_size, num_workers))\
+        .set_max_num_iterations(num_warmup_iterations + num_iterations)\
+        .register_callback(clock)
+    trainer.quiet()
+    trainer.console.toggle_info(False)
+    started_at = time.perf_counter()
+    trainer.fit()
+    # The clock starts with the last warm-up iteration
+    timed = clock.times[num_warmup_iterations - 1:] if num_warmup_iterations > 0 \
+        else [started_at] + clock.times
+    iterations_per_second = (len(timed) - 1) / (timed[-1] - timed[0])
+    return {'model': model_name,
+            'dim': dim,
+            'batch_size': batch_size,
+            'num_iterations': num_iterations,
+            'time_to_first_iteration': clock.times[0] - started_at,
+            'iterations_per_second': iterations_per_second,
+            'samples_per_second': iterations_per_second * batch_size,
+            'peak_rss_mib': utils.peak_rss_mib()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20,
+                        help="Number of timed iterations (default: %(default)s).")
+    parser.add_argument('--warmup', type=int, default=3,
+                        help="Number of warm-up iterations (default: %(default)s).")
+    parser.add_argument('--batch-size', type=int, default=2,
+                        help="Batch size (default: %(default)s).")
+    parser.add_argument('--num-workers', type=int, default=0,
+                        help="Number of loader workers (default: %(default)s).")
+    utils.add_report_arguments(parser, 'samples_per_second')
+    args = parser.parse_args(argv)
+    names = utils.select(list(BENCHMARKS), args.benchmarks)
+    if args.list:
+        print('\n'.join(names))
+        return
+    results = {}
+    for name in names:
+        outcome = utils.run_isolated(run_benchmark, name,
+                                     num_iterations=args.iterations,
+                                     num_warmup_iterations=args.warmup,
+                                     batch_size=args.batch_size,
+                                     num_workers=args.num_workers,
+                                     num_threads=args.num_threads)
+        if outcome['error'] is not None:
+            results[name] = {'error': outcome['error']}
+            print("{:<12} failed".format(name))
+            continue
+        results[name] = result = outcome['result']
+        print("{:<12} {:8.2f} it/s {:8.2f} samples/s {:8.2f} s to first iteration "
+              "{:8.1f} MiB peak RSS"
+              .format(name, result['iterations_per_second'], result['samples_per_second'],
+                      result['time_to_first_iteration'], result['peak_rss_mib']))
+    utils.finish(args, results, 'samples_per_second',
+                 iterations=args.iterations, warmup=args.warmup,
+                 batch_size=args.batch_size, num_workers=args.num_workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""Utilities shared by the benchmark suites."""
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+import traceback
+from datetime import datetime
+
+import torch
+
+import inferno
+
+
+def peak_rss_mib():
+    """Peak resident set size of this process (in MiB), as reported by the kernel."""
+    # ru_maxrss is in KiB on Linux (and in bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+
+
+def _call_and_report(function, args, kwargs):
+    try:
+        return {'result': function(*args, **kwargs), 'error': None}
+    except Exception:
+        return {'result': None, 'error': traceback.format_exc()}
+
+
+def run_isolated(function, *args, **kwargs):
+    """
+    Calls `function` in a fresh (spawned) process, such that measurements like the peak
+    RSS are not polluted by whatever ran before. `function` must be importable.
+
+    Returns
+    -------
+    dict
+        With keys 'result' (what `function` returned) and 'error' (the traceback, if
+        `function` raised).
+    """
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        return pool.apply(_call_and_report, (function, args, kwargs))
+
+
+def environment():
+    """Describes the machine and software the benchmarks ran with."""
+    return {'date': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'torch': torch.__version__,
+            'torch_num_threads': torch.get_num_threads(),
+            'inferno': inferno.__version__}
+
+
+def write_report(path, results, **meta):
+    """Writes `results` (a dictionary mapping benchmark names to results) as JSON."""
+    report = {'environment': environment(), 'meta': meta, 'results': results}
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+
+def read_report(path):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def find_regressions(results, baseline_results, metric, threshold, higher_is_better=True):
+    """
+    Compares `results` against `baseline_results` (both dictionaries mapping benchmark
+    names to results).
+
+    A benchmark regressed if its `metric` is worse than the baseline by more than the
+    fraction `threshold`, or if it failed while it succeeded in the baseline.
+    Benchmarks that are not in the baseline are not compared.
+
+    Returns
+    -------
+    list
+        Tuples of (name, baseline value, value) of the benchmarks that regressed. The
+        value is None if the benchmark failed.
+    """
+    regressions = []
+    for name, baseline_result in sorted(baseline_results.items()):
+        baseline_value = baseline_result.get(metric)
+        if name not in results or baseline_value is None:
+            continue
+        value = results[name].get(metric)
+        if value is None:
+            regressions.append((name, baseline_value, None))
+        elif higher_is_better and value < (1 - threshold) * baseline_value:
+            regressions.append((name, baseline_value, value))
+        elif not higher_is_better and value > (1 + threshold) * baseline_value:
+            regressions.append((name, baseline_value, value))
+    return regressions
+
+
+def add_report_arguments(parser, default_metric):
+    parser.add_argument('--output', default=None,
+                        help="Path of the JSON report to write.")
+    parser.add_argument('--baseline', default=None,
+                        help="Path of a JSON report to compare against.")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Fraction by which '{}' may regress before the comparison "
+                             "against the baseline fails (default: %(default)s)."
+                        .format(default_metric))
+    parser.add_argument('--num-threads', type=int, default=None,
+                        help="Number of threads torch may use (default: torch's choice).")
+    parser.add_argument('--list', action='store_true',
+                        help="List the benchmarks and exit.")
+    parser.add_argument('benchmarks', nargs='*',
+                        help="Names of the benchmarks to run, or prefixes up to a dot "
+                             "(e.g. 'transform.image'). Default: all.")
+    return parser
+
+
+def select(available, names):
+    """Selects the benchmarks in `available` that are named in (or start with) `names`."""
+    def matches(benchmark, name):
+        return benchmark == name or benchmark.startswith(name + '.')
+    unknown = sorted(name for name in names
+                     if not any(matches(benchmark, name) for benchmark in available))
+    if unknown:
+        raise SystemExit("Unknown benchmark(s): {}. Available: {}."
+                         .format(', '.join(unknown), ', '.join(available)))
+    return [benchmark for benchmark in available
+            if not names or any(matches(benchmark, name) for name in names)]
+
+
+def finish(args, results, metric, **meta):
+    """Writes the report and compares against the baseline; exits with 1 on regressions."""
+    if args.output is not None:
+        write_report(args.output, results, **meta)
+        print("Wrote report to {}.".format(args.output))
+    failed = sorted(name for name, result in results.items() if result.get('error'))
+    for name in failed:
+        print("\n[!] Benchmark '{}' failed:\n{}".format(name, results[name]['error']))
+    if args.baseline is None:
+        return
+    regressions = find_regressions(results, read_report(args.baseline)['results'],
+                                   metric, args.threshold)
+    if not regressions:
+        print("No regressions of '{}' by more than {:.0%}.".format(metric, args.threshold))
+        return
+    for name, baseline_value, value in regressions:
+        if value is None:
+            print("[!] {}: failed (baseline {}: {:.4g})".format(name, metric, baseline_value))
+        else:
+            print("[!] {}: {} regressed from {:.4g} to {:.4g} ({:+.1%})"
+                  .format(name, metric, baseline_value, value,
+                          value / baseline_value - 1))
+    raise SystemExit(1)
+
+
+class Stopwatch(object):
+    """Context manager measuring the wall time of its body (in `elapsed`)."""
+    def __enter__(self):
+        self.elapsed = None
+        self._tic = time.perf_counter()
+        return self
+
+    def __exit__(self, *_):
+        self.elapsed = time.perf_counter() - self._tic
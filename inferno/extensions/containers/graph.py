@@ -1,12 +1,16 @@
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import ExitStack
+from functools import wraps
 import sys
 import threading
 import multiprocessing as mp
 import copy
-import gc
+import time
 
 import networkx as nx
 from networkx import is_directed_acyclic_graph, topological_sort
+import torch
 from torch import nn as nn
 
 from ...utils import python_utils as pyu
@@ -18,12 +22,25 @@ __all__ = ['NNGraph', 'Graph']
 
 
 class NNGraph(nx.DiGraph):
-    """A NetworkX DiGraph, except that node and edge ordering matters."""
+    """
+    A NetworkX DiGraph, except that node and edge ordering matters, and that it keeps
+    count of the changes to its topology (see `version`).
+    """
     # We don't copy torch tensors, only to have them deleted.
     ATTRIBUTES_TO_NOT_COPY = {'payload'}
+    # Methods that change the topology of the graph, and bump its version
+    TOPOLOGY_MUTATORS = ['add_node', 'add_nodes_from', 'remove_node', 'remove_nodes_from',
+                         'add_edge', 'add_edges_from', 'remove_edge', 'remove_edges_from',
+                         'clear']
     node_dict_factory = OrderedDict
     adjlist_dict_factory = OrderedDict
 
+    @property
+    def version(self):
+        """Counter that's bumped whenever the topology of the graph is changed."""
+        # Graphs pickled by older versions (or under construction) have no version yet
+        return getattr(self, '_version', 0)
+
     def copy(self, **init_kwargs):
         new = type(self)(**init_kwargs)
         # Remove all attributes and copy only the graph structure
@@ -48,6 +65,97 @@ class NNGraph(nx.DiGraph):
         return new
 
 
+def _bumps_version(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self._version = self.version + 1
+        return result
+    return wrapper
+
+
+for _name in NNGraph.TOPOLOGY_MUTATORS:
+    setattr(NNGraph, _name, _bumps_version(getattr(nx.DiGraph, _name)))
+
+
+class ExecutionPlan(object):
+    """
+    The order in which a `Graph` evaluates its nodes, compiled from the topology of the graph.
+
+    Only the nodes that the given output nodes depend on are evaluated. Payloads live in a
+    flat list of slots, one per edge. Every slot is read by exactly one node (the target of
+    the edge), so it's released as soon as that node has read it. Slots of edges into nodes
+    that are not evaluated (e.g. sinks) are not written at all.
+    """
+    def __init__(self, graph, input_nodes, output_nodes):
+        edges = list(graph.edges())
+        slot_of_edge = {edge: slot for slot, edge in enumerate(edges)}
+        evaluated = set(input_nodes)
+        for name in output_nodes:
+            evaluated.update(nx.ancestors(graph, name))
+
+        def output_slots(name):
+            # Outputs sent to nodes that are not evaluated are dropped right away
+            return [slot_of_edge[edge] if edge[1] in evaluated or edge[1] in output_nodes
+                    else None
+                    for edge in graph.out_edges(name)]
+
+        self.num_slots = len(edges)
+        self.input_nodes = list(input_nodes)
+        self.output_nodes = list(output_nodes)
+        # Input nodes get their input from the arguments to forward
+        self.input_steps = [(name, output_slots(name)) for name in input_nodes]
+        self.steps = [(name,
+                       [slot_of_edge[edge] for edge in graph.in_edges(name)],
+                       output_slots(name))
+                      for name in topological_sort(graph)
+                      if name in evaluated and name not in input_nodes]
+        self.output_slots = [[slot_of_edge[edge] for edge in graph.in_edges(name)]
+                             for name in output_nodes]
+        # Dependencies between the steps, for evaluating independent nodes concurrently
+        producers = {slot: index
+                     for index, (_, _, slots) in enumerate(self.steps)
+                     for slot in slots if slot is not None}
+        self.dependencies = [sorted({producers[slot] for slot in input_slots
+                                     if slot in producers})
+                             for _, input_slots, _ in self.steps]
+        self.consumers = [[] for _ in self.steps]
+        for index, dependencies in enumerate(self.dependencies):
+            for dependency in dependencies:
+                self.consumers[dependency].append(index)
+        # Nodes at the same depth don't depend on each other
+        depths = []
+        for dependencies in self.dependencies:
+            depths.append(max([depths[dependency] + 1 for dependency in dependencies],
+                              default=0))
+        self.width = max([depths.count(depth) for depth in set(depths)], default=0)
+
+    def __len__(self):
+        return len(self.input_steps) + len(self.steps)
+
+
+# CUDA streams of the threads evaluating nodes concurrently, by device
+_thread_local = threading.local()
+
+
+def _stream_for(device):
+    streams = getattr(_thread_local, 'streams', None)
+    if streams is None:
+        streams = _thread_local.streams = {}
+    if device not in streams:
+        streams[device] = torch.cuda.Stream(device=device)
+    return streams[device]
+
+
+def _autocast_state(device_type):
+    try:
+        return torch.is_autocast_enabled(device_type), torch.get_autocast_dtype(device_type)
+    except (TypeError, AttributeError):
+        # torch < 2.4
+        if device_type == 'cpu':
+            return torch.is_autocast_cpu_enabled(), torch.get_autocast_cpu_dtype()
+        return torch.is_autocast_enabled(), torch.get_autocast_gpu_dtype()
+
 
 class Graph(nn.Module):
     """
@@ -94,6 +202,13 @@ class Graph(nn.Module):
         self._thread_to_graph_mapping = {}
         self._creator_thread = threading.get_ident()
         self._creator_pid = mp.current_process().pid
+        self._execution_plans = {}
+        self._execution_plans_fingerprint = None
+        self._selected_outputs = None
+        self._num_threads = 0
+        self._executor = None
+        self._executor_num_threads = None
+        self._concurrency_stats = None
         # Publics
         if graph is not None:
             self.graph = graph
@@ -118,6 +233,194 @@ class Graph(nn.Module):
     def graph(self, value):
         assert_(isinstance(value, NNGraph), exception_type=TypeError)
         self._thread_to_graph_mapping.update({threading.get_ident(): value})
+        self.invalidate_execution_plan()
+
+    @property
+    def execution_plan(self):
+        """
+        The (cached) `ExecutionPlan` used by the forward method for the selected outputs
+        (see `select_outputs`). It's compiled on first use after the topology of the graph
+        has changed (see `invalidate_execution_plan`).
+        """
+        return self.get_execution_plan()
+
+    def get_execution_plan(self, outputs=None):
+        """
+        Gets the (cached) `ExecutionPlan` computing the output nodes `outputs`.
+
+        Parameters
+        ----------
+        outputs : str or list of str
+            (List of) name(s) of the output nodes to compute. Defaults to the selected
+            outputs (see `select_outputs`).
+
+        Returns
+        -------
+        ExecutionPlan
+        """
+        outputs = self._selected_outputs if outputs is None \
+            else tuple(pyu.to_iterable(outputs))
+        plan = self._get_cached_execution_plans().get(outputs)
+        if plan is None:
+            plan = self.compile_execution_plan(outputs)
+        return plan
+
+    def compile_execution_plan(self, outputs=None):
+        """
+        Validates the graph and compiles the `ExecutionPlan` computing the output nodes
+        `outputs` (all output nodes by default).
+
+        Returns
+        -------
+        ExecutionPlan
+        """
+        self.assert_graph_is_valid()
+        output_nodes = self.output_nodes
+        outputs = None if outputs is None else tuple(pyu.to_iterable(outputs))
+        for name in outputs or ():
+            assert_(name in output_nodes,
+                    "'{}' is not an output node (output nodes are {})."
+                    .format(name, output_nodes),
+                    ValueError)
+        plan = ExecutionPlan(self.graph, self.input_nodes,
+                             output_nodes if outputs is None else outputs)
+        self._get_cached_execution_plans()[outputs] = plan
+        return plan
+
+    def invalidate_execution_plan(self):
+        """
+        Discards the cached `ExecutionPlan`s. This is done automatically by the methods
+        that change the graph (including `apply_on_graph`), and the plans are discarded
+        as well when the topology of the internal graph is changed through the methods of
+        `NNGraph`. Only changes made by writing to the dictionaries of the internal graph
+        directly need to be followed by calling this method.
+
+        Returns
+        -------
+        Graph
+            self
+        """
+        self._execution_plans = {}
+        self._execution_plans_fingerprint = None
+        return self
+
+    def _get_graph_fingerprint(self):
+        # Cheap stand-in for the topology of the graph. It's taken from the graph of the
+        # creator thread, which the graphs of the other threads are copied from.
+        graph = self._thread_to_graph_mapping.get(self._creator_thread, self.graph)
+        return id(graph), graph.version, graph.number_of_nodes(), graph.number_of_edges()
+
+    def _get_cached_execution_plans(self):
+        # The cached plans are discarded if the graph changed since they were compiled
+        fingerprint = self._get_graph_fingerprint()
+        if fingerprint != self._execution_plans_fingerprint:
+            self._execution_plans = {}
+            self._execution_plans_fingerprint = fingerprint
+        return self._execution_plans
+
+    def select_outputs(self, names=None):
+        """
+        Selects the output nodes the forward method computes (and returns, in the given
+        order). Only the nodes these outputs depend on are evaluated, which saves
+        evaluating e.g. auxiliary heads at inference time.
+
+        Parameters
+        ----------
+        names : str or list of str
+            (List of) name(s) of output nodes. With None, all output nodes are computed.
+
+        Returns
+        -------
+        Graph
+            self
+        """
+        names = None if names is None else tuple(pyu.to_iterable(names))
+        if names is not None:
+            # Fails for unknown outputs
+            self.get_execution_plan(names)
+        self._selected_outputs = names
+        return self
+
+    @property
+    def selected_outputs(self):
+        """The output nodes selected with `select_outputs` (all output nodes by default)."""
+        return self.output_nodes if self._selected_outputs is None \
+            else list(self._selected_outputs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Thread pools can't be pickled (or copied), they're recreated on demand
+        state['_executor'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Graphs pickled by older versions lack the execution plan and concurrency settings
+        for key, default in [('_execution_plans', {}), ('_execution_plans_fingerprint', None),
+                             ('_selected_outputs', None),
+                             ('_num_threads', 0),
+                             ('_executor', None), ('_executor_num_threads', None),
+                             ('_concurrency_stats', None)]:
+            state.setdefault(key, default)
+        super(Graph, self).__setstate__(state)
+
+    def __del__(self):
+        # Stop the worker threads with the graph. Looked up in the instance dict, because
+        # __init__ might not have made it this far.
+        executor = self.__dict__.get('_executor')
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def set_concurrency(self, num_threads=None):
+        """
+        Sets the number of threads used to evaluate nodes that don't depend on each other
+        (e.g. parallel branches) concurrently. Torch releases the GIL in its operations, so
+        this speeds up graphs with parallel branches on the CPU. On CUDA, every thread
+        launches its kernels on its own stream. The results are identical to evaluating
+        the nodes one after another.
+
+        Parameters
+        ----------
+        num_threads : int
+            Number of threads. With 0, nodes are evaluated one after another in the
+            calling thread (the default). With None, uses as many threads as nodes can
+            run concurrently.
+
+        Returns
+        -------
+        Graph
+            self
+        """
+        assert_(num_threads is None or (isinstance(num_threads, int) and num_threads >= 0),
+                "`num_threads` must be None or a non-negative integer, got {}."
+                .format(num_threads),
+                ValueError)
+        self._num_threads = num_threads
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        return self
+
+    @property
+    def concurrency_stats(self):
+        """
+        Statistics of the last forward pass that evaluated nodes concurrently (or None),
+        as a dict with:
+
+            - 'num_threads': the number of threads.
+            - 'max_concurrent_nodes': the largest number of nodes that were evaluated
+              at the same time.
+            - 'parallelism': the total time spent evaluating nodes, divided by the
+              time it took to evaluate all of them, i.e. the achieved speedup.
+        """
+        return self._concurrency_stats
+
+    def _get_executor(self, num_threads):
+        if self._executor is None or self._executor_num_threads != num_threads:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+            self._executor = ThreadPoolExecutor(max_workers=num_threads)
+            self._executor_num_threads = num_threads
+        return self._executor
 
     def is_node_in_graph(self, name):
         """
@@ -255,6 +558,7 @@ class Graph(nn.Module):
         assert isinstance(module, nn.Module)
         self.add_module(name, module)
         self.graph.add_node(name)
+        self.invalidate_execution_plan()
         if previous is not None:
             for _previous in pyu.to_iterable(previous):
                 self.add_edge(_previous, name)
@@ -277,6 +581,7 @@ class Graph(nn.Module):
         """
         self.add_module(name, Identity())
         self.graph.add_node(name, is_input_node=True)
+        self.invalidate_execution_plan()
         return self
 
     def add_output_node(self, name, previous=None):
@@ -295,6 +600,7 @@ class Graph(nn.Module):
             self
         """
         self.graph.add_node(name, is_output_node=True)
+        self.invalidate_execution_plan()
         if previous is not None:
             for _previous in pyu.to_iterable(previous):
                 self.add_edge(_previous, name)
@@ -325,12 +631,16 @@ class Graph(nn.Module):
         assert self.is_node_in_graph(from_node)
         assert self.is_node_in_graph(to_node)
         self.graph.add_edge(from_node, to_node)
+        self.invalidate_execution_plan()
         assert self.graph_is_valid
         return self
 
     def apply_on_graph(self, function, *args, **kwargs):
-        """Applies a `function` on the internal graph."""
-        return function(self, *args, **kwargs)
+        """Applies a `function` on the internal graph, and discards the cached plans."""
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            self.invalidate_execution_plan()
 
     def get_module_for_nodes(self, names):
         """
@@ -411,19 +721,7 @@ class Graph(nn.Module):
             # Convert input to list
             input = [input]
         # Get outputs
-        try:
-            outputs = pyu.to_iterable(getattr(self, name)(*input))
-        except Exception as e:
-            input_spec_string = "\n".join(["--[{}]-{}-->[{}]".format(incoming,
-                                                                     tuple(_input.size()),
-                                                                     this)
-                                           for (incoming, this), _input in
-                                           zip(self.graph.in_edges(name), input)])
-
-            message = "In node '{}': {}\n" \
-                      "Inputs to this node were:\n{}"\
-                .format(name, str(e), input_spec_string)
-            raise type(e)(message).with_traceback(sys.exc_info()[2])
+        outputs = self._apply_node(name, input)
         # Distribute outputs to outgoing payloads if required
         if not self.is_sink_node(name):
             outgoing_edges = self.graph.out_edges(name)
@@ -438,41 +736,177 @@ class Graph(nn.Module):
                                                                               name)
             for (this, outgoing), output in zip(outgoing_edges, outputs):
                 self.graph[this][outgoing].update({'payload': output})
-        # Collect garbage to free some GPU memory?
-        del input
-        gc.collect()
         # Return outputs
         return pyu.from_iterable(outputs)
 
-    def forward(self, *inputs):
-        self.assert_graph_is_valid()
-        input_nodes = self.input_nodes
-        output_nodes = self.output_nodes
-        assert len(inputs) == len(input_nodes), "Was expecting {} " \
-                                                "arguments for as many input nodes, got {}."\
-            .format(len(input_nodes), len(inputs))
+    def _apply_node(self, name, input):
+        try:
+            return pyu.to_iterable(getattr(self, name)(*input))
+        except Exception as e:
+            input_spec_string = "\n".join(["--[{}]-{}-->[{}]".format(incoming,
+                                                                     tuple(_input.size()),
+                                                                     this)
+                                           for (incoming, this), _input in
+                                           zip(self.graph.in_edges(name), input)])
+
+            message = "In node '{}': {}\n" \
+                      "Inputs to this node were:\n{}"\
+                .format(name, str(e), input_spec_string)
+            raise type(e)(message).with_traceback(sys.exc_info()[2])
+
+    def _distribute_outputs(self, name, outputs, output_slots, slots):
+        if len(outputs) == 1:
+            # Support for replication
+            outputs *= len(output_slots)
+        # Make sure the number of outputs check out
+        assert len(outputs) == len(output_slots), \
+            "Number of outputs from the model ({}) does not match the number " \
+            "of out-edges ({}) in the graph for this node ('{}').".format(len(outputs),
+                                                                          len(output_slots),
+                                                                          name)
+        for slot, output in zip(output_slots, outputs):
+            if slot is not None:
+                slots[slot] = output
+
+    @staticmethod
+    def _take_inputs(input_slots, slots):
+        input = [slots[slot] for slot in input_slots]
+        # This node is the only consumer of its input slots, so release them
+        for slot in input_slots:
+            slots[slot] = None
+        return input
+
+    def _apply_node_in_thread(self, name, input, inference_mode, grad_enabled,
+                              autocast_states, device, wait_events):
+        # Inference mode, grad mode, autocast and the current stream are thread local
+        with ExitStack() as stack:
+            stack.enter_context(torch.inference_mode(inference_mode))
+            stack.enter_context(torch.set_grad_enabled(grad_enabled))
+            for device_type, dtype in autocast_states:
+                stack.enter_context(torch.autocast(device_type=device_type, dtype=dtype))
+            event = None
+            if device is not None:
+                stream = _stream_for(device)
+                for wait_event in wait_events:
+                    stream.wait_event(wait_event)
+                for _input in input:
+                    if torch.is_tensor(_input) and _input.is_cuda:
+                        # Tell the caching allocator that the input is in use on this stream
+                        _input.record_stream(stream)
+                stack.enter_context(torch.cuda.stream(stream))
+            start = time.perf_counter()
+            outputs = self._apply_node(name, input)
+            if device is not None:
+                event = torch.cuda.Event()
+                event.record(stream)
+            stop = time.perf_counter()
+        return outputs, event, start, stop
+
+    def _forward_concurrently(self, plan, slots, inputs):
+        num_threads = self._num_threads or plan.width
+        executor = self._get_executor(num_threads)
+        inference_mode = torch.is_inference_mode_enabled()
+        grad_enabled = torch.is_grad_enabled()
+        autocast_states = [(device_type, dtype)
+                           for device_type in ('cpu', 'cuda')
+                           for enabled, dtype in [_autocast_state(device_type)] if enabled]
+        device = next((input.device for input in inputs
+                       if torch.is_tensor(input) and input.is_cuda), None)
+        if device is not None:
+            # The streams of the threads must wait for the inputs
+            inputs_ready = torch.cuda.Event()
+            inputs_ready.record(torch.cuda.current_stream(device))
+        events = [None] * len(plan.steps)
+        intervals = []
+        remaining = [len(dependencies) for dependencies in plan.dependencies]
+        futures = {}
+
+        def submit(index):
+            name, input_slots, _ = plan.steps[index]
+            wait_events = [] if device is None else \
+                [inputs_ready] + [events[dependency]
+                                  for dependency in plan.dependencies[index]]
+            future = executor.submit(self._apply_node_in_thread, name,
+                                     self._take_inputs(input_slots, slots), inference_mode,
+                                     grad_enabled, autocast_states, device, wait_events)
+            futures[future] = index
+
+        begin = time.perf_counter()
+        try:
+            for index, num_dependencies in enumerate(remaining):
+                if num_dependencies == 0:
+                    submit(index)
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures.pop(future)
+                    outputs, events[index], start, stop = future.result()
+                    intervals.append((start, stop))
+                    name, _, output_slots = plan.steps[index]
+                    self._distribute_outputs(name, outputs, output_slots, slots)
+                    del outputs
+                    for consumer in plan.consumers[index]:
+                        remaining[consumer] -= 1
+                        if remaining[consumer] == 0:
+                            submit(consumer)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        end = time.perf_counter()
+        if device is not None:
+            current_stream = torch.cuda.current_stream(device)
+            for event in events:
+                current_stream.wait_event(event)
+        # Sweep over the intervals to find the largest number of overlapping ones
+        concurrent_nodes = max_concurrent_nodes = 0
+        for _, change in sorted([(start, 1) for start, _ in intervals] +
+                                [(stop, -1) for _, stop in intervals]):
+            concurrent_nodes += change
+            max_concurrent_nodes = max(max_concurrent_nodes, concurrent_nodes)
+        self._concurrency_stats = {
+            'num_threads': num_threads,
+            'max_concurrent_nodes': max_concurrent_nodes,
+            'parallelism': sum(stop - start for start, stop in intervals) /
+            max(end - begin, 1e-12)}
+
+    def forward(self, *inputs, outputs=None):
+        """
+        Evaluates the graph.
+
+        Parameters
+        ----------
+        inputs : torch.Tensor
+            One input per input node.
+        outputs : str or list of str
+            (List of) name(s) of the output nodes to compute, overriding the ones selected
+            with `select_outputs`. Only the nodes these outputs depend on are evaluated.
+
+        Returns
+        -------
+        torch.Tensor or list
+            The outputs.
+        """
+        plan = self.get_execution_plan(outputs)
+        assert len(inputs) == len(plan.input_nodes), "Was expecting {} " \
+                                                     "arguments for as many input nodes, " \
+                                                     "got {}.".format(len(plan.input_nodes),
+                                                                      len(inputs))
+        slots = [None] * plan.num_slots
         # Unpack inputs to input nodes
-        for input, input_node in zip(inputs, input_nodes):
-            self.forward_through_node(input_node, input=input)
-        # Toposort the graph
-        toposorted = topological_sort(self.graph)
-        # Remove all input and output nodes
-        toposorted = [name for name in toposorted
-                      if name not in input_nodes and name not in output_nodes]
-        # Since we'll be clearing payloads anyway, it makes no sense whatsoever
-        # to evaluate sink nodes
-        toposorted = [name for name in toposorted if not self.is_sink_node(name)]
+        for input, (input_node, output_slots) in zip(inputs, plan.input_steps):
+            self._distribute_outputs(input_node, self._apply_node(input_node, [input]),
+                                     output_slots, slots)
         # Forward
-        for node in toposorted:
-            self.forward_through_node(node)
+        if self._num_threads != 0 and plan.width > 1:
+            self._forward_concurrently(plan, slots, inputs)
+        else:
+            for node, input_slots, output_slots in plan.steps:
+                outputs = self._apply_node(node, self._take_inputs(input_slots, slots))
+                self._distribute_outputs(node, outputs, output_slots, slots)
+                del outputs
         # Read outputs from output nodes
-        outputs = []
-        for output_node in output_nodes:
-            # Get all incoming edges to output node
-            outputs_from_node = [self.graph[incoming][this]['payload']
-                                 for incoming, this in self.graph.in_edges(output_node)]
-            outputs.append(pyu.from_iterable(outputs_from_node))
-        # Clear payloads for next pass
-        self.clear_payloads()
+        outputs = [pyu.from_iterable([slots[slot] for slot in output_slots])
+                   for output_slots in plan.output_slots]
         # Done.
         return pyu.from_iterable(outputs)
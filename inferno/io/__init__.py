@@ -1,4 +1,5 @@
 from . import box
 from . import core
 from . import transform
-from . import volumetric
\ No newline at end of file
+from . import volumetric
+from . import sinks
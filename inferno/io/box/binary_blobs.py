@@ -1,6 +1,8 @@
 import torch.utils.data as data
 import skimage.data
+import skimage.transform
 import numpy
+from inspect import signature
 from operator import mul
 from functools import reduce
 
@@ -43,13 +45,15 @@ class BinaryBlobs(data.Dataset):
 
     def __getitem__(self, index):
 
-        # generate the labels
+        # generate the labels (newer versions of skimage call the seed `rng`)
+        seed_kwarg = 'seed' if 'seed' in signature(skimage.data.binary_blobs).parameters \
+            else 'rng'
         label = skimage.data.binary_blobs(
             length=self.length, 
             blob_size_fraction=self.blob_size_fraction, 
             n_dim=self.n_dim, 
             volume_fraction=self.volume_fraction,
-            seed=self.master_seed + index)
+            **{seed_kwarg: self.master_seed + index})
 
         # make the raw image [-1,1]
         image  = label.astype('float32')*2
@@ -5,6 +5,22 @@ from ...utils.exceptions import assert_
 from ...utils import python_utils as pyu
 
 
+class ZippedSequence(object):
+    """Like `list(zip(*sequences))`, except the items are fetched from `sequences` on demand."""
+    def __init__(self, *sequences):
+        self.sequences = sequences
+
+    def __len__(self):
+        return min([len(sequence) for sequence in self.sequences])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[_index] for _index in range(len(self))[index]]
+        # Raises an IndexError if out of range, and deals with negative indices
+        index = range(len(self))[index]
+        return tuple(sequence[index] for sequence in self.sequences)
+
+
 class Zip(SyncableDataset):
     """
     Zip two or more datasets to one dataset. If the datasets implement synchronization primitives,
@@ -29,7 +45,8 @@ class Zip(SyncableDataset):
             self.sync_datasets()
         # Inherit base sequence if sync'ing
         if self.sync and all([du.defines_base_sequence(dataset) for dataset in self.datasets]):
-            self.base_sequence = list(zip(*[dataset.base_sequence for dataset in self.datasets]))
+            self.base_sequence = ZippedSequence(*[dataset.base_sequence
+                                                  for dataset in self.datasets])
         else:
             self.base_sequence = None
 
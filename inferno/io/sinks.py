@@ -0,0 +1,205 @@
+"""
+Sinks for predictions.
+
+A sink consumes predictions batch by batch (see `Trainer.predict`): it's told how many
+samples to expect with `begin`, gets every batch with `write` (a tensor or array with
+the batch along the first axis) and is closed with `close`. Sinks are context managers.
+"""
+import numpy as np
+
+# try to load io libraries (h5py)
+try:
+    import h5py
+    WITH_H5PY = True
+except ImportError:
+    WITH_H5PY = False
+
+from ..utils import torch_utils as thu
+from ..utils.exceptions import assert_, ShapeError
+
+
+def _as_array(batch):
+    assert_(not isinstance(batch, (list, tuple)),
+            "This sink can only write a single tensor per batch, got a {} of {} instead. "
+            "Please use `postprocess` to select the tensor to write."
+            .format(type(batch).__name__, len(batch)),
+            TypeError)
+    return thu.unwrap(batch, as_numpy=True)
+
+
+class PredictionSink(object):
+    """Base class for sinks. Subclasses must implement `write`."""
+    def begin(self, num_samples=None):
+        """Called before the first batch with the number of samples to expect (if known)."""
+        return self
+
+    def write(self, batch):
+        raise NotImplementedError
+
+    def flush(self):
+        return self
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class MemorySink(PredictionSink):
+    """
+    Keeps the predictions in memory (as numpy arrays). Models with multiple outputs
+    (lists or tuples of tensors) are supported.
+    """
+    def __init__(self):
+        self.batches = []
+
+    def write(self, batch):
+        self.batches.append(thu.unwrap(batch, as_numpy=True))
+        return self
+
+    @property
+    def result(self):
+        """The predictions concatenated along the batch axis."""
+        assert_(len(self.batches) > 0, "Nothing was written to the sink.", RuntimeError)
+        if isinstance(self.batches[0], (list, tuple)):
+            return type(self.batches[0])([np.concatenate(output_batches)
+                                          for output_batches in zip(*self.batches)])
+        return np.concatenate(self.batches)
+
+
+class HDF5Sink(PredictionSink):
+    """
+    Writes the predictions to a dataset in a HDF5 file. The dataset is created with the
+    first batch, and grows along the batch axis if the number of samples is not known.
+    """
+    def __init__(self, path, path_in_file='predictions', dtype=None, chunks=True,
+                 compression=None, mode='a'):
+        """
+        Parameters
+        ----------
+        path : str
+            Path to the HDF5 file.
+        path_in_file : str
+            Path of the dataset in the file. It must not exist yet.
+        dtype : str or numpy.dtype
+            Data type of the dataset. Defaults to the type of the first batch.
+        chunks : bool or tuple
+            Chunking of the dataset (see `h5py.File.create_dataset`).
+        compression : str
+            Compression of the dataset (see `h5py.File.create_dataset`).
+        mode : str
+            Mode to open the file in.
+        """
+        assert_(WITH_H5PY, "Need h5py to write predictions to hdf5 files.", ImportError)
+        self.path = path
+        self.path_in_file = path_in_file
+        self.dtype = dtype
+        self.chunks = chunks
+        self.compression = compression
+        self._file = h5py.File(path, mode)
+        self._dataset = None
+        self._num_samples = None
+        self._num_written = 0
+
+    def begin(self, num_samples=None):
+        self._num_samples = num_samples
+        return self
+
+    @property
+    def dataset(self):
+        return self._dataset
+
+    def write(self, batch):
+        batch = _as_array(batch)
+        if self._dataset is None:
+            dtype = batch.dtype if self.dtype is None else self.dtype
+            if self._num_samples is None:
+                shape, maxshape = (0,) + batch.shape[1:], (None,) + batch.shape[1:]
+            else:
+                shape = maxshape = (self._num_samples,) + batch.shape[1:]
+            self._dataset = self._file.create_dataset(self.path_in_file, shape=shape,
+                                                      maxshape=maxshape, dtype=dtype,
+                                                      chunks=self.chunks,
+                                                      compression=self.compression)
+        start, stop = self._num_written, self._num_written + len(batch)
+        if stop > self._dataset.shape[0]:
+            assert_(self._dataset.maxshape[0] is None,
+                    "Expected {} samples, but got more.".format(self._dataset.shape[0]),
+                    ShapeError)
+            self._dataset.resize(stop, axis=0)
+        self._dataset[start:stop] = batch
+        self._num_written = stop
+        return self
+
+    def flush(self):
+        self._file.flush()
+        return self
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+class NpyMemmapSink(PredictionSink):
+    """
+    Writes the predictions to a (memory-mapped) `.npy` file, which can be read with
+    `numpy.load` (with `mmap_mode` for larger-than-memory predictions). The number of
+    samples must be known up front, either from the constructor or from `begin`.
+    """
+    def __init__(self, path, num_samples=None, dtype=None):
+        """
+        Parameters
+        ----------
+        path : str
+            Path to the `.npy` file.
+        num_samples : int
+            Number of samples. Can be left to None if the sink is used with a loader
+            whose dataset has a length.
+        dtype : str or numpy.dtype
+            Data type of the array. Defaults to the type of the first batch.
+        """
+        self.path = path
+        self.num_samples = num_samples
+        self.dtype = dtype
+        self._array = None
+        self._num_written = 0
+
+    def begin(self, num_samples=None):
+        if self.num_samples is None:
+            self.num_samples = num_samples
+        return self
+
+    @property
+    def array(self):
+        return self._array
+
+    def write(self, batch):
+        batch = _as_array(batch)
+        if self._array is None:
+            assert_(self.num_samples is not None,
+                    "The number of samples must be known to write to a npy file.",
+                    RuntimeError)
+            self._array = np.lib.format.open_memmap(
+                self.path, mode='w+', shape=(self.num_samples,) + batch.shape[1:],
+                dtype=batch.dtype if self.dtype is None else self.dtype)
+        start, stop = self._num_written, self._num_written + len(batch)
+        assert_(stop <= self.num_samples,
+                "Expected {} samples, but got more.".format(self.num_samples),
+                ShapeError)
+        self._array[start:stop] = batch
+        self._num_written = stop
+        return self
+
+    def flush(self):
+        if self._array is not None:
+            self._array.flush()
+        return self
+
+    def close(self):
+        self.flush()
+        # Unmap
+        self._array = None
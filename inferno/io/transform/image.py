@@ -588,8 +588,8 @@ class RandomScaleSegmentation(Transform):
                 crop_r = new_shape - image_shape - crop_l
                 cropping = [slice(None)] + [slice(c[0] if c[0] > 0 else None,
                                                  -c[1] if c[1] > 0 else None) for c in zip(crop_l, crop_r)]
-                img = img[cropping]
-                seg = seg[cropping]
+                img = img[tuple(cropping)]
+                seg = seg[tuple(cropping)]
             else:
                 # crop image to original size
                 pad_l = (image_shape - new_shape) // 2
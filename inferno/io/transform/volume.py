@@ -119,10 +119,10 @@ class CentralSlice(Transform):
 class VolumeCenterCrop(Transform):
     """ Crop patch of size `size` from the center of the volume """
     def __init__(self, size, **super_kwargs):
-        super(VolumeCrop, self).__init__(**super_kwargs)
+        super(VolumeCenterCrop, self).__init__(**super_kwargs)
         assert isinstance(size, (int, tuple))
         self.size = (size, size, size) if isinstance(size, int) else size
-        assert len(size) == 3
+        assert len(self.size) == 3
 
     def volume_function(self, volume):
         h, w, d = volume.shape
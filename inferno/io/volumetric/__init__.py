@@ -1 +1,4 @@
-from .volume import VolumeLoader, HDF5VolumeLoader, TIFVolumeLoaderfrom .lazy_volume_loader import LazyHDF5VolumeLoader, LazyZarrVolumeLoader, LazyN5VolumeLoader
\ No newline at end of file
+from .volume import VolumeLoader, HDF5VolumeLoader, TIFVolumeLoader, MemmapVolumeLoader
+from .lazy_volume_loader import LazyHDF5VolumeLoader, LazyZarrVolumeLoader, LazyN5VolumeLoader
+from .tiling import TiledPredictor, predict_tiled
+from .blockwise import predict_blockwise
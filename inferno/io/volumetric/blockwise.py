@@ -0,0 +1,323 @@
+"""
+Out-of-core, multi-process blockwise prediction.
+
+The volume is split into blocks aligned with the chunks of the dataset it's stored in.
+Every block is predicted from a window extending the block by a halo (read with a
+`Lazy*VolumeLoader`, which pads the window at the borders of the volume), and the core of
+the prediction (without the halo) is written to an output dataset. Blocks are distributed
+over a pool of processes, each with its own copy of the model and its own file handles.
+Finished blocks are recorded in a journal, such that an interrupted prediction can be
+resumed without predicting the finished blocks again.
+
+Workers write directly to N5 and zarr outputs, where writes of distinct chunks don't
+interfere. HDF5 files can't be written from several processes, so the blocks are written
+by the main process instead.
+"""
+import itertools as it
+import json
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+import torch
+
+# try to load io libraries (h5py and z5py)
+try:
+    import h5py
+    WITH_H5PY = True
+except ImportError:
+    WITH_H5PY = False
+
+try:
+    import z5py
+    WITH_Z5PY = True
+except ImportError:
+    WITH_Z5PY = False
+
+from .volume import HDF5VolumeLoader
+from .lazy_volume_loader import LazyHDF5VolumeLoader, LazyN5VolumeLoader, \
+    LazyZarrVolumeLoader
+from ..transform.generic import AsTorchBatch
+from ...utils.exceptions import assert_, ShapeError
+
+# State of a worker process (see `_initialize_worker`)
+_WORKER = {}
+
+
+def _file_format(path):
+    if HDF5VolumeLoader.is_h5(path):
+        return 'h5'
+    return 'n5' if os.path.splitext(path)[1].lower() == '.n5' else 'zarr'
+
+
+def _open_file(path, mode):
+    file_format = _file_format(path)
+    if file_format == 'h5':
+        assert_(WITH_H5PY, "Need h5py to read or write hdf5 files.", ImportError)
+        return h5py.File(path, mode)
+    assert_(WITH_Z5PY, "Need z5py to read or write N5 or zarr files.", ImportError)
+    return z5py.N5File(path, mode) if file_format == 'n5' else z5py.ZarrFile(path, mode)
+
+
+def _loader_class(path):
+    return {'h5': LazyHDF5VolumeLoader,
+            'n5': LazyN5VolumeLoader,
+            'zarr': LazyZarrVolumeLoader}[_file_format(path)]
+
+
+def blockwise_slices(shape, block_shape):
+    """
+    Splits a volume of shape `shape` into blocks of shape `block_shape` (in C order).
+    Blocks at the upper borders of the volume are truncated.
+    """
+    assert_(len(shape) == len(block_shape),
+            "Block shape {} does not match the shape {} of the volume."
+            .format(block_shape, shape),
+            ShapeError)
+    return [tuple(slice(start, min(start + size, extent))
+                  for start, size, extent in zip(starts, block_shape, shape))
+            for starts in it.product(*[range(0, extent, size)
+                                       for extent, size in zip(shape, block_shape)])]
+
+
+class BlockJournal(object):
+    """
+    Records which blocks are done, in a JSON-lines file. The first line describes the
+    blocking, such that a journal can't be resumed with a different blocking.
+    """
+    def __init__(self, path, blocking):
+        self.path = path
+        self.blocking = blocking
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            if lines:
+                assert_(lines[0] == {'blocking': blocking},
+                        "The journal at {} was written for a different blocking ({}), "
+                        "expected {}.".format(path, lines[0].get('blocking'), blocking),
+                        ValueError)
+                self.done = {line['block'] for line in lines[1:]}
+                return
+        with open(path, 'w') as f:
+            f.write(json.dumps({'blocking': blocking}) + '\n')
+
+    def record(self, block_id):
+        # The block is only recorded once it's safely on disk
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'block': block_id}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.add(block_id)
+        return self
+
+
+def _initialize_worker(config):
+    if config['num_threads'] is not None:
+        torch.set_num_threads(config['num_threads'])
+    model = pickle.loads(config['model']).to(config['device'])
+    model.eval()
+    halo, block_shape = config['halo'], config['block_shape']
+    loader = _loader_class(config['input_path'])(
+        config['input_path'], config['input_key'],
+        window_size=[size + 2 * h for size, h in zip(block_shape, halo)],
+        stride=list(block_shape), padding=[[h, h] for h in halo],
+        padding_mode=config['padding_mode'], transforms=config['transforms'])
+    _WORKER.clear()
+    _WORKER.update(config=config, model=model, loader=loader)
+    if config['write_in_workers']:
+        output_file = _open_file(config['output_path'], 'a')
+        _WORKER.update(output_file=output_file,
+                       output=output_file[config['output_key']])
+
+
+def _predict_block(block):
+    block_id, core = block
+    config, model, loader = _WORKER['config'], _WORKER['model'], _WORKER['loader']
+    halo = config['halo']
+    window_size = [size + 2 * h for size, h in zip(config['block_shape'], halo)]
+    # The window is shifted back at the upper borders, such that it's always of the same
+    # size (and the model always gets inputs of the same size)
+    window_starts = [min(sl.start, padded_extent - size)
+                     for sl, padded_extent, size in zip(core, loader.shape, window_size)]
+    window = loader.load_window(tuple(slice(start, start + size)
+                                      for start, size in zip(window_starts, window_size)))
+    transforms = config['transforms'] or AsTorchBatch(len(window_size))
+    inputs = torch.as_tensor(transforms(window))[None].to(config['device'])
+    with torch.no_grad():
+        prediction = model(inputs)
+        if config['postprocess'] is not None:
+            prediction = config['postprocess'](prediction)
+    prediction = prediction[0].cpu().numpy()
+    # Crop the core (the window starts `halo` before the core in unpadded coordinates)
+    prediction = prediction[(slice(None),) +
+                            tuple(slice(sl.start + h - start, sl.stop + h - start)
+                                  for sl, h, start in zip(core, halo, window_starts))]
+    if config['out_channels'] is None:
+        assert_(prediction.shape[0] == 1,
+                "Expected a single output channel (as `out_channels` is None), "
+                "got {}.".format(prediction.shape[0]),
+                ShapeError)
+        prediction = prediction[0]
+        output_slices = core
+    else:
+        assert_(prediction.shape[0] == config['out_channels'],
+                "Expected {} output channels, got {}."
+                .format(config['out_channels'], prediction.shape[0]),
+                ShapeError)
+        output_slices = (slice(None),) + tuple(core)
+    prediction = prediction.astype(config['dtype'], copy=False)
+    if config['write_in_workers']:
+        _WORKER['output'][output_slices] = prediction
+        return block_id, None, None
+    return block_id, output_slices, prediction
+
+
+def predict_blockwise(model, input_path, input_key, output_path, output_key,
+                      block_shape=None, halo=None, transforms=None, postprocess=None,
+                      padding_mode='reflect', out_channels=None, dtype='float32',
+                      num_workers=1, num_threads_per_worker=None, device='cpu',
+                      journal_path=None):
+    """
+    Predicts a volume stored in a HDF5, N5 or zarr file block by block, and writes the
+    prediction to a dataset in a HDF5, N5 or zarr file.
+
+    Parameters
+    ----------
+    model : torch.nn.Module
+        The model. It's copied to every worker (and must hence be picklable). It gets
+        a batch with a single window (of the size of the blocks plus the halo) and must
+        return a prediction of the same size, with channels.
+    input_path : str
+        Path to the file with the volume. The format is inferred from the extension
+        (see `HDF5VolumeLoader`).
+    input_key : str
+        Path of the volume in the file.
+    output_path : str
+        Path to the file to write the prediction to.
+    output_key : str
+        Path of the prediction in the file. It's created (chunked by blocks) if it
+        doesn't exist yet.
+    block_shape : list or tuple
+        Shape of the blocks. Defaults to the chunks of the volume (or of an existing
+        output dataset). Blocks must be aligned with the chunks of the output.
+    halo : int or list
+        Number of voxels the windows extend beyond the blocks (in every direction).
+    transforms : callable
+        Applied on every window. Must return a tensor (or array) with channels.
+        Defaults to adding a channel axis (with `AsTorchBatch`).
+    postprocess : callable
+        Applied on the output of the model, e.g. a final activation.
+    padding_mode : str
+        How to pad the windows at the borders of the volume (see `numpy.pad`).
+    out_channels : int
+        Number of output channels. If None, the model must predict a single channel,
+        and the output dataset has no channel axis.
+    dtype : str or numpy.dtype
+        Data type of the output dataset.
+    num_workers : int
+        Number of worker processes. With 0, blocks are predicted in this process.
+    num_threads_per_worker : int
+        Number of threads torch uses in every worker. Defaults to distributing the CPU
+        cores over the workers.
+    device : str or torch.device
+        Device the workers predict on.
+    journal_path : str
+        Path of the journal recording the finished blocks. Defaults to the output path
+        with '.journal' appended. Delete it to predict from scratch.
+
+    Returns
+    -------
+    int
+        Number of blocks predicted in this call (i.e. excluding blocks finished before
+        resuming).
+    """
+    with _open_file(input_path, 'r') as input_file:
+        dataset = input_file[input_key]
+        shape, input_chunks = tuple(dataset.shape), dataset.chunks
+    ndim = len(shape)
+    halo = [0] * ndim if halo is None else \
+        [halo] * ndim if isinstance(halo, int) else list(halo)
+    assert_(len(halo) == ndim, "Need a halo for {} axes, got {}.".format(ndim, len(halo)),
+            ShapeError)
+    output_shape = shape if out_channels is None else (out_channels,) + shape
+
+    # Create (or check) the output dataset
+    with _open_file(output_path, 'a') as output_file:
+        if output_key in output_file:
+            output = output_file[output_key]
+            assert_(tuple(output.shape) == output_shape,
+                    "Expected the output dataset to have the shape {}, got {}."
+                    .format(output_shape, tuple(output.shape)),
+                    ShapeError)
+            output_chunks = output.chunks
+            output_chunks = None if output_chunks is None else tuple(output_chunks[-ndim:])
+            if block_shape is None:
+                block_shape = output_chunks
+        else:
+            output_chunks = None
+        if block_shape is None:
+            assert_(input_chunks is not None,
+                    "The volume is not chunked, please specify a `block_shape`.",
+                    ValueError)
+            block_shape = input_chunks
+        block_shape = [min(size, extent) for size, extent in zip(block_shape, shape)]
+        if output_chunks is None:
+            output_chunks = tuple(block_shape)
+            if output_key not in output_file:
+                output_file.create_dataset(output_key, shape=output_shape, dtype=dtype,
+                                           chunks=output_chunks if out_channels is None
+                                           else (out_channels,) + output_chunks)
+    assert_(all(size % chunk == 0 or size == extent
+                for size, chunk, extent in zip(block_shape, output_chunks, shape)),
+            "Blocks of shape {} are not aligned with the chunks {} of the output."
+            .format(block_shape, output_chunks),
+            ShapeError)
+
+    blocks = blockwise_slices(shape, block_shape)
+    journal = BlockJournal(journal_path or output_path + '.journal',
+                           {'shape': list(shape), 'block_shape': list(block_shape),
+                            'halo': halo})
+    todo = [(block_id, core) for block_id, core in enumerate(blocks)
+            if block_id not in journal.done]
+    if not todo:
+        return 0
+
+    write_in_workers = num_workers > 0 and _file_format(output_path) != 'h5'
+    if num_threads_per_worker is None and num_workers > 0:
+        num_threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+    config = dict(model=pickle.dumps(model), input_path=input_path, input_key=input_key,
+                  output_path=output_path, output_key=output_key,
+                  block_shape=list(block_shape), halo=halo, transforms=transforms,
+                  postprocess=postprocess, padding_mode=padding_mode,
+                  out_channels=out_channels, dtype=np.dtype(dtype).str,
+                  num_threads=num_threads_per_worker, device=device,
+                  write_in_workers=write_in_workers)
+
+    output_file = None if write_in_workers else _open_file(output_path, 'a')
+    pool = None
+    try:
+        if num_workers > 0:
+            pool = multiprocessing.get_context('spawn').Pool(
+                num_workers, initializer=_initialize_worker, initargs=(config,))
+            results = pool.imap_unordered(_predict_block, todo)
+        else:
+            _initialize_worker(config)
+            results = map(_predict_block, todo)
+        for block_id, output_slices, prediction in results:
+            if output_file is not None:
+                output_file[output_key][output_slices] = prediction
+                if hasattr(output_file, 'flush'):
+                    output_file.flush()
+            journal.record(block_id)
+        if pool is not None:
+            pool.close()
+            pool.join()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        _WORKER.clear()
+        if output_file is not None:
+            output_file.close()
+    return len(todo)
@@ -0,0 +1,151 @@
+"""
+A cache of decompressed storage chunks for the lazy volume loaders.
+
+With overlapping windows, the same storage chunks are read (and decompressed) for several
+windows. `ChunkCache` wraps a h5py or z5py dataset and reads it chunk by chunk, keeping the
+most recently used chunks in memory. Windows are assembled from the cached chunks.
+"""
+from collections import OrderedDict
+import itertools as it
+import os
+
+import numpy as np
+
+from ...utils.exceptions import assert_, ShapeError
+
+
+class ChunkCache(object):
+    """
+    Wraps a dataset (anything with `shape`, `dtype` and numpy-like slicing, e.g. a h5py or
+    z5py dataset) and keeps the most recently read chunks in a size-bounded LRU cache.
+
+    The cache is local to the process: in a forked DataLoader worker, it starts empty
+    (and so do the counters).
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset or z5py.Dataset
+        The dataset to read from.
+    max_size : int
+        Maximum size of the cached chunks in bytes.
+    chunks : list or tuple
+        Shape of the blocks to read and cache. Defaults to the chunks of the dataset,
+        which is what they should be aligned to.
+    """
+    def __init__(self, dataset, max_size, chunks=None):
+        chunks = getattr(dataset, 'chunks', None) if chunks is None else chunks
+        assert_(chunks is not None,
+                "The dataset is not chunked, please specify the `chunks` to cache.",
+                ValueError)
+        assert_(len(chunks) == len(dataset.shape),
+                "Chunks {} do not match the shape {} of the dataset."
+                .format(chunks, dataset.shape),
+                ShapeError)
+        self.dataset = dataset
+        self.max_size = max_size
+        self.chunks = tuple(int(chunk) for chunk in chunks)
+        self.clear()
+
+    @property
+    def shape(self):
+        return tuple(self.dataset.shape)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return self.dataset.dtype
+
+    @property
+    def size(self):
+        """Size of the cached chunks in bytes."""
+        return self._size
+
+    def clear(self):
+        """Empties the cache and resets the counters."""
+        self._cache = OrderedDict()
+        self._size = 0
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return self
+
+    def cache_info(self):
+        """Gets the hit and miss counters and the state of the cache as a dict."""
+        self._check_process()
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'num_chunks': len(self._cache), 'size': self._size,
+                'max_size': self.max_size}
+
+    def _check_process(self):
+        # Forked workers don't share the cache (nor the counters) with the parent
+        if os.getpid() != self._pid:
+            self.clear()
+
+    def _get_chunk(self, chunk_index):
+        chunk = self._cache.get(chunk_index)
+        if chunk is not None:
+            self._cache.move_to_end(chunk_index)
+            self.hits += 1
+            return chunk
+        self.misses += 1
+        chunk = np.asarray(self.dataset[tuple(slice(index * size, (index + 1) * size)
+                                              for index, size in zip(chunk_index,
+                                                                     self.chunks))])
+        self._cache[chunk_index] = chunk
+        self._size += chunk.nbytes
+        # Evict the least recently used chunks. This may evict the new chunk too if it
+        # doesn't fit, which is fine: the caller holds a reference.
+        while self._size > self.max_size and self._cache:
+            _, evicted = self._cache.popitem(last=False)
+            self._size -= evicted.nbytes
+            self.evictions += 1
+        return chunk
+
+    def __getitem__(self, slices):
+        self._check_process()
+        slices = slices if isinstance(slices, tuple) else (slices,)
+        assert_(len(slices) == self.ndim and all(isinstance(sl, slice) for sl in slices),
+                "Expected a slice for every one of the {} axes, got {}."
+                .format(self.ndim, slices),
+                ShapeError)
+        starts, stops, steps = zip(*[sl.indices(extent)
+                                     for sl, extent in zip(slices, self.shape)])
+        assert_(all(step > 0 for step in steps), "Negative steps are not supported.",
+                ValueError)
+        stops = [max(start, stop) for start, stop in zip(starts, stops)]
+        # Read the window at full resolution and subsample it afterwards
+        window = np.empty([stop - start for start, stop in zip(starts, stops)],
+                          dtype=self.dtype)
+        if window.size > 0:
+            chunk_ranges = [range(start // size, (stop - 1) // size + 1)
+                            for start, stop, size in zip(starts, stops, self.chunks)]
+            for chunk_index in it.product(*chunk_ranges):
+                chunk = self._get_chunk(chunk_index)
+                chunk_starts = [index * size for index, size in zip(chunk_index, self.chunks)]
+                # The intersection of the window and the chunk
+                lower = [max(start, chunk_start)
+                         for start, chunk_start in zip(starts, chunk_starts)]
+                upper = [min(stop, chunk_start + extent)
+                         for stop, chunk_start, extent in zip(stops, chunk_starts,
+                                                              chunk.shape)]
+                window[tuple(slice(low - start, up - start)
+                             for low, up, start in zip(lower, upper, starts))] = \
+                    chunk[tuple(slice(low - chunk_start, up - chunk_start)
+                                for low, up, chunk_start in zip(lower, upper, chunk_starts))]
+        if any(step != 1 for step in steps):
+            window = window[tuple(slice(None, None, step) for step in steps)]
+        return window
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The cached chunks are not sent along
+        state.update(_cache=OrderedDict(), _size=0, hits=0, misses=0, evictions=0)
+        return state
+
+    def __repr__(self):
+        return "{}(shape={}, chunks={}, max_size={})".format(type(self).__name__, self.shape,
+                                                             self.chunks, self.max_size)
@@ -1,3 +1,6 @@
+from collections import OrderedDict
+import threading
+import uuid
 import numpy as np
 import os
 
@@ -17,13 +20,161 @@ except ImportError:
 from ..core.base import SyncableDataset
 from ..core.base import IndexSpec
 from . import volumetric_utils as vu
+from .chunk_cache import ChunkCache
 from ...utils import python_utils as pyu
 
 
+class FileHandlePool(object):
+    """
+    Keeps the files opened by the lazy volume loaders, at most `max_open_files` of them (the
+    least recently used ones are closed first).
+
+    Handles are never shared between processes: after a fork (e.g. in a DataLoader worker),
+    the handles inherited from the parent are dropped and files are opened again.
+    """
+    def __init__(self, max_open_files=64):
+        self._reset()
+        self.max_open_files = max_open_files
+
+    @property
+    def max_open_files(self):
+        return self._max_open_files
+
+    @max_open_files.setter
+    def max_open_files(self, value):
+        self._max_open_files = value
+        if os.getpid() == self._pid:
+            with self._lock:
+                self._evict()
+
+    def _evict(self):
+        while len(self._files) > max(self._max_open_files, 1):
+            _, evicted = self._files.popitem(last=False)
+            if hasattr(evicted, 'close'):
+                evicted.close()
+
+    def _reset(self):
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def open(self, key, file_impl, path):
+        """
+        Gets the file at `path` opened (read only) with `file_impl` in this process, as
+        the handle identified by `key`.
+        """
+        if os.getpid() != self._pid:
+            # Don't touch (let alone close) the parent's handles
+            self._reset()
+        with self._lock:
+            file_ = self._files.get(key)
+            if file_ is not None:
+                self._files.move_to_end(key)
+                return file_
+            file_ = self._files[key] = file_impl(path, mode='r')
+            self._evict()
+            return file_
+
+    def close(self, key):
+        """Closes the handle identified by `key` if it's open in this process."""
+        if os.getpid() != self._pid:
+            return
+        with self._lock:
+            file_ = self._files.pop(key, None)
+            if file_ is not None and hasattr(file_, 'close'):
+                file_.close()
+
+    def close_all(self):
+        """Closes all files opened in this process."""
+        if os.getpid() != self._pid:
+            self._reset()
+        with self._lock:
+            for file_ in self._files.values():
+                if hasattr(file_, 'close'):
+                    file_.close()
+            self._files.clear()
+
+    def __len__(self):
+        return len(self._files) if os.getpid() == self._pid else 0
+
+
+# The files opened by the lazy volume loaders
+file_handle_pool = FileHandlePool()
+
+
+class FileDataset(object):
+    """
+    A dataset in a file that is opened on demand in every process, through the
+    `file_handle_pool`. Only the path and the metadata of the dataset are kept, so it's
+    cheap to pickle (e.g. for DataLoader workers with the spawn start method).
+    """
+    def __init__(self, file_impl, path, path_in_file):
+        self.file_impl = file_impl
+        self.path = path
+        self.path_in_file = path_in_file
+        # Identifies the handle in the pool, for all copies of this object
+        self.key = uuid.uuid4().hex
+        dataset = self.get()
+        self.shape = tuple(dataset.shape)
+        self.dtype = dataset.dtype
+        self.chunks = None if dataset.chunks is None else tuple(dataset.chunks)
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def file_(self):
+        return file_handle_pool.open(self.key, self.file_impl, self.path)
+
+    def get(self):
+        """Gets the dataset in the file opened in this process."""
+        file_ = self.file_
+        if file_ is not self.__dict__.get('_file'):
+            # The file was (re)opened
+            self._file = file_
+            self._dataset = file_[self.path_in_file]
+        return self._dataset
+
+    def __getitem__(self, slices):
+        return self.get()[slices]
+
+    def close(self):
+        self.__dict__.pop('_file', None)
+        self.__dict__.pop('_dataset', None)
+        file_handle_pool.close(self.key)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_file', None)
+        state.pop('_dataset', None)
+        return state
+
+    # this is not pythonic, but we need to close the h5py file
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            # The interpreter may be shutting down
+            pass
+
+    def __repr__(self):
+        return "{}(path={}, path_in_file={}, shape={})".format(type(self).__name__, self.path,
+                                                              self.path_in_file, self.shape)
+
+
 class LazyVolumeLoaderBase(SyncableDataset):
+    """
+    Base class for loaders reading windows from a dataset on demand.
+
+    With `chunk_cache_size` (in bytes), the dataset is read chunk by chunk through a
+    `ChunkCache`, which keeps the most recently used (decompressed) chunks in memory. This
+    saves reading and decompressing the same chunks again for overlapping windows. The
+    cache is then available as `chunk_cache` (e.g. for its `cache_info()`).
+    """
     def __init__(self, dataset, window_size, stride, downsampling_ratio=None, padding=None,
                  padding_mode='reflect', transforms=None, return_index_spec=False, name=None,
-                 data_slice=None):
+                 data_slice=None, chunk_cache_size=None):
         super(LazyVolumeLoaderBase, self).__init__()
         assert len(window_size) == dataset.ndim, "%i, %i" % (len(window_size), dataset.ndim)
         assert len(stride) == dataset.ndim
@@ -32,6 +183,11 @@ class LazyVolumeLoaderBase(SyncableDataset):
 
         self.name = name
         self.return_index_spec = return_index_spec
+        if chunk_cache_size is not None:
+            # Contiguous datasets are cached in blocks of the window size
+            dataset = ChunkCache(dataset, chunk_cache_size,
+                                 chunks=getattr(dataset, 'chunks', None) or window_size)
+        self.chunk_cache = dataset if chunk_cache_size is not None else None
         self.dataset = dataset
         self.window_size = window_size
         self.stride = stride
@@ -83,18 +239,32 @@ class LazyVolumeLoaderBase(SyncableDataset):
         return shape
 
     def make_sliding_windows(self):
-        return list(vu.slidingwindowslices(shape=list(self.shape),
-                                           window_size=self.window_size,
-                                           strides=self.stride,
-                                           shuffle=self.shuffle,
-                                           add_overhanging=True,
-                                           ds=self.downsampling_ratio))
+        return vu.SlidingWindows(shape=list(self.shape),
+                                 window_size=self.window_size,
+                                 strides=self.stride,
+                                 shuffle=self.shuffle,
+                                 add_overhanging=True,
+                                 ds=self.downsampling_ratio)
 
     def __getitem__(self, index):
         # Casting to int would allow index to be IndexSpec objects.
         index = int(index)
         slices = self.base_sequence[index]
+        sliced_volume = self.load_window(slices)
+        if self.transforms is None:
+            transformed = sliced_volume
+        else:
+            transformed = self.transforms(sliced_volume)
+        if self.return_index_spec:
+            return transformed, IndexSpec(index=index, base_sequence_at_index=slices)
+        else:
+            return transformed
 
+    def load_window(self, slices):
+        """
+        Loads the window at `slices` (in the padded and sliced volume, like the slices in
+        `base_sequence`) from the dataset, and pads it where it extends into the padding.
+        """
         slices_ = tuple(slices)
 
         # check if we have padding and if we need to pad
@@ -141,15 +311,7 @@ class LazyVolumeLoaderBase(SyncableDataset):
         if need_padding:
             sliced_volume = np.pad(sliced_volume, pad_width=pad_width,
                                    mode=self.padding_mode)
-
-        if self.transforms is None:
-            transformed = sliced_volume
-        else:
-            transformed = self.transforms(sliced_volume)
-        if self.return_index_spec:
-            return transformed, IndexSpec(index=index, base_sequence_at_index=slices)
-        else:
-            return transformed
+        return sliced_volume
 
     def clone(self, dataset=None, transforms=None, name=None):
         # Make sure the dataset shapes check out
@@ -159,6 +321,11 @@ class LazyVolumeLoaderBase(SyncableDataset):
         # Update dictionary to initialize
         new_dict = dict(self.__dict__)
         if dataset is not None:
+            if self.chunk_cache is not None:
+                # The clone gets a cache of its own
+                dataset = ChunkCache(dataset, self.chunk_cache.max_size,
+                                     chunks=self.chunk_cache.chunks)
+                new_dict.update({'chunk_cache': dataset})
             new_dict.update({'dataset': dataset})
         if transforms is not None:
             new_dict.update({'transforms': transforms})
@@ -213,12 +380,18 @@ class LazyVolumeLoader(LazyVolumeLoaderBase):
         assert 'window_size' in slicing_config_for_name
         assert 'stride' in slicing_config_for_name
 
-        self.file_ = file_impl(self.path, mode='r')
+        # The file is opened on demand, separately in every process
+        self.file_dataset = dataset = FileDataset(file_impl, self.path, self.path_in_file)
         # Initialize superclass with the volume
-        super(LazyVolumeLoader, self).__init__(dataset=self.file_[self.path_in_file], name=name,
+        super(LazyVolumeLoader, self).__init__(dataset=dataset, name=name,
                                                transforms=transforms, data_slice=data_slice,
                                                **slicing_config_for_name)
 
+    @property
+    def file_(self):
+        """The file, opened in this process."""
+        return self.file_dataset.file_
+
     # we do not support step in the dataslice
     def validate_data_slice(self, data_slice):
         if data_slice is not None:
@@ -234,10 +407,6 @@ class LazyHDF5VolumeLoader(LazyVolumeLoader):
                                                    data_slice=data_slice, transforms=transforms,
                                                    name=name, **slicing_config)
 
-    # this is not pythonic, but we need to close the h5py file
-    def __del__(self):
-        self.file_.close()
-
 
 class LazyN5VolumeLoader(LazyVolumeLoader):
     def __init__(self, path, path_in_file=None, data_slice=None, transforms=None,
@@ -0,0 +1,452 @@
+"""
+Tiled (sliding window) inference.
+
+`VolumeLoader` and the `Lazy*VolumeLoader`s cut a volume into overlapping windows; the
+`TiledPredictor` stitches the predictions for these windows back into a volume. Every
+window is weighted with a blending window (e.g. a Gaussian, to down-weight the
+predictions close to the window borders) and optionally cropped by a halo, and the
+weighted predictions are accumulated into a preallocated array. The blending windows
+are separable, so instead of accumulating the weights into an array the size of the
+volume, only the per-axis profiles of every window are kept. The stitched volume is
+normalized block by block at the end, with the weights of every block recomputed from
+the profiles.
+"""
+import bisect
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torch.utils.data.dataloader import default_collate
+
+from ..core.base import IndexSpec
+from .volume import VolumeLoader
+from .lazy_volume_loader import LazyVolumeLoaderBase
+from ...utils import torch_utils as thu
+from ...utils.exceptions import assert_, ShapeError
+
+BLENDING_MODES = ['gaussian', 'linear', 'constant']
+
+
+def _to_list(value, ndim):
+    return [value] * ndim if isinstance(value, int) else list(value)
+
+
+def blending_profiles(window_size, mode='gaussian', sigma_scale=0.125):
+    """
+    Builds the per-axis profiles of a blending window (see `blending_window`), which is
+    their outer product.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        The (float64) profiles, one per axis, each with a maximum of 1.
+    """
+    assert_(mode in BLENDING_MODES,
+            "`mode` must be one of {}, got {} instead.".format(BLENDING_MODES, mode),
+            ValueError)
+    profiles = []
+    for size in window_size:
+        # Distance of the voxel centers to the center of the window
+        distance = np.abs(np.arange(size, dtype='float64') - (size - 1) / 2.)
+        if mode == 'gaussian':
+            sigma = max(sigma_scale * size, 1e-6)
+            profile = np.exp(-0.5 * (distance / sigma) ** 2)
+        elif mode == 'linear':
+            profile = 1. - distance / (size / 2. + 0.5)
+        else:
+            profile = np.ones(size)
+        profiles.append(profile / profile.max())
+    return profiles
+
+
+def _outer_weights(profiles):
+    weights = np.ones((), dtype='float64')
+    for profile in profiles:
+        weights = np.multiply.outer(weights, profile)
+    # The tails of the Gaussian can underflow in float32
+    return np.maximum(weights, np.finfo('float32').tiny).astype('float32')
+
+
+def blending_window(window_size, mode='gaussian', sigma_scale=0.125):
+    """
+    Builds the weights of a window for blending overlapping predictions.
+
+    Parameters
+    ----------
+    window_size : list or tuple
+        Size of the window.
+    mode : {'gaussian', 'linear', 'constant'}
+        'gaussian' weighs with a Gaussian centered in the window, 'linear' with a tent
+        falling off linearly towards the borders of the window and 'constant' weighs all
+        voxels equally (i.e. overlapping predictions are averaged).
+    sigma_scale : float
+        Standard deviation of the Gaussian, as a fraction of the window size.
+
+    Returns
+    -------
+    numpy.ndarray
+        The (float32) weights. All weights are positive and the largest weight is 1.
+    """
+    return _outer_weights(blending_profiles(window_size, mode=mode, sigma_scale=sigma_scale))
+
+
+class TiledPredictor(object):
+    """
+    Accumulates the predictions for (overlapping) windows of a volume into the prediction
+    for the whole volume.
+
+    Windows are given by their slices in the (padded) volume the windows were cut from,
+    like the ones in `VolumeLoader.base_sequence` or in the `IndexSpec`s returned by the
+    volume loaders. Every prediction is cropped by the `halo` (except at the borders of
+    the volume, which would be left uncovered otherwise), cropped to the volume without
+    the padding, weighted with the blending window and accumulated. Once all windows are
+    in, `finalize` divides by the accumulated weights.
+
+    The weights are never held for the whole volume at once: the predictor only keeps the
+    per-axis blending profiles of every window, and `finalize` recomputes the weights for
+    blocks of at most `BLOCK_SIZE` voxels at a time. The memory it needs (besides `out`)
+    is therefore independent of the size of the volume.
+
+    Predictions have the shape of the window, optionally with a leading channel axis.
+    """
+    # Maximum number of voxels `finalize` computes the weights for at a time
+    BLOCK_SIZE = 2 ** 24
+
+    def __init__(self, shape, padding=None, blending='gaussian', halo=None,
+                 sigma_scale=0.125, out=None):
+        """
+        Parameters
+        ----------
+        shape : list or tuple
+            Shape of the volume (without channels and padding).
+        padding : list
+            Padding of the volume the windows were cut from, as pairs of (before, after)
+            padding per axis (or an int per axis for symmetric padding).
+        blending : {'gaussian', 'linear', 'constant'}
+            How to weigh the predictions (see `blending_window`).
+        halo : int or list
+            Number of voxels to discard at every border of the predicted windows.
+        sigma_scale : float
+            Standard deviation of the Gaussian blending window, as a fraction of the
+            (cropped) window size.
+        out : numpy.ndarray or h5py.Dataset
+            Array to accumulate the predictions into, e.g. a `numpy.memmap` for
+            predictions that don't fit in memory. Its shape must be the shape of the
+            volume, with the channels in front if the predictions have channels. It's
+            allocated (as float32) with the first prediction if not given.
+        """
+        assert_(blending in BLENDING_MODES,
+                "`blending` must be one of {}, got {} instead."
+                .format(BLENDING_MODES, blending),
+                ValueError)
+        self.shape = tuple(shape)
+        ndim = len(self.shape)
+        padding = [[0, 0]] * ndim if padding is None else padding
+        assert_(len(padding) == ndim, "Need padding for {} axes, got {}."
+                .format(ndim, len(padding)), ShapeError)
+        self.padding = [[pad, pad] if isinstance(pad, int) else list(pad) for pad in padding]
+        self.halo = _to_list(0 if halo is None else halo, ndim)
+        assert_(len(self.halo) == ndim, "Need a halo for {} axes, got {}."
+                .format(ndim, len(self.halo)), ShapeError)
+        self.blending = blending
+        self.sigma_scale = sigma_scale
+        self._out = out
+        # The slices of every accumulated window in the volume, and its blending profiles
+        # cut to these slices
+        self._windows = []
+        # The starts of the windows along the first axis (by which the windows are sorted)
+        # and their largest extent along that axis, built when the weights are computed
+        self._window_index = None
+        self._profiles = {}
+        self._blending_windows = {}
+        self._finalized = False
+
+    @property
+    def padded_shape(self):
+        return tuple(size + sum(pad) for size, pad in zip(self.shape, self.padding))
+
+    @property
+    def out(self):
+        return self._out
+
+    @property
+    def weights(self):
+        """
+        The accumulated weights. They're computed on demand, in an array the size of the
+        volume.
+        """
+        return self._weights_in(tuple(slice(0, size) for size in self.shape))
+
+    def _blending_profiles(self, window_size):
+        window_size = tuple(window_size)
+        if window_size not in self._profiles:
+            self._profiles[window_size] = blending_profiles(
+                window_size, mode=self.blending, sigma_scale=self.sigma_scale)
+        return self._profiles[window_size]
+
+    def _blending_window(self, window_size):
+        window_size = tuple(window_size)
+        if window_size not in self._blending_windows:
+            self._blending_windows[window_size] = \
+                _outer_weights(self._blending_profiles(window_size))
+        return self._blending_windows[window_size]
+
+    def _windows_overlapping(self, block):
+        # Returns the windows that overlap the block along the first axis. Looking them up
+        # in the index (instead of going through all windows) keeps the block by block
+        # normalization linear in the number of windows.
+        if self._window_index is None:
+            self._windows.sort(key=lambda window: window[0][0].start)
+            self._window_index = ([volume_slices[0].start
+                                   for volume_slices, _ in self._windows],
+                                  max([volume_slices[0].stop - volume_slices[0].start
+                                       for volume_slices, _ in self._windows] or [0]))
+        starts, max_extent = self._window_index
+        first = bisect.bisect_left(starts, block[0].start - max_extent + 1)
+        last = bisect.bisect_left(starts, block[0].stop)
+        return self._windows[first:last]
+
+    def _weights_in(self, block):
+        # Sums the weights of all windows overlapping the block (given by its slices)
+        weights = np.zeros(tuple(sl.stop - sl.start for sl in block), dtype='float32')
+        for volume_slices, profiles in self._windows_overlapping(block):
+            starts = [max(vsl.start, bsl.start) for vsl, bsl in zip(volume_slices, block)]
+            stops = [min(vsl.stop, bsl.stop) for vsl, bsl in zip(volume_slices, block)]
+            if any(start >= stop for start, stop in zip(starts, stops)):
+                continue
+            profiles = [profile[start - vsl.start:stop - vsl.start]
+                        for profile, start, stop, vsl
+                        in zip(profiles, starts, stops, volume_slices)]
+            weights[tuple(slice(start - bsl.start, stop - bsl.start)
+                          for start, stop, bsl in zip(starts, stops, block))] += \
+                _outer_weights(profiles)
+        return weights
+
+    def _allocate(self, num_channels):
+        shape = self.shape if num_channels is None else (num_channels,) + self.shape
+        if self._out is None:
+            self._out = np.zeros(shape, dtype='float32')
+        else:
+            assert_(tuple(self._out.shape) == shape,
+                    "Expected the output to have the shape {}, got {} instead."
+                    .format(shape, tuple(self._out.shape)),
+                    ShapeError)
+
+    def accumulate(self, prediction, slices):
+        """
+        Accumulates the prediction for a single window.
+
+        Parameters
+        ----------
+        prediction : numpy.ndarray or torch.Tensor
+            Prediction for the window, with or without a leading channel axis.
+        slices : tuple
+            Slices of the window in the padded volume. A leading slice over the channels
+            (like in the `IndexSpec`s of multichannel `VolumeLoader`s) is ignored.
+        """
+        assert_(not self._finalized, "The prediction was already finalized.", RuntimeError)
+        ndim = len(self.shape)
+        slices = tuple(slices)[-ndim:]
+        assert_(all(sl.step in (None, 1) for sl in slices),
+                "Stitching downsampled windows is not supported.",
+                NotImplementedError)
+        prediction = np.asarray(thu.unwrap(prediction, as_numpy=True))
+        window_size = tuple(sl.stop - sl.start for sl in slices)
+        assert_(prediction.ndim in (ndim, ndim + 1) and
+                prediction.shape[-ndim:] == window_size,
+                "Expected a prediction of shape {} (with or without channels), "
+                "got {} instead.".format(window_size, prediction.shape),
+                ShapeError)
+        has_channels = prediction.ndim == ndim + 1
+        self._allocate(prediction.shape[0] if has_channels else None)
+        assert_(has_channels == (self._out.ndim == ndim + 1),
+                "Predictions must either all have channels or none.",
+                ShapeError)
+
+        # Crop the halo, except at the borders of the (padded) volume
+        crop_before = [halo if sl.start > 0 else 0
+                       for sl, halo in zip(slices, self.halo)]
+        crop_after = [halo if sl.stop < size else 0
+                      for sl, halo, size in zip(slices, self.halo, self.padded_shape)]
+        assert_(all(before + after < size for before, after, size
+                    in zip(crop_before, crop_after, window_size)),
+                "The halo {} leaves nothing of the window of size {}."
+                .format(self.halo, window_size),
+                ShapeError)
+        cropped_size = [size - before - after for size, before, after
+                        in zip(window_size, crop_before, crop_after)]
+        weights = self._blending_window(cropped_size)
+
+        # Where the cropped window lies in the volume without padding, and which part of
+        # the cropped window that is
+        starts = [sl.start + before - pad[0]
+                  for sl, before, pad in zip(slices, crop_before, self.padding)]
+        stops = [start + size for start, size in zip(starts, cropped_size)]
+        volume_slices = tuple(slice(max(start, 0), min(stop, size))
+                              for start, stop, size in zip(starts, stops, self.shape))
+        if any(sl.start >= sl.stop for sl in volume_slices):
+            # The window only covers padding
+            return self
+        window_slices = tuple(slice(before + vsl.start - start,
+                                    before + vsl.stop - start)
+                              for before, vsl, start in zip(crop_before, volume_slices,
+                                                            starts))
+        cut = tuple(slice(vsl.start - start, vsl.stop - start)
+                    for vsl, start in zip(volume_slices, starts))
+        weights = weights[cut]
+        if has_channels:
+            prediction = prediction[(slice(None),) + window_slices]
+            self._out[(slice(None),) + volume_slices] += prediction * weights
+        else:
+            self._out[volume_slices] += prediction[window_slices] * weights
+        self._windows.append((volume_slices,
+                              [profile[sl] for profile, sl
+                               in zip(self._blending_profiles(cropped_size), cut)]))
+        self._window_index = None
+        return self
+
+    def accumulate_batch(self, predictions, slices):
+        """Accumulates a batch of predictions, given the slices of each window."""
+        assert_(len(predictions) == len(slices),
+                "Got {} predictions for {} windows.".format(len(predictions), len(slices)),
+                ShapeError)
+        for prediction, window_slices in zip(predictions, slices):
+            self.accumulate(prediction, window_slices)
+        return self
+
+    @property
+    def coverage(self):
+        """Boolean mask of the voxels that were covered by at least one window."""
+        return self.weights > 0
+
+    def _blocks(self):
+        # Blocks of whole rows (along the first axis) of at most BLOCK_SIZE voxels
+        row_size = int(np.prod(self.shape[1:]))
+        num_rows = max(1, self.BLOCK_SIZE // max(row_size, 1))
+        for start in range(0, self.shape[0], num_rows):
+            yield (slice(start, min(start + num_rows, self.shape[0])),) + \
+                tuple(slice(0, size) for size in self.shape[1:])
+
+    def finalize(self):
+        """
+        Normalizes the accumulated predictions by the accumulated weights (in place,
+        block by block) and returns them. Voxels not covered by any window are left at
+        zero.
+        """
+        assert_(self._out is not None, "Nothing was accumulated.", RuntimeError)
+        if not self._finalized:
+            has_channels = self._out.ndim == len(self.shape) + 1
+            for block in self._blocks():
+                weights = self._weights_in(block)
+                out_block = (slice(None),) + block if has_channels else block
+                # Works for arrays (whose slices are views) and datasets alike
+                values = np.asarray(self._out[out_block])
+                np.divide(values, weights, out=values, where=weights > 0)
+                self._out[out_block] = values
+            self._finalized = True
+        return self._out
+
+
+def volume_geometry(loader):
+    """
+    Returns the shape (without channels and padding) and the padding of the volume a
+    `VolumeLoader` or `Lazy*VolumeLoader` cuts its windows from.
+    """
+    if isinstance(loader, VolumeLoader):
+        padded_shape = loader.shape
+        padding = loader.padding
+    elif isinstance(loader, LazyVolumeLoaderBase):
+        padded_shape = loader.shape
+        padding = loader.padding if loader.padding is not None \
+            else [[0, 0]] * len(padded_shape)
+    else:
+        raise TypeError("Expected a VolumeLoader or a Lazy*VolumeLoader, got {} instead."
+                        .format(type(loader).__name__))
+    padding = [[pad, pad] if isinstance(pad, int) else list(pad) for pad in padding]
+    shape = tuple(size - sum(pad) for size, pad in zip(padded_shape, padding))
+    return shape, padding
+
+
+def _collate_inputs(batch):
+    # Drop the index specs (windows are matched to predictions by their position)
+    return default_collate([sample[0] if isinstance(sample, (list, tuple)) and
+                            isinstance(sample[-1], IndexSpec) else sample
+                            for sample in batch])
+
+
+def _predict_with_module(model, loader, postprocess):
+    parameter = next(model.parameters(), None)
+    device = parameter.device if parameter is not None else torch.device('cpu')
+    was_training = model.training
+    model.eval()
+    try:
+        for inputs in loader:
+            with torch.no_grad():
+                prediction = model(inputs.to(device))
+                if postprocess is not None:
+                    prediction = postprocess(prediction)
+                prediction = thu.unwrap(prediction, to_cpu=True)
+            yield prediction
+    finally:
+        model.train(was_training)
+
+
+def predict_tiled(model, loader, blending='gaussian', halo=None, sigma_scale=0.125,
+                  postprocess=None, batch_size=1, num_workers=0, out=None):
+    """
+    Predicts a volume window by window and stitches the predictions together (see
+    `TiledPredictor`).
+
+    Parameters
+    ----------
+    model : inferno.trainers.basic.Trainer or torch.nn.Module
+        What to predict with. A trainer predicts with `Trainer.predict` (i.e. with its
+        device, precision and prefetching settings); a module is applied on the device
+        of its parameters.
+    loader : inferno.io.volumetric.VolumeLoader or inferno.io.volumetric.LazyVolumeLoaderBase
+        Loader cutting the volume into windows. Its transforms must keep the size of the
+        windows (but may add a channel and a batch axis, e.g. `AsTorchBatch`).
+    blending : {'gaussian', 'linear', 'constant'}
+        How to weigh overlapping predictions (see `blending_window`).
+    halo : int or list
+        Number of voxels to discard at every border of the predicted windows.
+    sigma_scale : float
+        Standard deviation of the Gaussian blending window, as a fraction of the window
+        size.
+    postprocess : callable
+        Called with the output of the model for every batch, e.g. to apply a final
+        activation or select one of several outputs.
+    batch_size : int
+        Number of windows per batch.
+    num_workers : int
+        Number of workers loading the windows.
+    out : numpy.ndarray
+        Array to stitch the prediction into (see `TiledPredictor`).
+
+    Returns
+    -------
+    numpy.ndarray
+        The stitched prediction, with the shape of the volume (without padding) and
+        with the channels (if the model predicts any) in front.
+    """
+    shape, padding = volume_geometry(loader)
+    stitcher = TiledPredictor(shape, padding=padding, blending=blending, halo=halo,
+                              sigma_scale=sigma_scale, out=out)
+    # The windows are loaded in order, so the n-th prediction is for the n-th window
+    batches = DataLoader(loader, batch_size=batch_size, shuffle=False,
+                         num_workers=num_workers, collate_fn=_collate_inputs)
+    if isinstance(model, torch.nn.Module):
+        predictions = _predict_with_module(model, batches, postprocess)
+    else:
+        predictions = model.predict(batches, postprocess=postprocess, to_cpu=True)
+    num_predicted = 0
+    for prediction in predictions:
+        assert_(torch.is_tensor(prediction) or isinstance(prediction, np.ndarray),
+                "Expected a single tensor per batch, got a {} instead. Please use "
+                "`postprocess` to select the output to stitch."
+                .format(type(prediction).__name__),
+                TypeError)
+        windows = loader.base_sequence[num_predicted:num_predicted + len(prediction)]
+        stitcher.accumulate_batch(prediction, windows)
+        num_predicted += len(prediction)
+    return stitcher.finalize()
@@ -24,9 +24,12 @@ class VolumeLoader(SyncableDataset):
     downsampling_ratio: list or tuple (default: None)
         factor by which the data is downsampled (no downsapling by default)
     padding: list (default: None)
-        padding for data, follows np.pad syntax
+        padding for data, follows np.pad syntax. The volume is not padded, instead
+        windows extending into the padding are padded when they are loaded (windows
+        in the interior are views of the volume).
     padding_mode: str (default: 'reflect')
-        padding mode as in np.pad
+        padding mode as in np.pad. 'constant' (with zeros), 'edge', 'reflect', 'symmetric'
+        and 'wrap' are computed per window, other modes pad the whole volume.
     transforms: callable (default: None)
        transforms applied on each batch loaded from volume
     return_index_spec: bool (default: False)
@@ -37,6 +40,9 @@ class VolumeLoader(SyncableDataset):
         is this a multichannel volume? sliding window is NOT applied to channel dimension
     """
 
+    # Padding modes that are computed per window (with zeros for 'constant')
+    VIRTUAL_PADDING_MODES = ('constant', 'edge', 'reflect', 'symmetric', 'wrap')
+
     def __init__(self, volume, window_size, stride, downsampling_ratio=None, padding=None,
                  padding_mode='reflect', transforms=None, return_index_spec=False, name=None,
                  is_multichannel=False):
@@ -49,9 +55,8 @@ class VolumeLoader(SyncableDataset):
                                                                      volume.ndim),
                                                                     ShapeError)
             assert_(len(stride) + 1 == volume.ndim, exception_type=ShapeError)
-            # TODO implemnent downsampling and padding for multi-channel volume
+            # TODO implemnent downsampling for multi-channel volume
             assert_(downsampling_ratio is None, exception_type=NotImplementedError)
-            assert_(padding is None, exception_type=NotImplementedError)
         else:
             assert_(len(window_size) == volume.ndim, "%i, %i" % (len(window_size),
                                                                  volume.ndim),
@@ -72,6 +77,9 @@ class VolumeLoader(SyncableDataset):
         self.shuffle = False
 
         ndim = self.volume.ndim - 1 if is_multichannel else self.volume.ndim
+        # Whether the volume was padded as a whole (for padding modes that are not computed
+        # per window)
+        self._volume_is_padded = False
 
         if downsampling_ratio is None:
             self.downsampling_ratio = [1] * ndim
@@ -86,41 +94,107 @@ class VolumeLoader(SyncableDataset):
         if padding is None:
             self.padding = [[0, 0]] * ndim
         else:
-            self.padding = padding
+            self.padding = self._normalize_padding(padding)
+        if self.padding_mode not in self.VIRTUAL_PADDING_MODES and \
+                any(sum(pad) > 0 for pad in self.padding):
+            # Fall back to padding the whole volume
             self.pad_volume()
+        self.shape = self.get_shape()
 
         self.base_sequence = self.make_sliding_windows()
 
+    def _normalize_padding(self, padding):
+        # Returns the padding as a list of [before, after] pairs, one per (non-channel) axis.
+        # For symmetric padding, a single int can be passed for an axis.
+        ndim = self.volume.ndim - 1 if self.is_multichannel else self.volume.ndim
+        assert_(all(isinstance(pad, (int, tuple, list)) for pad in padding),
+                "Expect int or iterable", TypeError)
+        assert_(len(padding) == ndim, "Need padding for {} axes, got {}."
+                .format(ndim, len(padding)), ShapeError)
+        return [[pad, pad] if isinstance(pad, int) else list(pad) for pad in padding]
+
     def pad_volume(self, padding=None):
         padding = self.padding if padding is None else padding
         if padding is None:
             return self.volume
         else:
-            #for symmertic padding only one int can be passed for each axis
-            assert_(all(isinstance(pad, (int, tuple, list)) for pad in self.padding),\
-                "Expect int or iterable", TypeError)
-            self.padding = [[pad, pad] if isinstance(pad, int) else pad for pad in self.padding]
+            self.padding = self._normalize_padding(padding)
+            pad_width = [[0, 0]] + self.padding if self.is_multichannel else self.padding
             self.volume = np.pad(self.volume,
-                                 pad_width=self.padding,
+                                 pad_width=pad_width,
                                  mode=self.padding_mode)
+            self._volume_is_padded = True
             return self.volume
 
-    def make_sliding_windows(self):
+    # get the effective shape (without channels) after padding
+    def get_shape(self):
         shape = self.volume.shape[1:] if self.is_multichannel else self.volume.shape
-        return list(vu.slidingwindowslices(shape=list(shape),
-                                           window_size=self.window_size,
-                                           strides=self.stride,
-                                           shuffle=self.shuffle,
-                                           add_overhanging=True,
-                                           ds=self.downsampling_ratio))
+        if self._volume_is_padded:
+            return tuple(shape)
+        return tuple(sh + sum(pad) for sh, pad in zip(shape, self.padding))
+
+    @staticmethod
+    def _padded_indices(start, stop, step, pad_before, size, mode):
+        # Indices into an axis of length `size` for the positions `start:stop:step` of that
+        # axis padded with `pad_before` (like np.pad), and which of them are in the axis
+        indices = np.arange(start, stop, step) - pad_before
+        valid = (indices >= 0) & (indices < size)
+        if mode == 'reflect':
+            period = max(2 * (size - 1), 1)
+            indices = np.mod(indices, period)
+            indices = np.where(indices >= size, period - indices, indices)
+        elif mode == 'symmetric':
+            indices = np.mod(indices, 2 * size)
+            indices = np.where(indices >= size, 2 * size - 1 - indices, indices)
+        elif mode == 'wrap':
+            indices = np.mod(indices, size)
+        else:
+            indices = np.clip(indices, 0, size - 1)
+        return indices, valid
+
+    def load_window(self, slices):
+        """
+        Loads the window at `slices` (in the padded volume, like the slices in
+        `base_sequence`). Windows in the interior of the volume are views of the volume,
+        windows extending into the padding are padded.
+        """
+        channels = (slice(None),) if self.is_multichannel else ()
+        if self._volume_is_padded:
+            return self.volume[channels + tuple(slices)]
+        volume_shape = self.volume.shape[1:] if self.is_multichannel else self.volume.shape
+        # Positions in the volume without padding
+        starts = [sl.start - pad[0] for sl, pad in zip(slices, self.padding)]
+        stops = [sl.stop - pad[0] for sl, pad in zip(slices, self.padding)]
+        if all(start >= 0 and stop <= size
+               for start, stop, size in zip(starts, stops, volume_shape)):
+            return self.volume[channels + tuple(slice(start, stop, sl.step)
+                                                for start, stop, sl in zip(starts, stops,
+                                                                           slices))]
+        indices, valid = zip(*[self._padded_indices(sl.start, sl.stop, sl.step or 1, pad[0],
+                                                    size, self.padding_mode)
+                               for sl, pad, size in zip(slices, self.padding, volume_shape)])
+        window = self.volume[channels + np.ix_(*indices)]
+        if self.padding_mode == 'constant':
+            for axis, axis_valid in enumerate(valid):
+                if not axis_valid.all():
+                    window[channels + (slice(None),) * axis + (~axis_valid,)] = 0
+        return window
+
+    def make_sliding_windows(self):
+        return vu.SlidingWindows(shape=list(self.shape),
+                                 window_size=self.window_size,
+                                 strides=self.stride,
+                                 shuffle=self.shuffle,
+                                 add_overhanging=True,
+                                 ds=self.downsampling_ratio)
 
     def __getitem__(self, index):
         # Casting to int would allow index to be IndexSpec objects.
         index = int(index)
         slices = self.base_sequence[index]
+        sliced_volume = self.load_window(slices)
         if self.is_multichannel:
             slices = (slice(None),) + tuple(slices)
-        sliced_volume = self.volume[tuple(slices)]
         if self.transforms is None:
             transformed = sliced_volume
         else:
@@ -286,3 +360,106 @@ class TIFVolumeLoader(VolumeLoader):
         # Initialize superclass with the volume
         super(TIFVolumeLoader, self).__init__(volume=volume, transforms=transforms,
                                               **slicing_config)
+
+
+class MemmapVolumeLoader(VolumeLoader):
+    """
+    Loader for volumes stored in .npy or raw files, which are memory mapped instead of read.
+    The windows are views of the memory map, and the pages of the file are shared by all
+    processes reading them (DataLoader workers, or other jobs on the same machine) through
+    the page cache. Memory hence doesn't grow with the number of workers.
+
+    Use `inferno.utils.io_utils.tonpy` to convert a volume (e.g. from a hdf5 file) to a .npy
+    or raw file.
+
+    Parameters
+    ----------
+    path: str
+        path to the file. Files with the extension .npy are loaded with their header,
+        other files are read as raw data (which requires `dtype` and `shape`).
+    dtype: str or np.dtype (default: None)
+        data type of a raw file
+    shape: list or tuple (default: None)
+        shape of the volume in a raw file
+    offset: int (default: 0)
+        offset of the volume in a raw file in bytes
+    order: str (default: 'C')
+        memory layout of the volume in a raw file ('C' or 'F')
+    mode: str (default: 'c')
+        mode of the memory map (see `np.memmap`). With 'c' (copy-on-write), the windows can
+        be modified in memory (e.g. by transforms) without changing the file.
+    data_slice: slice (default: None)
+        slice of the volume to load windows from
+    transforms: callable (default: None)
+       transforms applied on each batch loaded from volume
+    name: str (default: None)
+        name of this volume
+    slicing_config: kwargs
+        keyword arguments for base class `VolumeLoader`
+    """
+    def __init__(self, path, dtype=None, shape=None, offset=0, order='C', mode='c',
+                 data_slice=None, transforms=None, name=None, **slicing_config):
+        if isinstance(path, dict):
+            assert name is not None
+            assert name in path
+            self.path = path.get(name)
+        elif isinstance(path, str):
+            assert os.path.exists(path), path
+            self.path = path
+        else:
+            raise NotImplementedError
+
+        if data_slice is None or isinstance(data_slice, (str, list)):
+            self.data_slice = vu.parse_data_slice(data_slice)
+        elif isinstance(data_slice, dict):
+            assert name is not None
+            assert name in data_slice
+            self.data_slice = vu.parse_data_slice(data_slice.get(name))
+        else:
+            raise NotImplementedError
+
+        slicing_config_for_name = pyu.get_config_for_name(slicing_config, name)
+
+        # adapt data-slice if this is a multi-channel volume (slice is not applied to channel dimension)
+        if self.data_slice is not None and slicing_config_for_name.get('is_multichannel', False):
+            self.data_slice = (slice(None),) + self.data_slice
+
+        assert 'window_size' in slicing_config_for_name
+        assert 'stride' in slicing_config_for_name
+        # Padding the whole volume would read it into memory
+        assert_(slicing_config_for_name.get('padding') is None or
+                slicing_config_for_name.get('padding_mode', 'reflect') in
+                self.VIRTUAL_PADDING_MODES,
+                "Only padding modes {} are supported for memory mapped volumes."
+                .format(self.VIRTUAL_PADDING_MODES),
+                NotImplementedError)
+
+        self.is_npy = self.path.lower().endswith('.npy')
+        assert_(self.is_npy or (dtype is not None and shape is not None),
+                "Need the `dtype` and `shape` to load a raw file.",
+                ValueError)
+        self.raw_config = dict(dtype=dtype, shape=None if shape is None else tuple(shape),
+                               offset=offset, order=order)
+        self.mode = mode
+        # Initialize superclass with the memory mapped volume
+        super(MemmapVolumeLoader, self).__init__(volume=self.open_volume(), name=name,
+                                                 transforms=transforms,
+                                                 **slicing_config_for_name)
+
+    def open_volume(self):
+        """Memory maps the volume (and applies the data slice)."""
+        if self.is_npy:
+            volume = np.load(self.path, mmap_mode=self.mode)
+        else:
+            volume = np.memmap(self.path, mode=self.mode, **self.raw_config)
+        return volume[self.data_slice] if self.data_slice is not None else volume
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Memory maps are pickled as copies of the data, so the file is mapped again instead
+        state['volume'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.volume = self.open_volume()
@@ -57,6 +57,88 @@ def slidingwindowslices(shape, window_size, strides,
     return it.product(*nslices)
 
 
+class SlidingWindows(object):
+    """
+    The sliding windows over a volume, in the same order as `slidingwindowslices` (with the
+    same arguments) yields them. Instead of materializing a tuple of slices per window, only
+    the start positions along every axis are stored, and the slices of a window are computed
+    from its index (by decoding it into one index per axis). Memory is hence independent of
+    the number of windows, and so is the cost of sending it to DataLoader workers.
+
+    Supports `len`, indexing, iteration and slicing (which returns a `SlidingWindows` over
+    the selected windows).
+    """
+    def __init__(self, shape, window_size, strides, ds=1, shuffle=False, rngseed=None,
+                 add_overhanging=True):
+        # only support lists or tuples for shape, window_size and strides
+        assert isinstance(shape, (list, tuple))
+        assert isinstance(window_size, (list, tuple)), "%s" % (str(type(window_size)))
+        assert isinstance(strides, (list, tuple))
+
+        dim = len(shape)
+        assert len(window_size) == dim
+        assert len(strides) == dim
+
+        # check for downsampling
+        assert isinstance(ds, (list, tuple, int))
+        if isinstance(ds, int):
+            ds = [ds] * dim
+        assert len(ds) == dim
+
+        # Seed RNG if a seed is provided
+        if rngseed is not None:
+            random.seed(rngseed)
+
+        stops = [dimsize - wsize if wsize != dimsize else dimsize
+                 for dimsize, wsize in zip(shape, window_size)]
+        assert all(stp > 0 for stp in stops), "%s, %s" % (str(dim * [0]), str(stops))
+
+        self.window_size = list(window_size)
+        self.ds = list(ds)
+        self.starts = []
+        for stop, wsize, stride, dimsize in zip(stops, window_size, strides, shape):
+            starts = [st for st in range(0, stop + 1, stride) if st + wsize <= dimsize]
+            # add an overhanging window at the end if the windows
+            # do not fit and `add_overhanging`
+            if starts[-1] + wsize != dimsize and add_overhanging:
+                starts.append(dimsize - wsize)
+            if shuffle:
+                random.shuffle(starts)
+            self.starts.append(starts)
+        num_windows = 1
+        for starts in self.starts:
+            num_windows *= len(starts)
+        self._indices = range(num_windows)
+
+    def __len__(self):
+        return len(self._indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            new = type(self).__new__(type(self))
+            new.__dict__.update(self.__dict__)
+            new._indices = self._indices[index]
+            return new
+        # Raises an IndexError if out of range, and deals with negative indices
+        remainder = self._indices[index]
+        # Decode the index, the last axis varying fastest
+        slices = []
+        for starts, wsize, ds in zip(reversed(self.starts), reversed(self.window_size),
+                                     reversed(self.ds)):
+            remainder, axis_index = divmod(remainder, len(starts))
+            start = starts[axis_index]
+            slices.append(slice(start, start + wsize, ds))
+        return tuple(reversed(slices))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __repr__(self):
+        return "{}(num_windows={}, window_size={})".format(type(self).__name__, len(self),
+                                                           self.window_size)
+
+
 # This code is legacy af, don't judge
 # Define a sliding window iterator (this time, more readable than a wannabe one-liner)
 def slidingwindowslices_depr(shape, nhoodsize, stride=1, ds=1, window=None, ignoreborder=True,
@@ -1,9 +1,10 @@
 from datetime import datetime
 from inspect import signature
+import copy
 import os
-import shutil
 import contextlib
 import warnings
+import weakref
 
 # These are fetched from globals, they're not unused
 # noinspection PyUnresolvedReferences
@@ -13,23 +14,32 @@ import pickle
 
 
 import torch
+import torch.distributed as dist
 from numpy import inf
 from torch.autograd import Variable
 from torch.utils.data import DataLoader
 from torch.nn.parallel.data_parallel import data_parallel
+from torch.nn.parallel import DistributedDataParallel
 from .callbacks.logging.base import Logger
 from .callbacks.logging import get_logger
 
 from ..utils import train_utils as tu
 from ..utils import python_utils as pyu
 from ..utils import torch_utils as thu
+from ..utils import checkpoint_utils as cu
+from ..utils import model_utils as mu
 from ..extensions import metrics
 from ..extensions import optimizers
 from ..extensions import criteria
 from .callbacks import CallbackEngine
 from .callbacks import Console
+from .evaluator import BackgroundEvaluator
+from . import distributed as distributed_utils
 from ..utils.exceptions import assert_, NotSetError, NotTorchModuleError, DeviceError
 
+# Stands in for the phase timer's context manager if phases are not being timed
+_NOT_TIMED = contextlib.suppress()
+
 
 class Trainer(object):
     """A basic trainer.
@@ -61,6 +71,10 @@ class Trainer(object):
         self._optimizer = None
         self._criterion = None
         self._retain_graph = False
+        self._accumulate_gradients_over = 1
+        # Compilation
+        self._compile = None
+        self._compiled_model = None
 
         # Metric evaluation
         self._metric = None
@@ -77,6 +91,9 @@ class Trainer(object):
         self._loaders = {}
         self._loader_iters = {}
         self._loader_specs = {}
+        # Loaders whose prefetcher finished a pass that has not been followed by an epoch yet
+        self._exhausted_prefetchers = set()
+        self._prefetch_depth = 0
 
         # Iteration and epoch book-keeping
         self._iteration_count = 0
@@ -87,6 +104,7 @@ class Trainer(object):
         # GPU and dtype business
         self._use_cuda = False
         self._dtype = 'float'
+        self._grad_scaler = None
         self._devices = None
         self._base_device_ordinal = None
 
@@ -96,6 +114,14 @@ class Trainer(object):
         self._is_iteration_with_best_validation_score = False
         self._validate_every = None
         self._num_validation_iterations = None
+        # Validation in a separate process
+        self._validate_in_background = False
+        self._background_validation_kwargs = {}
+        self._background_evaluator = None
+
+        # Distributed data-parallel training
+        self._distributed = None
+        self._distributed_model = None
         self._target_batch_dim = 0
         self._validation_criterion = None
         # We should exclude the zero-th epoch from validation
@@ -109,6 +135,7 @@ class Trainer(object):
         self._save_every = None
         self._save_to_directory = None
         self._pickle_module = 'pickle'
+        self._checkpoint_format = 'pickle'
         # Defaults for file names
         self._checkpoint_filename = 'checkpoint.pytorch'
         self._best_checkpoint_filename = 'best_checkpoint.pytorch'
@@ -117,6 +144,10 @@ class Trainer(object):
         self._last_saved_at_epoch = 0
         # This is to allow a callback to trigger a save by setting trainer.save_now = True
         self._save_externally_triggered = False
+        # Asynchronous checkpointing
+        self._save_asynchronously = False
+        self._max_pending_saves = 1
+        self._checkpoint_writer = None
 
         # Stopping conditions
         self._max_num_iterations = None
@@ -125,6 +156,10 @@ class Trainer(object):
         # Callbacks and states
         self._callback_engine = CallbackEngine().bind_trainer(self)
         self._state = {}
+        self._retained_states = None
+
+        # Instrumentation
+        self._phase_timer = None
 
         # Print console
         self._console = Console()
@@ -152,7 +187,7 @@ class Trainer(object):
         """Gets the callback engine."""
         return self._callback_engine
 
-    def register_callback(self, callback, trigger='auto', **callback_kwargs):
+    def register_callback(self, callback, trigger='auto', priority=0, **callback_kwargs):
         """
         Registers a callback with the internal callback engine.
 
@@ -164,6 +199,9 @@ class Trainer(object):
             Specify the event that triggers the callback. Leave at 'auto' to have the
             callback-engine figure out the triggers. See
             `inferno.training.callbacks.base.CallbackEngine` documentation for more on this.
+        priority : int or float
+            Callbacks are called in the order of decreasing priority (and in the order of
+            registration if the priorities are equal).
         callback_kwargs : dict
             If `callback` is a type, initialize an instance with these keywords to the
             __init__ method.
@@ -174,7 +212,7 @@ class Trainer(object):
         """
         if isinstance(callback, type):
             callback = callback(**callback_kwargs)
-        self._callback_engine.register_callback(callback, trigger=trigger)
+        self._callback_engine.register_callback(callback, trigger=trigger, priority=priority)
         return self
 
     @property
@@ -205,11 +243,87 @@ class Trainer(object):
                 "Model must be a torch.nn.Module.",
                 NotTorchModuleError)
         self._model = model
+        self._compiled_model = None
         # Transfer model to GPU if required
         if self._use_cuda:
             self._model.cuda()
         return self
 
+    def compile(self, mode='default', method='auto', yes=True, **compile_kwargs):
+        """
+        Compile the model to reduce the overhead of running it op by op in python.
+
+        The model is compiled (with `torch.compile` or TorchScript) the first time it's
+        applied, and the compiled model shares its parameters with the model. The model
+        itself is left untouched, and it's what the checkpoints contain; it's compiled
+        again once a checkpoint is loaded. Whatever fails to compile runs eagerly: with
+        `torch.compile`, that's decided per compiled frame, and with TorchScript, per
+        module (see `inferno.utils.model_utils.script_model`). If compiling fails
+        altogether, the trainer falls back to the eager model with a warning.
+
+        Note that the compiled model is not used for (multi-GPU or distributed) data
+        parallel training.
+
+        Parameters
+        ----------
+        mode : str
+            Compilation mode passed on to `torch.compile`, e.g. 'default',
+            'reduce-overhead' or 'max-autotune'. Ignored by TorchScript.
+        method : {'auto', 'compile', 'script'}
+            Whether to compile with `torch.compile` or with TorchScript. 'auto' uses
+            `torch.compile` if it's available (torch >= 2.0).
+        yes : bool
+            Whether to compile the model.
+        compile_kwargs : dict
+            Further keyword arguments to `torch.compile` (e.g. `backend` or `dynamic`).
+
+        Returns
+        -------
+        Trainer
+            self
+        """
+        assert_(method in ['auto', 'compile', 'script'],
+                "`method` must be one of ['auto', 'compile', 'script'], got {} instead."
+                .format(method),
+                ValueError)
+        if method == 'auto':
+            method = 'compile' if hasattr(torch, 'compile') else 'script'
+        if method == 'compile':
+            compile_kwargs.update({'mode': mode})
+        self._compile = dict(method=method, **compile_kwargs) if yes else None
+        self._compiled_model = None
+        return self
+
+    @property
+    def compiles_model(self):
+        # Trainers loaded from old pickle files might not have '_compile'
+        return getattr(self, '_compile', None) is not None
+
+    @property
+    def compiled_model(self):
+        """Gets the compiled model (or the model, if it's not to be compiled)."""
+        if not self.compiles_model:
+            return self.model
+        if getattr(self, '_compiled_model', None) is None:
+            self._compiled_model = mu.compile_model(self.model, **self._compile)
+        return self._compiled_model
+
+    def _apply_compiled_model(self, *inputs):
+        model = self.compiled_model
+        if model is self.model:
+            return model(*inputs)
+        # TorchScript modules keep their own train/eval flag
+        if model.training != self.model.training:
+            model.train(self.model.training)
+        try:
+            with mu.compilation_errors_suppressed():
+                return model(*inputs)
+        except mu.COMPILATION_ERRORS as error:
+            warnings.warn("Could not compile the model ({}: {}), falling back to eager "
+                          "execution.".format(type(error).__name__, error))
+            self._compiled_model = self.model
+            return self.model(*inputs)
+
     @property
     def model_is_defined(self):
         return self._model is not None
@@ -622,6 +736,24 @@ class Trainer(object):
                 f"got {value} instead.", ValueError)
         self._pickle_module = value
 
+    _ALLOWED_CHECKPOINT_FORMATS = {'pickle', 'structured'}
+
+    @property
+    def checkpoint_format(self):
+        """
+        Gets the format checkpoints are written in: either 'pickle' (the entire trainer is
+        pickled with `torch.save`) or 'structured' (see `inferno.utils.checkpoint_utils`).
+        """
+        # Trainers loaded from old pickle files might not have '_checkpoint_format'
+        return getattr(self, '_checkpoint_format', 'pickle')
+
+    @checkpoint_format.setter
+    def checkpoint_format(self, value):
+        assert_(value in self._ALLOWED_CHECKPOINT_FORMATS,
+                f"Checkpoint format must be one of {self._ALLOWED_CHECKPOINT_FORMATS}, "
+                f"got {value} instead.", ValueError)
+        self._checkpoint_format = value
+
     @property
     def saving_every(self):
         """Gets the frequency at which checkpoints are made."""
@@ -661,7 +793,8 @@ class Trainer(object):
         self._save_externally_triggered = bool(value)
 
     def save_every(self, frequency, to_directory=None,
-                   checkpoint_filename=None, best_checkpoint_filename=None):
+                   checkpoint_filename=None, best_checkpoint_filename=None,
+                   checkpoint_format=None):
         """
         Set checkpoint creation frequency.
 
@@ -675,6 +808,10 @@ class Trainer(object):
             Name of the checkpoint file.
         best_checkpoint_filename : str
             Name of the best checkpoint file.
+        checkpoint_format : str
+            Format of the checkpoints, 'pickle' or 'structured'. Structured checkpoints
+            keep the tensors apart from the rest of the trainer, which allows them to be
+            memory-mapped when loading.
         Returns
         -------
         Trainer
@@ -683,6 +820,8 @@ class Trainer(object):
         self._save_every = tu.Frequency.build_from(frequency, priority='iterations')
         assert self._save_every.is_consistent
         self.save_to_directory(to_directory, checkpoint_filename, best_checkpoint_filename)
+        if checkpoint_format is not None:
+            self.checkpoint_format = checkpoint_format
         return self
 
     @property
@@ -706,6 +845,58 @@ class Trainer(object):
             self._best_checkpoint_filename = best_checkpoint_filename
         return self
 
+    def save_asynchronously(self, yes=True, max_pending_saves=1):
+        """
+        Write checkpoints in a background thread.
+
+        When saving, the trainer is snapshotted: the tensors of the model and the state of
+        the optimizer are copied to host memory, and everything else is deep-copied. The
+        training resumes while the snapshot is serialized and written to disk. With
+        `max_pending_saves` snapshots still being written, the next save blocks until the
+        oldest is on disk. The checkpoints are the same as the ones saved synchronously
+        (e.g. the tensors are loaded to the devices they were on).
+
+        Parameters
+        ----------
+        yes : bool
+            Whether to save asynchronously.
+        max_pending_saves : int
+            Maximum number of checkpoints that may be pending (i.e. held in memory
+            waiting to be written) at any given time.
+
+        Returns
+        -------
+        Trainer
+            self
+        """
+        assert_(isinstance(max_pending_saves, int) and max_pending_saves >= 1,
+                "`max_pending_saves` must be a positive integer, got {} instead."
+                .format(max_pending_saves),
+                ValueError)
+        if not yes:
+            self.wait_for_pending_saves()
+        self._save_asynchronously = yes
+        self._max_pending_saves = max_pending_saves
+        self._checkpoint_writer = None
+        return self
+
+    @property
+    def saving_asynchronously(self):
+        # Trainers loaded from old pickle files might not have '_save_asynchronously'
+        return getattr(self, '_save_asynchronously', False)
+
+    @property
+    def checkpoint_writer(self):
+        if getattr(self, '_checkpoint_writer', None) is None:
+            self._checkpoint_writer = pyu.BackgroundWorker(max_pending=self._max_pending_saves)
+        return self._checkpoint_writer
+
+    def wait_for_pending_saves(self):
+        """Blocks until all checkpoints being written in the background are on disk."""
+        if getattr(self, '_checkpoint_writer', None) is not None:
+            self._checkpoint_writer.wait()
+        return self
+
     @property
     def validating_every(self):
         return self._validate_every
@@ -763,6 +954,301 @@ class Trainer(object):
         self._num_validation_iterations = for_num_iterations
         return self
 
+    def validate_in_background(self, yes=True, num_threads=None, max_pending_validations=1,
+                               start_method='spawn'):
+        """
+        Validate in a separate process, while training goes on.
+
+        When it's time to validate, `fit` hands a snapshot of the model's weights to an
+        evaluator process (see `inferno.trainers.evaluator.BackgroundEvaluator`) which owns
+        the 'validate' loader, and resumes training right away. The evaluator's results
+        are collected between training runs: they are recorded in the trainer's state
+        ('validation_loss_averaged' and 'validation_error_averaged') and the
+        `END_OF_VALIDATION_RUN` callbacks are called (without the meters), such that
+        e.g. `SaveAtBestValidationScore` and `AutoLR` work as usual. Note however that the
+        results are delayed: they arrive (and are acted upon) a few iterations after the
+        snapshot was taken. The model must therefore not depend on being validated with
+        the latest weights, and the states set per validation iteration (e.g.
+        'validation_prediction') are not available.
+
+        Parameters
+        ----------
+        yes : bool
+            Whether to validate in the background.
+        num_threads : int
+            Number of threads the evaluator process may use. On multi-core CPUs, it's
+            usually a good idea to split the cores between the trainer and the evaluator
+            (see `torch.set_num_threads`).
+        max_pending_validations : int
+            Maximum number of snapshots that may be waiting to be validated. If the
+            evaluator falls behind, `fit` blocks until it has caught up.
+        start_method : str
+            Multiprocessing start method of the evaluator process.
+
+        Returns
+        -------
+        Trainer
+            self
+        """
+        self.close_background_evaluator()
+        self._validate_in_background = yes
+        self._background_validation_kwargs = dict(num_threads=num_threads,
+                                                  max_pending=max_pending_validations,
+                                                  start_method=start_method)
+        return self
+
+    @property
+    def validating_in_background(self):
+        # Trainers loaded from old pickle files might not have '_validate_in_background'
+        return getattr(self, '_validate_in_background', False)
+
+    @property
+    def background_evaluator(self):
+        if getattr(self, '_background_evaluator', None) is None:
+            assert_('validate' in self._loaders,
+                    "Can't validate in the background without a 'validate' loader.",
+                    NotSetError)
+            # The evaluator gets its own copy of the trainer - minus everything it doesn't
+            # need for validating.
+            config_dict = self.get_config()
+            config_dict.update({'_loaders': {'validate': self._loaders['validate']},
+                                '_callback_engine': CallbackEngine(),
+                                '_logger': None,
+                                '_optimizer': None,
+                                '_state': {},
+                                '_save_every': None,
+                                '_validate_in_background': False,
+                                '_background_validation_kwargs': {}})
+            self._background_evaluator = BackgroundEvaluator(config_dict,
+                                                             pickle_module=self.pickle_module,
+                                                             **self._background_validation_kwargs)
+        return self._background_evaluator
+
+    def close_background_evaluator(self):
+        """Shuts the evaluator process down (if there is one)."""
+        if getattr(self, '_background_evaluator', None) is not None:
+            self._background_evaluator.close()
+            self._background_evaluator = None
+        return self
+
+    def submit_validation(self):
+        """
+        Submits a snapshot of the model to the background evaluator. The results are
+        recorded by `collect_validation_results`.
+        """
+        # Record the epoch we're validating in
+        self._last_validated_at_epoch = self._epoch_count
+        self._last_validated_at_iteration = self._iteration_count
+        # Copy, because the weights are updated in place while the snapshot is validated
+        state_dict = {key: value.detach().to('cpu', copy=True)
+                      for key, value in self.model.state_dict().items()}
+        self.background_evaluator.submit(state_dict,
+                                         iteration_count=self._iteration_count,
+                                         epoch_count=self._epoch_count)
+        return self
+
+    def collect_validation_results(self, wait=False):
+        """
+        Records the results of the background validation runs that are done (or, if
+        `wait`, of all that were submitted).
+        """
+        if getattr(self, '_background_evaluator', None) is None:
+            return self
+        for result in self._background_evaluator.poll(block=wait):
+            assert_(result.traceback is None,
+                    "Background validation of the snapshot taken at iteration {} failed:\n{}"
+                    .format(result.iteration_count, result.traceback),
+                    RuntimeError)
+            self.record_validation_results(result.validation_loss, result.validation_error)
+            self.console.info("Validation loss (at iteration {}): {}; validation error: {}"
+                              .format(result.iteration_count, result.validation_loss,
+                                      result.validation_error))
+            self.callbacks.call(self.callbacks.END_OF_VALIDATION_RUN,
+                                validation_loss_meter=None,
+                                validation_error_meter=None,
+                                validated_at_iteration=result.iteration_count,
+                                validated_at_epoch=result.epoch_count)
+        return self
+
+    def distributed(self, num_processes=None, backend='gloo', init_method=None,
+                    num_threads=None, start_method='spawn'):
+        """
+        Train data-parallel in multiple processes with `torch.distributed`.
+
+        With `num_processes` set, `fit` launches as many worker processes (on this
+        machine), each of which fits a copy of the trainer. Otherwise, the trainer is
+        expected to be running in one of the processes of a process group that's launched
+        externally (e.g. with `torchrun`, possibly over multiple nodes), and `fit` joins
+        that process group (if it's not initialized already).
+
+        In every process, the model is wrapped in a `DistributedDataParallel`, such that
+        the gradients are averaged over all processes, and every bound loader is sharded
+        with a `DistributedSampler`. Validation results are averaged over all processes.
+        Callbacks are called at every rank, such that the ones that modify the training
+        (e.g. clip gradients or trigger validation) keep the replicas in sync. Callbacks
+        that only have side effects outside of the training (e.g. the logger, see
+        `Callback.RANK_ZERO_ONLY`) are called and checkpoints are saved at rank 0 only.
+        Since callbacks might schedule the hyperparameters of the optimizer based on
+        states that differ between ranks (e.g. the training loss), these are broadcast
+        from rank 0 before every optimizer step. Once the worker processes launched by
+        `fit` are done, the trainer is updated with the state of the trainer at rank 0.
+
+        Parameters
+        ----------
+        num_processes : int
+            Number of processes to launch. Leave to None if the processes are launched
+            externally.
+        backend : str
+            Backend of `torch.distributed`. 'gloo' works on CPUs.
+        init_method : str
+            URL specifying how to initialize the process group. Defaults to a free TCP
+            port on localhost if `num_processes` is given, and to 'env://' otherwise.
+        num_threads : int
+            Number of threads every launched process may use. Defaults to the number of
+            CPUs divided by the number of processes.
+        start_method : str
+            Multiprocessing start method of the launched processes.
+
+        Returns
+        -------
+        Trainer
+            self
+        """
+        assert_(num_processes is None or (isinstance(num_processes, int) and num_processes > 0),
+                "`num_processes` must be a positive integer, got {} instead."
+                .format(num_processes),
+                ValueError)
+        assert_(dist.is_available(), "torch.distributed is not available.", RuntimeError)
+        if num_threads is None and num_processes is not None:
+            num_threads = max(1, (os.cpu_count() or 1) // num_processes)
+        self._distributed = dict(num_processes=num_processes, backend=backend,
+                                 init_method=init_method, num_threads=num_threads,
+                                 start_method=start_method)
+        return self
+
+    @property
+    def is_distributed(self):
+        # Trainers loaded from old pickle files might not have '_distributed'
+        return getattr(self, '_distributed', None) is not None
+
+    @property
+    def distributed_model(self):
+        """The `DistributedDataParallel` model while fitting distributed, None otherwise."""
+        return getattr(self, '_distributed_model', None)
+
+    @property
+    def rank(self):
+        """Rank of this process while fitting distributed, 0 otherwise."""
+        return dist.get_rank() if self.distributed_model is not None else 0
+
+    def _setup_distributed(self):
+        # Runs in each of the processes of the (initialized) process group
+        assert_(self._devices is None,
+                "Distributed training can't be combined with multi-GPU data parallelism.",
+                RuntimeError)
+        assert_(not self.validating_in_background,
+                "Distributed training can't be combined with background validation.",
+                RuntimeError)
+        world_size, rank = dist.get_world_size(), dist.get_rank()
+        for name, loader in list(self._loaders.items()):
+            # All processes must make the same number of training steps, whereas every
+            # sample must be evaluated exactly once
+            loader = distributed_utils.shard_loader(loader, world_size, rank,
+                                                    pad=(name == 'train'))
+            self.bind_loader(name, loader, **self._loader_specs.get(name, {}))
+        self._set_loader_epochs()
+        self._distributed_model = DistributedDataParallel(self.model)
+        if rank != 0:
+            # Callbacks that only have side effects (including the logger) run at rank 0
+            self.callbacks.skip_rank_zero_only_callbacks()
+            self._logger = None
+            self.console.toggle_info(False)
+            self.console.toggle_progress(False)
+        return self
+
+    def _fit_distributed(self, max_num_iterations=None, max_num_epochs=None):
+        fit_kwargs = dict(max_num_iterations=max_num_iterations, max_num_epochs=max_num_epochs)
+        settings = self._distributed
+        if settings['num_processes'] is None:
+            # The processes are launched externally, so all that's left to do is to join
+            # the process group
+            dist.init_process_group(settings['backend'],
+                                    init_method=settings['init_method'] or 'env://')
+            return self.fit(**fit_kwargs)
+        self.wait_for_pending_saves()
+        result = distributed_utils.launch(self.get_config(exclude_loader=False),
+                                          world_size=settings['num_processes'],
+                                          backend=settings['backend'],
+                                          init_method=settings['init_method'],
+                                          num_threads=settings['num_threads'],
+                                          fit_kwargs=fit_kwargs,
+                                          start_method=settings['start_method'],
+                                          pickle_module=self.pickle_module)
+        self.set_config(result)
+        return self
+
+    def _broadcast_hyperparameters(self):
+        # Callbacks (e.g. LR schedules) might change the hyperparameters based on states
+        # that differ between ranks, so rank 0 has the final say
+        hyperparameters = [(param_group, key)
+                           for param_group in self.optimizer.param_groups
+                           for key in sorted(param_group)
+                           if isinstance(param_group[key], (int, float)) and
+                           not isinstance(param_group[key], bool)]
+        values = torch.tensor([param_group[key] for param_group, key in hyperparameters],
+                              dtype=torch.float64)
+        dist.broadcast(values, src=0)
+        for (param_group, key), value in zip(hyperparameters, values.tolist()):
+            param_group[key] = type(param_group[key])(value)
+        return self
+
+    @staticmethod
+    def _all_reduce_meter(meter):
+        totals = torch.tensor([meter.sum, meter.count], dtype=torch.float64)
+        dist.all_reduce(totals)
+        total, count = totals.tolist()
+        meter.reset()
+        if count > 0:
+            meter.update(total / count, n=int(count))
+        return meter
+
+    @property
+    def accumulating_gradients_over(self):
+        # Trainers loaded from old pickle files might not have '_accumulate_gradients_over'
+        return getattr(self, '_accumulate_gradients_over', 1)
+
+    def accumulate_gradients(self, num_batches):
+        """
+        Accumulate gradients over multiple batches before updating the parameters.
+
+        With `num_batches = N`, every training iteration processes N batches and makes a
+        single optimizer step with the gradient of the loss averaged over these batches.
+        This results in an effective batch size of N times the loader's batch size, but
+        with the memory footprint of a single batch. Note that the iteration count (and
+        therefore all frequencies measured in iterations, e.g. for validation, saving,
+        logging or LR scheduling) counts optimizer steps and not batches.
+
+        Accumulation windows don't span epochs: the last window of an epoch is cut short if
+        the number of batches per epoch is not a multiple of N, and its gradient is averaged
+        over the batches it has.
+
+        Parameters
+        ----------
+        num_batches : int
+            Number of batches to accumulate gradients over. Set to 1 to disable
+            gradient accumulation.
+
+        Returns
+        -------
+        Trainer
+            self
+        """
+        assert_(isinstance(num_batches, int) and num_batches >= 1,
+                "`num_batches` must be a positive integer, got {} instead.".format(num_batches),
+                ValueError)
+        self._accumulate_gradients_over = num_batches
+        return self
+
     @property
     def iteration_count(self):
         return self._iteration_count
@@ -848,17 +1334,45 @@ class Trainer(object):
     # The following dictionary maps state keys to the corresponding trainer attribute
     DYNAMIC_STATES = {'learning_rate': 'current_learning_rate'}
 
-    def update_state(self, key, value):
+    def update_state(self, key, value, lazy=False):
+        """
+        Updates the trainer state at `key`.
+
+        Parameters
+        ----------
+        key : str
+            State key.
+        value : object
+            State value.
+        lazy : bool
+            If True, `value` must be a tensor or variable (or a list of these), which is
+            unwrapped (i.e. copied to the CPU) only once it's read with `get_state`. If
+            the key is not among the states to retain (see `retain_states`), the value is
+            dropped altogether. Values that are not scalars and have not been read by the
+            time the next training or validation iteration begins are dropped as well.
+
+        Returns
+        -------
+        Trainer
+            self
+        """
         assert key not in self.DYNAMIC_STATES, \
             "State at key '{}' cannot be updated because it's dynamic.".format(key)
+        if lazy:
+            if not self.state_is_retained(key):
+                self._state.pop(key, None)
+                return self
+            value = thu.DeferredUnwrap(value)
         self._state.update({key: value})
         return self
 
-    def update_state_from_dictionary(self, dictionary):
+    def update_state_from_dictionary(self, dictionary, lazy=True):
         # Unwrap variables (or tensors)
-        self._state.update({
-            state_key: thu.unwrap(state)
-            for state_key, state in dictionary.items()})
+        for state_key, state in dictionary.items():
+            if lazy:
+                self.update_state(state_key, state, lazy=True)
+            else:
+                self.update_state(state_key, thu.unwrap(state))
 
     def update_state_from_model_state_hooks(self):
         if hasattr(self.model, '_state_hooks'):
@@ -870,7 +1384,63 @@ class Trainer(object):
         if key in self.DYNAMIC_STATES:
             return getattr(self, self.DYNAMIC_STATES.get(key), default)
         else:
-            return self._state.get(key, default)
+            state = self._state.get(key, default)
+            if isinstance(state, thu.DeferredUnwrap):
+                state = state.value
+            return state
+
+    def retain_states(self, keys=None):
+        """
+        Declare the states that are to be retained by lazy state updates (see
+        `update_state`). These include the inputs, targets and predictions of the
+        training and validation iterations. The states not declared here are not kept
+        around, and cannot be read with `get_state`.
+
+        Retained states stay on the device they were computed on until they're read,
+        which saves the copies to the CPU, but costs device memory. To bound the latter,
+        the states that are not scalars (e.g. the inputs and the predictions) are dropped
+        at the start of the next iteration if they have not been read by then (i.e. they
+        can be read by callbacks up to and including the `begin_of_training_iteration`
+        and `begin_of_validation_iteration` triggers). The scalars (e.g. the loss and the
+        error) are kept until they're replaced. Declaring only the states that are
+        actually read (e.g. `['training_loss', 'training_error']`) keeps the other states
+        from holding on to device memory altogether.
+
+        Parameters
+        ----------
+        keys : list of str
+            Keys of the states to retain. Leave at None to retain all states.
+
+        Returns
+        -------
+        Trainer
+            self
+        """
+        self._retained_states = None if keys is None else set(pyu.to_iterable(keys))
+        return self
+
+    def retain_state(self, key):
+        """Adds `key` to the set of states to be retained, if such a set is declared."""
+        if self.retained_states is not None:
+            self._retained_states.add(key)
+        return self
+
+    @property
+    def retained_states(self):
+        # Trainers loaded from old pickle files might not have '_retained_states'
+        return getattr(self, '_retained_states', None)
+
+    def state_is_retained(self, key):
+        return self.retained_states is None or key in self.retained_states
+
+    def _release_deferred_states(self):
+        # Drops the lazily updated states that are not scalars and have not been read
+        # (and are therefore still held on the device), see `retain_states`
+        for key in [key for key, state in self._state.items()
+                    if isinstance(state, thu.DeferredUnwrap) and
+                    not state.is_unwrapped and not state.is_scalar]:
+            del self._state[key]
+        return self
 
     @property
     def current_learning_rate(self):
@@ -936,9 +1506,10 @@ class Trainer(object):
                     "Without dataparallelism, `base_device` cannot be 'cpu'.",
                     DeviceError)
         self._base_device_ordinal = {None: None, 'cpu': -1, 'cuda': None}.get(base_device)
-        # Move model to CUDA
+        # Move model to CUDA (and compile it again, once it's there)
         if self.model_is_defined:
             self.model.cuda()
+            self._compiled_model = None
         # Move criterion to cuda if base device ordinal is not -1 (i.e. CPU)
         # (the criterion is evaluated on the base device)
         if self.criterion_is_defined and self._base_device_ordinal != -1:
@@ -961,6 +1532,7 @@ class Trainer(object):
         """
         if self.model_is_defined:
             self.model.cpu()
+            self._compiled_model = None
         if self.criterion_is_defined:
             self.criterion.cpu()
         self._use_cuda = False
@@ -971,11 +1543,19 @@ class Trainer(object):
         """Returns whether using GPU for training."""
         return self._use_cuda
 
-    def to_device(self, objects):
+    def to_device(self, objects, non_blocking=False):
         if isinstance(objects, (list, tuple)):
-            return type(objects)([self.to_device(_object) for _object in objects])
+            return type(objects)([self.to_device(_object, non_blocking=non_blocking)
+                                  for _object in objects])
+        elif not self._use_cuda:
+            return objects
+        elif non_blocking and thu.is_tensor(objects) and not objects.is_cuda:
+            # Copies from pageable memory are synchronous, so the tensor is pinned first
+            if not objects.is_pinned():
+                objects = objects.pin_memory()
+            return objects.cuda(non_blocking=True)
         else:
-            return objects.cuda() if self._use_cuda else objects
+            return objects.cuda()
 
     def apply_model(self, *inputs):
         if hasattr(self, '_base_device_ordinal'):
@@ -983,26 +1563,35 @@ class Trainer(object):
             base_device_ordinal = self._base_device_ordinal
         else:
             base_device_ordinal = None
-        if self._devices is not None:
-            return data_parallel(self.model, inputs, list(self._devices),
-                                 output_device=base_device_ordinal)
-        else:
-            return self.model(*inputs)
+        with self.autocast():
+            if self._devices is not None:
+                output = data_parallel(self.model, inputs, list(self._devices),
+                                       output_device=base_device_ordinal)
+            elif self.distributed_model is not None and torch.is_grad_enabled():
+                # Gradients are synchronized across processes
+                output = self.distributed_model(*inputs)
+            elif self.compiles_model:
+                output = self._apply_compiled_model(*inputs)
+            else:
+                output = self.model(*inputs)
+        if self.uses_mixed_precision:
+            # Losses and metrics are evaluated in full precision
+            output = self.cast(output)
+        return output
 
     def cast(self, objects):
         if isinstance(objects, (list, tuple)):
             return type(objects)([self.cast(_object) for _object in objects])
+        elif thu.is_tensor(objects) and objects.is_floating_point():
+            # Cast only the float types, while leaving the ints alone. With mixed precision,
+            # the tensors remain in full precision (autocast takes care of the rest).
+            return getattr(objects, 'float' if self.uses_mixed_precision else self._dtype)()
         else:
-            # Cast only the float types, while leaving the ints alone
-            if objects.__class__.__name__ in ['HalfTensor', 'FloatTensor', 'DoubleTensor']:
-                cast_fn = getattr(objects, self._dtype, None)
-            else:
-                cast_fn = None
+            return objects
 
-            if cast_fn is not None:
-                return cast_fn()
-            else:
-                return objects
+    # Maps the mixed precision settings to the dtype used by autocast, where None
+    # stands for bfloat16 on the CPU and float16 on the GPU.
+    _MIXED_PRECISION_DTYPES = {'half': 'float16', 'bfloat16': 'bfloat16', 'mixed': None}
 
     def set_precision(self, dtype):
         """
@@ -1010,19 +1599,91 @@ class Trainer(object):
 
         Parameters
         ----------
-        dtype : {'double', 'float', 'half'}
-            Training precision.
+        dtype : {'double', 'float', 'half', 'bfloat16', 'mixed'}
+            Training precision. With 'double' or 'float', the model and the inputs are cast
+            to the respective dtype. 'half', 'bfloat16' and 'mixed' enable mixed precision
+            training: the model parameters (and therefore the optimizer updates) remain in
+            float32, while the forward pass runs under `torch.autocast` with float16 or
+            bfloat16 respectively. 'mixed' uses bfloat16 on the CPU and float16 on the GPU.
+            With float16, the loss is scaled to prevent the gradients from underflowing.
 
         Returns
         -------
         Trainer
             self
         """
-        assert dtype in ['double', 'float', 'half']
+        valid_dtypes = ['double', 'float', 'half', 'bfloat16', 'mixed']
+        assert_(dtype in valid_dtypes,
+                "`dtype` must be one of {}, got {} instead.".format(valid_dtypes, dtype),
+                ValueError)
+        if dtype in self._MIXED_PRECISION_DTYPES:
+            assert_(hasattr(torch, 'autocast'),
+                    "Mixed precision training requires torch.autocast (torch >= 1.10).",
+                    RuntimeError)
         self._dtype = dtype
-        self._model = getattr(self._model, dtype)()
+        # The loss scaler is built on demand
+        self._grad_scaler = None
+        if self.model_is_defined:
+            self._model = getattr(self._model, 'float' if self.uses_mixed_precision else dtype)()
+            self._compiled_model = None
         return self
 
+    @property
+    def uses_mixed_precision(self):
+        return self._dtype in self._MIXED_PRECISION_DTYPES
+
+    @property
+    def autocast_dtype(self):
+        """Gets the dtype used by autocast, or None if not using mixed precision."""
+        if not self.uses_mixed_precision:
+            return None
+        dtype = self._MIXED_PRECISION_DTYPES.get(self._dtype)
+        if dtype is None:
+            dtype = 'float16' if self._use_cuda else 'bfloat16'
+        return getattr(torch, dtype)
+
+    def autocast(self):
+        """
+        Gets a context manager for the forward pass, which is a `torch.autocast` when using
+        mixed precision and a no-op otherwise.
+        """
+        if not self.uses_mixed_precision:
+            return contextlib.suppress()
+        return torch.autocast(device_type='cuda' if self._use_cuda else 'cpu',
+                              dtype=self.autocast_dtype)
+
+    @property
+    def grad_scaler(self):
+        """Gets the loss scaler, or None if the loss need not be scaled."""
+        if self.autocast_dtype is not torch.float16:
+            return None
+        # Trainers loaded from old pickle files might not have '_grad_scaler'
+        if getattr(self, '_grad_scaler', None) is None:
+            if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+                self._grad_scaler = torch.amp.GradScaler('cuda' if self._use_cuda else 'cpu')
+            else:
+                self._grad_scaler = torch.cuda.amp.GradScaler()
+        return self._grad_scaler
+
+    def backward(self, loss):
+        """Backprops `loss`, which is scaled first if required by the precision."""
+        grad_scaler = self.grad_scaler
+        if grad_scaler is not None:
+            loss = grad_scaler.scale(loss)
+        # retain_graph option is needed for some custom
+        # loss functions like malis, False per default
+        loss.backward(retain_graph=self.retain_graph)
+
+    def step_optimizer(self):
+        """Updates the parameters, taking care of the loss scale if required."""
+        grad_scaler = self.grad_scaler
+        if grad_scaler is not None:
+            # This skips the step if the gradients are not finite, and adjusts the scale
+            grad_scaler.step(self.optimizer)
+            grad_scaler.update()
+        else:
+            self.optimizer.step()
+
     @property
     def dtype(self):
         return self._dtype
@@ -1075,6 +1736,7 @@ class Trainer(object):
             # This is when the previous loader already has a DataLoaderIter running.
             # The DataLoaderIter implements a __del__ method, which shuts down workers.
             del self._loader_iters[name]
+            self._get_exhausted_prefetchers().discard(name)
         # Trainers loaded from pickle files might not have '_loader_specs', therefore:
         if not hasattr(self, '_loader_specs'):
             setattr(self, '_loader_specs', {})
@@ -1105,15 +1767,118 @@ class Trainer(object):
         except StopIteration:
             # This if clause prevents infinite recursion if the loader is empty
             if restart_exhausted_generators:
-                self._loader_iters.update({from_loader: self._loaders[from_loader].__iter__()})
-                # Update epoch count
+                # Update epoch count. This comes first, such that the new iterator is
+                # built for the new epoch.
                 if update_epoch_count_if_generator_exhausted:
                     self.next_epoch()
+                self._loader_iters.update({from_loader: self._loaders[from_loader].__iter__()})
                 return self.fetch_next_batch(from_loader, restart_exhausted_generators=False,
                                              update_batch_count=update_batch_count)
             else:
                 raise
 
+    def prefetch(self, depth=2):
+        """
+        Stage upcoming training batches in a background thread.
+
+        The batches are fetched, sent to the device and cast to the right dtype while the
+        current iteration is being computed, such that the training loop only needs to
+        dequeue them. On the GPU, the batches are pinned and copied to the device on a
+        separate CUDA stream, such that the copies overlap with the training kernels.
+
+        Parameters
+        ----------
+        depth : int
+            Number of batches to keep staged. Set to 0 to disable prefetching.
+
+        Returns
+        -------
+        Trainer
+            self
+
+        Notes
+        -----
+        Batches are wrapped with the device and dtype settings at the time they're staged.
+        Call this method after `cuda` and `set_precision` to avoid wasting the first
+        `depth` batches.
+        """
+        assert_(isinstance(depth, int) and depth >= 0,
+                "`depth` must be a non-negative integer, got {} instead.".format(depth),
+                ValueError)
+        self._prefetch_depth = depth
+        # Drop the staged batches, if any - they'll be restaged with the new depth
+        if isinstance(self._loader_iters.get('train'), tu.BatchPrefetcher):
+            self._loader_iters.pop('train').close()
+        return self
+
+    @property
+    def prefetch_depth(self):
+        # Trainers loaded from old pickle files might not have '_prefetch_depth'
+        return getattr(self, '_prefetch_depth', 0)
+
+    def _get_exhausted_prefetchers(self):
+        # Trainers loaded from old pickle files might not have '_exhausted_prefetchers'
+        if not hasattr(self, '_exhausted_prefetchers'):
+            self._exhausted_prefetchers = set()
+        return self._exhausted_prefetchers
+
+    def fetch_next_prefetched_batch(self, from_loader='train', update_batch_count=True,
+                                    update_epoch_count_if_generator_exhausted=True,
+                                    restart_exhausted_generators=True):
+        """
+        Like `fetch_next_batch` followed by `wrap_batch`, but the batch is taken from a
+        background prefetcher (which is started if required).
+        """
+        exhausted_prefetchers = self._get_exhausted_prefetchers()
+        if from_loader in exhausted_prefetchers:
+            # The last pass ended at the previous call, which didn't move on to the next one
+            if not restart_exhausted_generators:
+                raise StopIteration
+            exhausted_prefetchers.discard(from_loader)
+            if update_epoch_count_if_generator_exhausted:
+                self.next_epoch()
+        prefetcher = self._loader_iters.get(from_loader)
+        if not isinstance(prefetcher, tu.BatchPrefetcher):
+            # The worker thread only gets a weak reference to the trainer, such that the
+            # trainer (and with it, the prefetcher) can still be garbage collected.
+            trainer_ref = weakref.ref(self)
+
+            def transform(batch):
+                trainer = trainer_ref()
+                assert_(trainer is not None, "Trainer is gone.", RuntimeError)
+                trainer.verify_batch(batch, from_loader)
+                # The copies to the device don't block when staging on a side stream
+                return trainer.wrap_batch(batch, from_loader=from_loader,
+                                          non_blocking=stream is not None)
+            # On the GPU, batches are staged on their own stream, such that copying them to
+            # the device overlaps with the computations on the default stream
+            stream = torch.cuda.Stream() if self._use_cuda else None
+            loader = self._loaders[from_loader]
+            first_epoch = self._epoch_count
+
+            def begin_pass(pass_num):
+                # The worker starts the next pass before the epoch count moves on
+                distributed_utils.set_epoch(loader, first_epoch + pass_num)
+            prefetcher = tu.BatchPrefetcher(loader,
+                                            depth=self.prefetch_depth,
+                                            transform=transform,
+                                            begin_pass=begin_pass,
+                                            stream=stream)
+            self._loader_iters.update({from_loader: prefetcher})
+        try:
+            next_batch = next(prefetcher)
+        except StopIteration:
+            if not restart_exhausted_generators:
+                exhausted_prefetchers.add(from_loader)
+                raise
+            # The prefetcher moves on to the next pass over the loader by itself
+            if update_epoch_count_if_generator_exhausted:
+                self.next_epoch()
+            next_batch = next(prefetcher)
+        if update_batch_count:
+            self._batch_count += 1
+        return next_batch
+
     def verify_batch(self, batch, from_loader):
         loader_specs = self.get_loader_specs(from_loader)
         num_inputs = loader_specs.get('num_inputs')
@@ -1161,13 +1926,14 @@ class Trainer(object):
                                    for from_loader in of_loader})
         return self
 
-    def wrap_batch(self, batch, from_loader=None, requires_grad=False, volatile=False):
+    def wrap_batch(self, batch, from_loader=None, requires_grad=False, volatile=False,
+                   non_blocking=False):
         base_device_ordinal = \
             self._base_device_ordinal if hasattr(self, '_base_device_ordinal') else None
         # First, send to the right device
         if base_device_ordinal is None:
             # Both inputs and labels are sent to the device
-            batch = self.to_device(batch)
+            batch = self.to_device(batch, non_blocking=non_blocking)
         elif base_device_ordinal == -1:
             # Input batches go to device, while labels remain on the CPU.
             # To start, we need the number of input batches, i.e. from_loader must not be None
@@ -1183,7 +1949,7 @@ class Trainer(object):
             num_targets = loader_spec['num_targets']
             # Fetch input batches and send'em to device (leave the targets alone)
             inputs = batch[:-num_targets]
-            inputs = self.to_device(inputs)
+            inputs = self.to_device(inputs, non_blocking=non_blocking)
             # Finally, build the batch
             batch = inputs + batch[-num_targets:]
         else:
@@ -1218,6 +1984,11 @@ class Trainer(object):
     def next_iteration(self):
         self._iteration_count += 1
 
+    def _set_loader_epochs(self):
+        # Distributed samplers shuffle differently in every epoch, if they're told about it
+        for loader in self._loaders.values():
+            distributed_utils.set_epoch(loader, self._epoch_count)
+
     def next_epoch(self):
         # Callback before the end of epoch
         self.callbacks.call(self.callbacks.END_OF_EPOCH,
@@ -1226,6 +1997,7 @@ class Trainer(object):
                             iteration_count=self._iteration_count)
         self._epoch_count += 1
         self._batch_count = 0
+        self._set_loader_epochs()
         # Callback after the start of epoch
         self.callbacks.call(self.callbacks.BEGIN_OF_EPOCH,
                             epoch_count=self._epoch_count,
@@ -1333,6 +2105,12 @@ class Trainer(object):
         max_num_epochs = inf if max_num_epochs in self.INF_STRINGS else max_num_epochs
         max_num_epochs = self._max_num_epochs if max_num_epochs is None else max_num_epochs
 
+        if self.is_distributed:
+            if not dist.is_initialized():
+                return self._fit_distributed(max_num_iterations, max_num_epochs)
+            if self.distributed_model is None:
+                self._setup_distributed()
+
         self.callbacks.call(self.callbacks.BEGIN_OF_FIT,
                             max_num_iterations=max_num_iterations,
                             max_num_epochs=max_num_epochs)
@@ -1348,14 +2126,30 @@ class Trainer(object):
                                                                           max_num_epochs))
             # Check if it's time to validate
             if self.validate_now:
-                self.console.info("Validating.")
-                self.validate_for()
+                if self.validating_in_background:
+                    self.console.info("Submitting snapshot for validation.")
+                    self.submit_validation()
+                else:
+                    self.console.info("Validating.")
+                    self.validate_for()
+            if self.validating_in_background:
+                self.collect_validation_results()
             # Check if it's time to save
             if self.save_now:
                 self.console.info("Saving.")
                 self.save()
             run_num += 1
 
+        # Wait for the last validation results, which might warrant a save
+        if self.validating_in_background:
+            self.collect_validation_results(wait=True)
+            if self.save_now:
+                self.console.info("Saving.")
+                self.save()
+
+        # Make sure the checkpoints are on disk
+        self.wait_for_pending_saves()
+
         # Call callback
         self.callbacks.call(self.callbacks.END_OF_FIT,
                             max_num_iterations=max_num_iterations,
@@ -1370,25 +2164,132 @@ class Trainer(object):
             assert_(mode in ['train', 'eval'],
                     f"`mode` must be one of ['train', 'eval'], got {mode} instead.", ValueError)
         # Compute prediction
-        prediction = self.apply_model(*inputs)
+        with self._timed_phase('forward'):
+            prediction = self.apply_model(*inputs)
         # Compute loss
         kwargs = {}
         if (isinstance(self.criterion, torch.nn.Module) and
                 'trainer' in signature(self.criterion.forward).parameters):
             kwargs['trainer'] = self
-        if mode == 'train':
-            loss = self.criterion(prediction, target, **kwargs)
-        elif mode == 'eval':
-            loss = self.validation_criterion(prediction, target, **kwargs)
-        else:
-            raise ValueError
+        with self._timed_phase('loss'):
+            if mode == 'train':
+                loss = self.criterion(prediction, target, **kwargs)
+            elif mode == 'eval':
+                loss = self.validation_criterion(prediction, target, **kwargs)
+            else:
+                raise ValueError
         if backward:
             # Backprop if required
-            # retain_graph option is needed for some custom
-            # loss functions like malis, False per default
-            loss.backward(retain_graph=self.retain_graph)
+            with self._timed_phase('backward'):
+                self.backward(loss)
         return prediction, loss
 
+    # Phases of a training iteration that are timed by `record_phase_timings`
+    PHASES = ['fetch', 'wrap', 'forward', 'loss', 'backward', 'optimizer_step',
+              'callbacks', 'metric', 'update_state']
+    # Phases in which the trainer waits for data
+    DATA_WAIT_PHASES = ['fetch', 'wrap']
+
+    def record_phase_timings(self, yes=True, window_size=50, synchronize_cuda=False):
+        """
+        Toggles timing the phases of every training iteration (see `Trainer.PHASES`).
+
+        The timings are averaged over the last `window_size` iterations and written to
+        the trainer states '<phase>_time' (e.g. 'forward_time', in seconds), together
+        with 'iteration_time', 'samples_per_second' and 'data_wait_fraction' (the
+        fraction of the time spent fetching and wrapping batches). They can be observed
+        by loggers like any other state, or exported with
+        `inferno.trainers.callbacks.timing.PhaseTimingExporter`.
+
+        The states are updated at the very end of every iteration, such that the
+        averages include the callbacks at `END_OF_TRAINING_ITERATION`. Callbacks
+        therefore get to see the averages up to the previous iteration. With prefetching,
+        batches are wrapped in the background, and the time spent waiting for them is
+        attributed to 'fetch'.
+
+        Parameters
+        ----------
+        yes : bool
+            Whether to time the phases.
+        window_size : int
+            Number of iterations to average the timings over.
+        synchronize_cuda : bool
+            Whether to synchronize with the GPU before reading the clock. Without
+            synchronizing, the time the GPU takes is attributed to the phase that first
+            waits for its results (usually the optimizer step or fetching the loss).
+            Synchronizing makes the timings accurate, but slows down training.
+
+        Returns
+        -------
+        Trainer
+            self.
+        """
+        if yes:
+            self._phase_timer = tu.PhaseTimer(window_size=window_size,
+                                              synchronize_cuda=synchronize_cuda)
+        else:
+            self._phase_timer = None
+        return self
+
+    @property
+    def phase_timer(self):
+        # Trainers loaded from old pickle files might not have '_phase_timer'
+        return getattr(self, '_phase_timer', None)
+
+    @property
+    def records_phase_timings(self):
+        return self.phase_timer is not None
+
+    def _timed_phase(self, phase):
+        phase_timer = self.phase_timer
+        if phase_timer is None:
+            return _NOT_TIMED
+        return phase_timer.time(phase)
+
+    def _count_samples(self, target):
+        phase_timer = self.phase_timer
+        if phase_timer is None:
+            return
+        if isinstance(target, (list, tuple)):
+            target = target[0]
+        phase_timer.count_samples(target.size(self._target_batch_dim))
+
+    def get_phase_timings(self):
+        """
+        Returns a dictionary with the averaged timings (see `record_phase_timings`),
+        keyed like the trainer states they're written to.
+        """
+        phase_timer = self.phase_timer
+        assert_(phase_timer is not None, "Phase timings are not being recorded.",
+                RuntimeError)
+        timings = {'{}_time'.format(phase): duration
+                   for phase, duration in phase_timer.phase_durations().items()}
+        timings.update({'iteration_time': phase_timer.iteration_duration,
+                        'samples_per_second': phase_timer.samples_per_second,
+                        'data_wait_fraction':
+                            phase_timer.fraction_of_time_in(self.DATA_WAIT_PHASES)})
+        return timings
+
+    def _end_timed_iteration(self):
+        phase_timer = self.phase_timer
+        if phase_timer is None or not phase_timer.in_iteration:
+            return
+        phase_timer.end_iteration()
+        for key, value in self.get_phase_timings().items():
+            self.update_state(key, value)
+
+    def _fetch_training_batch(self, restart_exhausted_generators=True):
+        # Returns the next training batch, sent to the device and wrapped
+        if self.prefetch_depth > 0:
+            with self._timed_phase('fetch'):
+                return self.fetch_next_prefetched_batch(
+                    'train', restart_exhausted_generators=restart_exhausted_generators)
+        with self._timed_phase('fetch'):
+            batch = self.fetch_next_batch(
+                'train', restart_exhausted_generators=restart_exhausted_generators)
+        with self._timed_phase('wrap'):
+            return self.wrap_batch(batch, from_loader='train')
+
     def train_for(self, num_iterations=None, break_callback=None):
         # Switch model to train mode
         self.train_mode()
@@ -1409,45 +2310,110 @@ class Trainer(object):
                 break
             self.console.progress("Training iteration {} (batch {} of epoch {})."
                        .format(iteration_num, self._batch_count, self._epoch_count))
+            if self.phase_timer is not None:
+                self.phase_timer.start_iteration()
             # Call callback
-            self.callbacks.call(self.callbacks.BEGIN_OF_TRAINING_ITERATION,
-                                iteration_num=iteration_num)
+            with self._timed_phase('callbacks'):
+                self.callbacks.call(self.callbacks.BEGIN_OF_TRAINING_ITERATION,
+                                    iteration_num=iteration_num)
+            # Don't hold on to the states of the last iteration while computing this one
+            self._release_deferred_states()
             # Zero out the grads
             self.optimizer.zero_grad()
+            # With gradient accumulation, an iteration consists of several (micro-)batches
+            # whose gradients are accumulated before the parameters are updated. The
+            # accumulation window is cut short at the end of an epoch.
+            num_accumulated_batches = self.accumulating_gradients_over
+            accumulated_losses = []
             # No interrupts while computing - a SIGINT could shoot down the driver if
-            # done at the wrong time. Not sure if this has something to do with pinned memory
+            # done at the wrong time. Not sure if this has something to do with pinned
+            # memory
             with pyu.delayed_keyboard_interrupt():
-                # Get batch
-                batch = self.fetch_next_batch('train')
-                # Send to device and wrap as variable
-                batch = self.wrap_batch(batch, from_loader='train')
-                # Separate inputs from targets
-                inputs, target = self.split_batch(batch, from_loader='train')
-                # Apply model, compute loss and backprop
-                prediction, loss = self.apply_model_and_loss(inputs, target, backward=True,
-                                                             mode='train')
-            self.callbacks.call(self.callbacks.AFTER_MODEL_AND_LOSS_IS_APPLIED,
-                                prediction=prediction, loss=loss, iteration_num=iteration_num)
+                next_batch = self._fetch_training_batch()
+            while next_batch is not None:
+                batch = next_batch
+                with pyu.delayed_keyboard_interrupt():
+                    # Look ahead, such that we know whether this is the last batch of the
+                    # window
+                    next_batch = None
+                    if len(accumulated_losses) + 1 < num_accumulated_batches:
+                        try:
+                            next_batch = \
+                                self._fetch_training_batch(restart_exhausted_generators=False)
+                        except StopIteration:
+                            pass
+                # When training distributed, the gradients need to be synchronized across
+                # processes only once they're fully accumulated
+                if self.distributed_model is not None and next_batch is not None:
+                    gradient_sync = self.distributed_model.no_sync()
+                else:
+                    gradient_sync = contextlib.suppress()
+                with pyu.delayed_keyboard_interrupt(), gradient_sync:
+                    # Separate inputs from targets
+                    inputs, target = self.split_batch(batch, from_loader='train')
+                    self._count_samples(target)
+                    if num_accumulated_batches == 1:
+                        # Apply model, compute loss and backprop
+                        prediction, loss = self.apply_model_and_loss(inputs, target,
+                                                                     backward=True,
+                                                                     mode='train')
+                    else:
+                        # Apply model and compute loss
+                        prediction, loss = self.apply_model_and_loss(inputs, target,
+                                                                     backward=False,
+                                                                     mode='train')
+                        # Backprop the scaled loss, such that the accumulated gradient is
+                        # that of the loss averaged over all accumulated batches
+                        with self._timed_phase('backward'):
+                            self.backward(loss / num_accumulated_batches)
+                        accumulated_losses.append(loss.detach())
+            if num_accumulated_batches > 1:
+                num_batches = len(accumulated_losses)
+                if num_batches < num_accumulated_batches:
+                    # The window was cut short by the end of the epoch. Rescale the
+                    # gradients, such that they're averaged over the batches we did get.
+                    for parameter in self.model.parameters():
+                        if parameter.grad is not None:
+                            parameter.grad.mul_(num_accumulated_batches / num_batches)
+                # The iteration's loss is the average over the accumulated batches. Everything
+                # else (inputs, prediction, etc.) is taken from the last batch.
+                loss = sum(accumulated_losses) / num_batches
+            if self.grad_scaler is not None:
+                # Unscale the gradients in-place, such that callbacks (e.g. for gradient
+                # clipping) get to see the actual gradients
+                self.grad_scaler.unscale_(self.optimizer)
+            with self._timed_phase('callbacks'):
+                self.callbacks.call(self.callbacks.AFTER_MODEL_AND_LOSS_IS_APPLIED,
+                                    prediction=prediction, loss=loss,
+                                    iteration_num=iteration_num)
             # Compute metric
             if self.metric_is_defined and self.evaluate_metric_now:
                 self._last_metric_evaluated_at_epoch = self._epoch_count
-                error = self.metric(thu.unwrap(prediction, to_cpu=False),
-                                    thu.unwrap(target, to_cpu=False))
-                self.update_state('training_error', thu.unwrap(error))
+                with self._timed_phase('metric'):
+                    error = self.metric(thu.unwrap(prediction, to_cpu=False),
+                                        thu.unwrap(target, to_cpu=False))
+                self.update_state('training_error', error, lazy=True)
             else:
                 error = None
-            # Update state from computation
-            self.update_state('training_inputs', thu.unwrap(inputs))
-            self.update_state('training_target', thu.unwrap(target))
-            self.update_state('training_prediction', thu.unwrap(prediction))
-            self.update_state('training_loss', thu.unwrap(loss))
-            # Update state from model's state hooks
-            self.update_state_from_model_state_hooks()
+            with self._timed_phase('update_state'):
+                # Update state from computation. The states are unwrapped (i.e. copied to
+                # the CPU) only if and when they're read.
+                self.update_state('training_inputs', inputs, lazy=True)
+                self.update_state('training_target', target, lazy=True)
+                self.update_state('training_prediction', prediction, lazy=True)
+                self.update_state('training_loss', loss, lazy=True)
+                # Update state from model's state hooks
+                self.update_state_from_model_state_hooks()
             # Update parameters
-            self.optimizer.step()
+            with self._timed_phase('optimizer_step'):
+                if self.distributed_model is not None:
+                    self._broadcast_hyperparameters()
+                self.step_optimizer()
             # Call callback
-            self.callbacks.call(self.callbacks.END_OF_TRAINING_ITERATION,
-                                iteration_num=iteration_num)
+            with self._timed_phase('callbacks'):
+                self.callbacks.call(self.callbacks.END_OF_TRAINING_ITERATION,
+                                    iteration_num=iteration_num)
+            self._end_timed_iteration()
             # Prepare for next iteration
             self.next_iteration()
             # Break if validating or saving. It's important that the next_iteration() method is
@@ -1487,8 +2453,9 @@ class Trainer(object):
                 "Invalid `loader_name`: {}".format(loader_name),
                 ValueError)
         # Average over errors
-        validation_error_meter = tu.AverageMeter()
-        validation_loss_meter = tu.AverageMeter()
+        # The meters accumulate on the device, and are only read at the end of the run
+        validation_error_meter = tu.TensorAverageMeter()
+        validation_loss_meter = tu.TensorAverageMeter()
         iteration_num = 0
         num_iterations = \
             self._num_validation_iterations if num_iterations is None else num_iterations
@@ -1530,6 +2497,8 @@ class Trainer(object):
             except StopIteration:
                 self.console.info("{} generator exhausted, breaking.".format(loader_name))
                 break
+            # The states of the last iteration are kept for the end of the validation run
+            self._release_deferred_states()
 
             self.console.progress("Validating iteration {}.".format(iteration_num))
 
@@ -1549,24 +2518,21 @@ class Trainer(object):
                 batch_size = target[0].size(self._target_batch_dim)
             else:
                 batch_size = target.size(self._target_batch_dim)
-            validation_loss_meter.update(thu.unwrap(loss, extract_item=True), n=batch_size)
+            validation_loss_meter.update(thu.unwrap(loss, to_cpu=False), n=batch_size)
 
             # Compute validation_error
             if self.metric_is_defined:
                 validation_error = self.metric(thu.unwrap(output, to_cpu=False),
                                                thu.unwrap(target, to_cpu=False))
-                if torch.is_tensor(validation_error):
-                    # Convert to float
-                    validation_error = thu.unwrap(validation_error, extract_item=True)
-                self.update_state('validation_error', thu.unwrap(validation_error))
+                self.update_state('validation_error', validation_error, lazy=True)
                 validation_error_meter.update(validation_error, n=batch_size)
 
-            self.update_state('validation_inputs', thu.unwrap(inputs))
-            self.update_state('validation_target', thu.unwrap(target))
-            self.update_state('validation_prediction', thu.unwrap(output))
-            self.update_state('validation_loss', thu.unwrap(loss))
+            self.update_state('validation_inputs', inputs, lazy=True)
+            self.update_state('validation_target', target, lazy=True)
+            self.update_state('validation_prediction', output, lazy=True)
+            self.update_state('validation_loss', loss, lazy=True)
             # This is here for legacy reasons and will eventually be deprecated.
-            self.update_state('validation_input', self.get_state('validation_inputs'))
+            self.update_state('validation_input', inputs, lazy=True)
             # Update from model's state hooks
             self.update_state_from_model_state_hooks()
 
@@ -1577,6 +2543,12 @@ class Trainer(object):
 
         self.console.info("Done validating. Logging results...")
 
+        if self.distributed_model is not None:
+            # Average over all processes
+            self._all_reduce_meter(validation_loss_meter)
+            if self.metric_is_defined:
+                self._all_reduce_meter(validation_error_meter)
+
         # Report
         validation_results = {
             'validation_loss': validation_loss_meter.avg,
@@ -1593,6 +2565,101 @@ class Trainer(object):
                             validation_error_meter if self.metric_is_defined else None)
         return self
 
+    def predict(self, loader_or_dataset, num_inputs=None, postprocess=None, sink=None,
+                to_cpu=True, batch_size=1, num_workers=0):
+        """
+        Streams the predictions of the model, batch by batch.
+
+        This is a generator: batches are loaded and predicted as the predictions are
+        consumed. The model is applied in eval mode and under `torch.inference_mode`,
+        with the device, precision and data-parallel settings of the trainer (like in
+        validation). The mode the trainer was in is restored once the generator is
+        exhausted or closed. If prefetching is enabled (see `Trainer.prefetch`),
+        batches are staged in the background; either way, no more than the prefetch
+        depth plus one batch of inputs and one of predictions are held at any time.
+
+        Parameters
+        ----------
+        loader_or_dataset : torch.utils.data.DataLoader or torch.utils.data.Dataset
+            Where to get the batches from. Datasets are wrapped in a (non-shuffling)
+            DataLoader with `batch_size` and `num_workers`.
+        num_inputs : int
+            Number of tensors in a batch that are inputs to the model. The rest of the
+            batch (e.g. the targets) is ignored. Defaults to all.
+        postprocess : callable
+            Called with the output of the model (on the device) for every batch, e.g.
+            to apply a final activation or select the output to keep. Its return value
+            is what's streamed.
+        sink : inferno.io.sinks.PredictionSink
+            Sink every (post-processed) batch is written to, e.g. to gather the
+            predictions in memory or write them to disk. The sink is flushed (but not
+            closed) once all batches are predicted.
+        to_cpu : bool
+            Whether to move the predictions to the CPU.
+        batch_size : int
+            Batch size, if `loader_or_dataset` is a dataset.
+        num_workers : int
+            Number of loader workers, if `loader_or_dataset` is a dataset.
+
+        Yields
+        ------
+        torch.Tensor or list
+            The (post-processed) prediction for every batch.
+        """
+        if isinstance(loader_or_dataset, DataLoader):
+            loader = loader_or_dataset
+        else:
+            loader = DataLoader(loader_or_dataset, batch_size=batch_size, shuffle=False,
+                                num_workers=num_workers)
+
+        # When prefetching on the GPU, batches are staged on their own stream (see
+        # `fetch_next_prefetched_batch`)
+        stream = torch.cuda.Stream() if self.prefetch_depth > 0 and self._use_cuda else None
+
+        def stage(batch):
+            batch = list(batch) if isinstance(batch, (list, tuple)) else [batch]
+            inputs = batch if num_inputs is None else batch[:num_inputs]
+            return self.cast(self.to_device(inputs, non_blocking=stream is not None))
+
+        if self.prefetch_depth > 0:
+            # Stop staging batches after one pass
+            batches = tu.BatchPrefetcher(loader, depth=self.prefetch_depth, transform=stage,
+                                         num_passes=1, stream=stream)
+        else:
+            batches = map(stage, loader)
+        if sink is not None:
+            # The sampler decides how many samples are drawn from the dataset
+            sink.begin(num_samples=tu.num_samples_in(loader))
+        inference_mode = torch.inference_mode if hasattr(torch, 'inference_mode') \
+            else torch.no_grad
+        was_training = self.model_is_defined and self.model.training
+        previous_mode = self._current_mode
+        self.eval_mode()
+        try:
+            for inputs in batches:
+                # Inference mode must not leak to the consumer of the generator, so
+                # it's not held across the yield
+                with pyu.delayed_keyboard_interrupt(), inference_mode():
+                    prediction = self.apply_model(*inputs)
+                    if postprocess is not None:
+                        prediction = postprocess(prediction)
+                    if to_cpu:
+                        prediction = thu.unwrap(prediction, to_cpu=True)
+                    # Free the inputs before the next batch is loaded
+                    del inputs
+                if sink is not None:
+                    sink.write(prediction)
+                yield prediction
+                del prediction
+            if sink is not None:
+                sink.flush()
+        finally:
+            if isinstance(batches, tu.BatchPrefetcher):
+                batches.close()
+            if was_training:
+                self.train_mode()
+            self._current_mode = previous_mode
+
     def record_validation_results(self, validation_loss, validation_error):
         # Update state
         self.update_state('validation_loss_averaged', thu.unwrap(validation_loss))
@@ -1614,9 +2681,29 @@ class Trainer(object):
         # Loader iterators can't be pickled
         if '_loader_iters' in config_dict:
             config_dict.update({'_loader_iters': {}})
+        if '_exhausted_prefetchers' in config_dict:
+            config_dict.update({'_exhausted_prefetchers': set()})
         if exclude_loader:
             if '_loaders' in config_dict:
                 config_dict.update({'_loaders': {}})
+        # Neither can the checkpoint writer or the background evaluator (which are
+        # rebuilt on demand)
+        if '_checkpoint_writer' in config_dict:
+            config_dict.update({'_checkpoint_writer': None})
+        if '_background_evaluator' in config_dict:
+            config_dict.update({'_background_evaluator': None})
+        # The distributed model wraps the model, and is only valid in its process group
+        if '_distributed_model' in config_dict:
+            config_dict.update({'_distributed_model': None})
+        # The model is saved uncompiled, and compiled again after loading
+        if '_compiled_model' in config_dict:
+            config_dict.update({'_compiled_model': None})
+        # States that are updated lazily (inputs, predictions, etc.) are transient: they
+        # only make sense for the iteration they were set in.
+        if '_state' in config_dict:
+            config_dict.update({'_state': {key: value
+                                           for key, value in config_dict['_state'].items()
+                                           if not isinstance(value, thu.DeferredUnwrap)}})
         return config_dict
 
     def set_config(self, config_dict):
@@ -1632,6 +2719,11 @@ class Trainer(object):
         # Log the epoch for save_now
         self._last_saved_at_epoch = self._epoch_count
 
+        if self.rank != 0:
+            # When training distributed, only rank 0 saves
+            self._is_iteration_with_best_validation_score = False
+            return self
+
         self.callbacks.call(self.callbacks.BEGIN_OF_SAVE,
                             save_to_directory=self._save_to_directory,
                             epoch_count=self._epoch_count,
@@ -1644,10 +2736,25 @@ class Trainer(object):
         best_checkpoint_path = os.path.join(self._save_to_directory,
                                             self._best_checkpoint_filename)
 
+        # Stash the best checkpoint, if required
+        if self._is_iteration_with_best_validation_score and stash_best_checkpoint:
+            stash_to_path = best_checkpoint_path
+        else:
+            stash_to_path = None
+
         # Save the state dictionary
-        torch.save(self.get_config(exclude_loader=exclude_loader),
-                   checkpoint_path,
-                   pickle_module=self.pickle_module)
+        config_dict = self.get_config(exclude_loader=exclude_loader)
+        if self.saving_asynchronously:
+            # Snapshot the trainer, and leave the serialization and the disk I/O to the
+            # writer
+            snapshot, devices = self._snapshot_config(config_dict)
+            self.checkpoint_writer.submit(self._write_checkpoint,
+                                          lambda f: self._dump_checkpoint(snapshot, f,
+                                                                          devices=devices),
+                                          checkpoint_path, stash_to_path)
+        else:
+            self._write_checkpoint(lambda f: self._dump_checkpoint(config_dict, f),
+                                   checkpoint_path, stash_to_path)
 
         self.callbacks.call(self.callbacks.END_OF_SAVE,
                             save_to_directory=self._save_to_directory,
@@ -1658,24 +2765,57 @@ class Trainer(object):
                             iteration_count=self._iteration_count,
                             is_iteration_with_best_validation_score=self._is_iteration_with_best_validation_score)
 
-        if self._is_iteration_with_best_validation_score and stash_best_checkpoint:
-            # Do the stashin'
-            shutil.copyfile(checkpoint_path, best_checkpoint_path)
-
         # This is required to prevent an infinite save loop?
         self._is_iteration_with_best_validation_score = False
         self.console.info("Saved to {}.".format(self._save_to_directory))
         return self
 
+    def _snapshot_config(self, config_dict):
+        # Copies the config, such that it can be serialized while the training goes on.
+        # The tensors of the model and the optimizer state are copied to the CPU (which is
+        # cheap compared to serializing them), everything else is deep-copied. Tensors that
+        # share a storage (e.g. tied weights) share it in the copy as well. Returns the copy
+        # and the devices the copied tensors were on (see `checkpoint_utils.snapshot`).
+        memo = {}
+        storages = {}
+        devices = {}
+        tensors = []
+        if self.model_is_defined:
+            tensors.extend(self.model.parameters())
+            tensors.extend(self.model.buffers())
+        if self.optimizer_is_defined:
+            tensors.extend(value for state in self.optimizer.state.values()
+                           for value in state.values() if torch.is_tensor(value))
+        for tensor in tensors:
+            if id(tensor) not in memo:
+                memo[id(tensor)] = cu.snapshot(tensor, storages, devices)
+        return copy.deepcopy(config_dict, memo), devices
+
+    def _dump_checkpoint(self, object_, file, devices=None):
+        if self.checkpoint_format == 'structured':
+            cu.save_structured(object_, file, pickle_module=self.pickle_module,
+                               devices=devices)
+        else:
+            cu.torch_save(object_, file, pickle_module=self.pickle_module, devices=devices)
+
+    @staticmethod
+    def _write_checkpoint(dump, checkpoint_path, best_checkpoint_path=None):
+        # `dump` writes the checkpoint to the file object it's given
+        pyu.write_atomically(checkpoint_path, dump)
+        if best_checkpoint_path is not None:
+            # Do the stashin'. The link remains valid because the checkpoint is not
+            # overwritten by the next save, but replaced by a new file.
+            pyu.link_or_copy(checkpoint_path, best_checkpoint_path)
+
     def save_model(self, to_directory=None):
         to_directory = self._save_to_directory if to_directory is None else to_directory
-        # Save the state dictionary
-        torch.save(self.model,
-                   os.path.join(to_directory, 'model.pytorch'),
-                   pickle_module=self.pickle_module)
+        # Save the model (in the checkpoint format)
+        pyu.write_atomically(os.path.join(to_directory, 'model.pytorch'),
+                             lambda f: self._dump_checkpoint(self.model, f))
         return self
 
-    def load(self, from_directory=None, best=False, filename=None, map_location=None):
+    def load(self, from_directory=None, best=False, filename=None, map_location=None,
+             mmap=True):
         """
         Load the trainer from checkpoint.
 
@@ -1689,22 +2829,29 @@ class Trainer(object):
             'best_checkpoint.pytorch'.
         filename : str
             Overrides the default filename.
-        device : function, torch.device, string or a dict
-            Specify how to remap storage locations.
+        map_location : function, torch.device, string or a dict
+            Specify how to remap storage locations. Functions are not supported for
+            structured checkpoints.
+        mmap : bool
+            Whether to memory-map the tensors of structured checkpoints (instead of
+            reading them to memory). Has no effect on pickled checkpoints.
 
         Returns
         -------
         Trainer
             self
         """
+        # Make sure we're not loading a checkpoint that is still being written
+        self.wait_for_pending_saves()
         from_directory = self._save_to_directory if from_directory is None else from_directory
         assert from_directory is not None, "Nowhere to load from."
         # Get file name
         if filename is None:
             filename = self._best_checkpoint_filename if best else self._checkpoint_filename
         # Load the dictionary
-        config_dict = torch.load(os.path.join(from_directory, filename),
-                                 pickle_module=self.pickle_module, map_location=map_location)
+        config_dict = cu.load(os.path.join(from_directory, filename),
+                              pickle_module=self.pickle_module, map_location=map_location,
+                              mmap=mmap)
 
         # This is required to prevent an infinite save loop?
         self._is_iteration_with_best_validation_score = False
@@ -1712,12 +2859,14 @@ class Trainer(object):
         self.set_config(config_dict)
         return self
 
-    def load_model(self, from_directory=None, filename=None):
+    def load_model(self, from_directory=None, filename=None, map_location=None, mmap=True):
         from_directory = self._save_to_directory if from_directory is None else from_directory
         filename = 'model.pytorch' if filename is None else filename
-        # Load the model
-        model = torch.load(os.path.join(from_directory, filename),
-                           pickle_module=self.pickle_module)
+        # Load the model. The weights of structured checkpoints are memory-mapped, which
+        # makes this cheap even for large models.
+        model = cu.load(os.path.join(from_directory, filename),
+                        pickle_module=self.pickle_module, map_location=map_location,
+                        mmap=mmap)
         # Set model
         self.model = model
         return self
@@ -1760,6 +2909,8 @@ class Trainer(object):
                 devices = trainer_config.get('use_cuda').get('devices') \
                     if isinstance(trainer_config.get('use_cuda'), dict) else None
                 trainer.cuda(devices=devices)
+            if 'accumulate_gradients' in trainer_config:
+                trainer.accumulate_gradients(trainer_config.get('accumulate_gradients'))
             if 'training_precision' in trainer_config:
                 trainer.set_precision(trainer_config.get('training_precision'))
         return trainer
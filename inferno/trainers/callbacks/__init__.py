@@ -1,10 +1,11 @@
-__all__ = ['CallbackEngine', 'Callback', 'Console', 'essentials', 'scheduling', 'gradients']
+__all__ = ['CallbackEngine', 'Callback', 'Console', 'essentials', 'scheduling', 'gradients', 'timing']
 
 from .base import CallbackEngine, Callback
 from .console import Console
 from . import essentials
 from . import scheduling
 from . import gradients
+from . import timing
 
 try:
     from .tqdm import TQDMProgressBar
@@ -1,4 +1,6 @@
+import time
 from ...utils import python_utils as pyu
+from ...utils.exceptions import assert_
 
 
 class CallbackEngine(object):
@@ -9,6 +11,10 @@ class CallbackEngine(object):
     occur. They could be any callable object, but if endowed with a `bind_trainer` method,
     it's called when the callback is registered. It is recommended that callbacks
     (or their `__call__` methods) use the double-star syntax for keyword arguments.
+
+    Callbacks with a truthy `RANK_ZERO_ONLY` attribute only have side effects outside of
+    the training (e.g. logging or writing files). When training distributed, they're
+    skipped at all ranks but rank 0 (see `skip_rank_zero_only_callbacks`).
     """
     # Triggers
     BEGIN_OF_FIT = 'begin_of_fit'
@@ -45,13 +51,27 @@ class CallbackEngine(object):
 
     def __init__(self):
         self._trainer = None
-        self._callback_registry = {trigger: set() for trigger in self.TRIGGERS}
+        self._callback_registry = {trigger: [] for trigger in self.TRIGGERS}
+        # Maps triggers to lists of priorities, in the same order as the registry
+        self._callback_priorities = {trigger: [] for trigger in self.TRIGGERS}
         self._last_known_epoch = None
         self._last_known_iteration = None
+        # Timing instrumentation
+        self._timings = None
+        # (callback, name) pairs in the order the callbacks were registered in, see
+        # `get_callback_name`
+        self._callback_names = []
+        # Whether callbacks that only run at rank 0 are to be skipped
+        self._skipping_rank_zero_only = False
+        # Maps triggers to tuples of (callback, method to call) pairs, see `compile`
+        self._dispatch_table = {}
+        self.compile()
 
     def register_new_trigger(self, trigger_name):
         self.TRIGGERS.add(trigger_name)
-        self._callback_registry.update({trigger_name: set()})
+        self._callback_registry.update({trigger_name: []})
+        self._callback_priorities.update({trigger_name: []})
+        self.compile(trigger_name)
 
     def bind_trainer(self, trainer):
         self._trainer = trainer
@@ -65,7 +85,28 @@ class CallbackEngine(object):
     def trainer_is_bound(self):
         return self._trainer is not None
 
-    def register_callback(self, callback, trigger='auto', bind_trainer=True):
+    def register_callback(self, callback, trigger='auto', bind_trainer=True, priority=0):
+        """
+        Registers a callback.
+
+        Parameters
+        ----------
+        callback : callable
+            Callback to register.
+        trigger : str
+            Trigger to register the callback at. If 'auto', the callback is registered at
+            all triggers it has a method for.
+        bind_trainer : bool
+            Whether to bind the trainer to the callback (if it has a `bind_trainer` method).
+        priority : int or float
+            Callbacks registered at a trigger are called in the order of decreasing priority.
+            Callbacks with the same priority are called in the order they're registered in.
+
+        Returns
+        -------
+        CallbackEngine
+            self
+        """
         assert callable(callback)
         # Automatic callback registration based on their methods
         if trigger == 'auto':
@@ -73,14 +114,27 @@ class CallbackEngine(object):
             for trigger in self.TRIGGERS:
                 if pyu.has_callable_attr(callback, trigger):
                     automatic_registration_successful = True
-                    self.register_callback(callback, trigger, bind_trainer)
+                    self.register_callback(callback, trigger, bind_trainer, priority)
             assert automatic_registration_successful, \
                 "Callback could not be auto-registered: no triggers recognized."
             return self
         # Validate triggers
         assert trigger in self.TRIGGERS
-        # Add to callback registry
-        self._callback_registry.get(trigger).add(callback)
+        # Add to callback registry (unless it's already there), and sort by priority. The
+        # sort is stable, so callbacks of the same priority stay in order of registration.
+        callbacks_at_trigger = self._callback_registry.setdefault(trigger, [])
+        priorities_at_trigger = self._callback_priorities.setdefault(trigger, [])
+        if callback in callbacks_at_trigger:
+            priorities_at_trigger[callbacks_at_trigger.index(callback)] = priority
+        else:
+            self._name_callback(callback)
+            callbacks_at_trigger.append(callback)
+            priorities_at_trigger.append(priority)
+        order = sorted(range(len(callbacks_at_trigger)),
+                       key=lambda index: -priorities_at_trigger[index])
+        callbacks_at_trigger[:] = [callbacks_at_trigger[index] for index in order]
+        priorities_at_trigger[:] = [priorities_at_trigger[index] for index in order]
+        self.compile(trigger)
         # Register trainer with the callback if required
         bind_trainer_to_callback = self.trainer_is_bound and \
                                    bind_trainer and \
@@ -89,6 +143,66 @@ class CallbackEngine(object):
             callback.bind_trainer(self._trainer)
         return self
 
+    def _name_callback(self, callback):
+        if any(named_callback is callback for named_callback, _ in self._callback_names):
+            return
+        class_name = type(callback).__name__
+        num_named = sum(name.split('#')[0] == class_name for _, name in self._callback_names)
+        name = class_name if num_named == 0 else '{}#{}'.format(class_name, num_named + 1)
+        self._callback_names.append((callback, name))
+
+    def get_callback_name(self, callback):
+        """
+        Returns the name of a registered callback, as used in the timings: the name of its
+        class, followed by '#n' for the n-th (n > 1) callback of that class registered.
+        """
+        for named_callback, name in self._callback_names:
+            if named_callback is callback:
+                return name
+        raise KeyError("Callback {} is not registered.".format(callback))
+
+    @staticmethod
+    def _get_dispatch_target(callback, trigger):
+        # Callbacks that rely on `Callback.__call__` would look up the method for the trigger
+        # at every call. We do it once instead. If there's no such method, `Callback.__call__`
+        # would do nothing, so there's nothing to call (and None is returned).
+        if isinstance(callback, Callback) and type(callback).__call__ is Callback.__call__:
+            target = getattr(callback, trigger, None)
+            return target if callable(target) else None
+        else:
+            return callback
+
+    def compile(self, trigger=None):
+        """
+        (Re)builds the dispatch table, which maps triggers to the methods to call (in order).
+        This happens automatically when callbacks are registered.
+        """
+        triggers = self._callback_registry.keys() if trigger is None else [trigger]
+        for _trigger in triggers:
+            dispatch = ((callback, self._get_dispatch_target(callback, _trigger))
+                        for callback in self._callback_registry.get(_trigger, [])
+                        if not (self._skipping_rank_zero_only and
+                                getattr(callback, 'RANK_ZERO_ONLY', False)))
+            self._dispatch_table[_trigger] = \
+                tuple((callback, target) for callback, target in dispatch
+                      if target is not None)
+        return self
+
+    def skip_rank_zero_only_callbacks(self, yes=True):
+        """
+        Toggles skipping the callbacks that only run at rank 0 (i.e. the ones with a truthy
+        `RANK_ZERO_ONLY` attribute). The trainer does this at all other ranks when training
+        distributed. All other callbacks run at every rank, such that the replicas stay in
+        sync (e.g. when callbacks modify the gradients or the parameters).
+        """
+        self._skipping_rank_zero_only = bool(yes)
+        self.compile()
+        return self
+
+    @property
+    def is_skipping_rank_zero_only_callbacks(self):
+        return self._skipping_rank_zero_only
+
     def rebind_trainer_to_all_callbacks(self):
         # FIXME This makes bind_trainer in register_callback reduntant,
         # especially if used by the trainer class, so... deprecate bind_traner.
@@ -101,19 +215,104 @@ class CallbackEngine(object):
                     callback.bind_trainer(self._trainer)
 
     def call(self, trigger, **kwargs):
-        assert trigger in self.TRIGGERS
+        dispatch = self._dispatch_table.get(trigger)
+        if not dispatch:
+            # Nothing to call, but make sure the trigger is valid
+            assert trigger in self.TRIGGERS
+            return
         kwargs.update({'trigger': trigger})
-        for callback in self._callback_registry.get(trigger):
-            callback(**kwargs)
+        if self._timings is None:
+            for _, target in dispatch:
+                target(**kwargs)
+        else:
+            self._timed_call(trigger, dispatch, kwargs)
+
+    def _timed_call(self, trigger, dispatch, kwargs):
+        trigger_timings = self._timings.setdefault(trigger, {})
+        for callback, target in dispatch:
+            tic = time.perf_counter()
+            target(**kwargs)
+            elapsed = time.perf_counter() - tic
+            name = self.get_callback_name(callback)
+            total, num_calls = trigger_timings.get(name, (0., 0))
+            trigger_timings[name] = (total + elapsed, num_calls + 1)
+
+    def record_timings(self, yes=True):
+        """
+        Toggles recording the cumulative wall time spent in every callback at every trigger.
+        Callbacks are timed separately, even if they're of the same class (see
+        `get_callback_name`).
+        """
+        if yes and self._timings is None:
+            self._timings = {}
+        elif not yes:
+            self._timings = None
+        return self
+
+    @property
+    def is_recording_timings(self):
+        return self._timings is not None
+
+    def reset_timings(self):
+        if self._timings is not None:
+            self._timings = {}
+        return self
+
+    def get_timings(self, per='callback'):
+        """
+        Gets the recorded timings.
+
+        Parameters
+        ----------
+        per : {'callback', 'trigger'}
+            If 'callback', returns a dictionary mapping callback names (see
+            `get_callback_name`) to dictionaries, which in turn map triggers to the cumulative wall time (in seconds).
+            If 'trigger', returns a dictionary mapping triggers to the cumulative wall time
+            spent in all callbacks at that trigger.
+
+        Returns
+        -------
+        dict
+        """
+        assert_(per in ['callback', 'trigger'],
+                "`per` must be one of ['callback', 'trigger'], got {} instead.".format(per),
+                ValueError)
+        assert_(self._timings is not None, "Timings are not being recorded.", RuntimeError)
+        if per == 'trigger':
+            return {trigger: sum(total for total, _ in trigger_timings.values())
+                    for trigger, trigger_timings in self._timings.items()}
+        timings = {}
+        for trigger, trigger_timings in self._timings.items():
+            for name, (total, _) in trigger_timings.items():
+                timings.setdefault(name, {})[trigger] = total
+        return timings
 
     def get_config(self):
         # Pop trainer
         config_dict = dict(self.__dict__)
         config_dict.update({'_trainer': None})
+        # The dispatch table is rebuilt on the fly
+        config_dict.update({'_dispatch_table': {}})
         return config_dict
 
     def set_config(self, config_dict):
         self.__dict__.update(config_dict)
+        # Old pickles keep callbacks in sets (and come without priorities or timings)
+        if '_callback_priorities' not in config_dict:
+            self._callback_registry = {trigger: list(callbacks)
+                                       for trigger, callbacks in self._callback_registry.items()}
+            self._callback_priorities = {trigger: [0] * len(callbacks)
+                                         for trigger, callbacks in self._callback_registry.items()}
+            self._timings = None
+        if '_skipping_rank_zero_only' not in config_dict:
+            self._skipping_rank_zero_only = False
+        if '_callback_names' not in config_dict:
+            self._callback_names = []
+            for callbacks in self._callback_registry.values():
+                for callback in callbacks:
+                    self._name_callback(callback)
+        self._dispatch_table = {}
+        self.compile()
         return self
 
     def __getstate__(self):
@@ -125,6 +324,10 @@ class CallbackEngine(object):
 
 class Callback(object):
     """Recommended (but not required) base class for callbacks."""
+    # Whether the callback only has side effects outside of the training (e.g. logging),
+    # and therefore only needs to run at rank 0 when training distributed
+    RANK_ZERO_ONLY = False
+
     def __init__(self):
         self._trainer = None
         self._debugging = False
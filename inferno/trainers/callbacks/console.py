@@ -64,6 +64,8 @@ class ShowMinimalConsoleInfo(Callback):
     viz. current epoch number, current learning rate,
     training loss and training error if exists.
     """
+    RANK_ZERO_ONLY = True
+
     def __init__(self, *args, **kwargs):
         super(ShowMinimalConsoleInfo, self).__init__(*args, **kwargs)
 
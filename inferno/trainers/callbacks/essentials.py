@@ -19,6 +19,8 @@ class NaNDetector(Callback):
 
 
 class PersistentSave(Callback):
+    RANK_ZERO_ONLY = True
+
     def __init__(self, template='checkpoint.pytorch.epoch{epoch_count}.iteration{iteration_count}'):
         super(PersistentSave, self).__init__()
         self.template = template
@@ -39,6 +41,8 @@ class PersistentSave(Callback):
 
 class DumpHDF5Every(Callback):
     """Dumps intermediate training states to a HDF5 file."""
+    RANK_ZERO_ONLY = True
+
     def __init__(self, frequency, to_directory,
                  filename_template='dump.{mode}.epoch{epoch_count}.iteration{iteration_count}.h5',
                  force_dump=False, dump_after_every_validation_run=False):
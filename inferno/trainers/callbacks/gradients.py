@@ -5,6 +5,7 @@ from .base import Callback
 
 class LogOutputGradients(Callback):
     """Logs the gradient of the network output"""
+    RANK_ZERO_ONLY = True
 
     def __init__(self, frequency):
         super(LogOutputGradients, self).__init__()
@@ -10,6 +10,8 @@ class Logger(Callback):
     callbacks have no such guarantees. In this regard, they jointly handled by
     trainers and the callback engine.
     """
+    RANK_ZERO_ONLY = True
+
     def __init__(self, log_directory=None):
         super(Logger, self).__init__()
         self._log_directory = None
@@ -0,0 +1,132 @@
+import json
+import os
+import time
+
+from ...utils.train_utils import Frequency
+from ...utils.exceptions import assert_, FrequencyValueError
+from ...utils import python_utils as pyu
+from .base import Callback
+
+
+class PhaseTimingExporter(Callback):
+    """
+    Exports the phase timings of the trainer (see `Trainer.record_phase_timings`) to a
+    file, for a scraper or a dashboard to pick up.
+
+    Two formats are supported:
+
+        * 'jsonl': A JSON object is appended to the file on every export, with the
+          iteration and epoch counts, the (unix) time and the timings.
+        * 'prometheus': The file is (atomically) rewritten on every export in the
+          Prometheus text exposition format, e.g. for the textfile collector of the
+          Prometheus node exporter.
+    """
+    RANK_ZERO_ONLY = True
+    FORMATS = ['jsonl', 'prometheus']
+
+    def __init__(self, path, format='jsonl', frequency=10, metric_prefix='inferno',
+                 labels=None):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of the file to export to.
+        format : {'jsonl', 'prometheus'}
+            Format to export in.
+        frequency : inferno.utils.train_utils.Frequency or str or tuple or list or int
+            How often to export. Defaults to every 10 iterations.
+        metric_prefix : str
+            Prefix of the Prometheus metric names.
+        labels : dict
+            Labels to add to the Prometheus metrics (e.g. the name of the run).
+        """
+        super(PhaseTimingExporter, self).__init__()
+        assert_(format in self.FORMATS,
+                "`format` must be one of {}, got {} instead.".format(self.FORMATS, format),
+                ValueError)
+        self.path = path
+        self.format = format
+        self.export_every = frequency
+        self.metric_prefix = metric_prefix
+        self.labels = dict(labels or {})
+
+    @property
+    def export_every(self):
+        return self._export_every
+
+    @export_every.setter
+    def export_every(self, value):
+        self._export_every = Frequency.build_from(value)
+        assert_(self._export_every.is_consistent,
+                "Export frequency is not consistent.",
+                FrequencyValueError)
+
+    @property
+    def export_now(self):
+        return self.export_every.match(iteration_count=self.trainer.iteration_count,
+                                       epoch_count=self.trainer.epoch_count,
+                                       persistent=True, match_zero=False)
+
+    def end_of_training_iteration(self, **_):
+        assert_(self.trainer.records_phase_timings,
+                "The trainer is not recording phase timings. "
+                "Please call `trainer.record_phase_timings()` first.",
+                RuntimeError)
+        if self.trainer.phase_timer.num_iterations == 0 or not self.export_now:
+            return
+        self.export(self.trainer.get_phase_timings())
+
+    def export(self, timings):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        if self.format == 'jsonl':
+            record = {'iteration_count': self.trainer.iteration_count,
+                      'epoch_count': self.trainer.epoch_count,
+                      'time': time.time()}
+            record.update(timings)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        else:
+            text = self.to_prometheus_text(timings)
+            pyu.write_atomically(self.path, lambda f: f.write(text.encode('utf-8')))
+
+    def _format_labels(self, **extra_labels):
+        labels = dict(self.labels, **extra_labels)
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+                                                                .replace('"', '\\"'))
+                              for key, value in sorted(labels.items())) + '}'
+
+    def to_prometheus_text(self, timings):
+        """Formats `timings` (see `Trainer.get_phase_timings`) as Prometheus gauges."""
+        lines = []
+
+        def gauge(name, help_text, samples):
+            samples = [(labels, value) for labels, value in samples if value is not None]
+            if not samples:
+                return
+            name = '{}_{}'.format(self.metric_prefix, name)
+            lines.append('# HELP {} {}'.format(name, help_text))
+            lines.append('# TYPE {} gauge'.format(name))
+            for labels, value in samples:
+                lines.append('{}{} {!r}'.format(name, self._format_labels(**labels),
+                                                float(value)))
+
+        phases = sorted(key[:-len('_time')] for key in timings
+                        if key.endswith('_time') and key != 'iteration_time')
+        gauge('phase_time_seconds',
+              'Average time spent in a phase of a training iteration.',
+              [({'phase': phase}, timings['{}_time'.format(phase)]) for phase in phases])
+        gauge('iteration_time_seconds', 'Average duration of a training iteration.',
+              [({}, timings.get('iteration_time'))])
+        gauge('samples_per_second', 'Training throughput.',
+              [({}, timings.get('samples_per_second'))])
+        gauge('data_wait_fraction',
+              'Fraction of the training time spent waiting for data.',
+              [({}, timings.get('data_wait_fraction'))])
+        gauge('iteration_count', 'Number of training iterations so far.',
+              [({}, self.trainer.iteration_count)])
+        gauge('epoch_count', 'Number of training epochs so far.',
+              [({}, self.trainer.epoch_count)])
+        return '\n'.join(lines) + '\n'
@@ -22,6 +22,8 @@ class TQDMConsole(Console):
 
 
 class TQDMProgressBar(Callback):
+    RANK_ZERO_ONLY = True
+
     def __init__(self, *args, **kwargs):
         super(TQDMProgressBar, self).__init__(*args, **kwargs)
         self.epoch_bar = None
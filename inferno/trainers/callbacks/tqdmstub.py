@@ -1,6 +1,8 @@
 from .base import Callback
 
 class TQDMProgressBar(Callback):
+    RANK_ZERO_ONLY = True
+
     def __init__(self, *args, **kwargs):
         super(TQDMProgressBar, self).__init__(*args, **kwargs)
 
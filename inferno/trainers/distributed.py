@@ -0,0 +1,133 @@
+import importlib
+import pickle
+import socket
+
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, RandomSampler, IterableDataset
+from torch.utils.data.distributed import DistributedSampler
+
+from ..utils.exceptions import assert_
+
+
+def find_free_port():
+    """Returns a port on localhost that is free (at the time of asking)."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class UnpaddedDistributedSampler(DistributedSampler):
+    """
+    Like `DistributedSampler`, but the dataset is not padded (by repeating samples) to be
+    evenly divisible by the number of replicas. Every sample is therefore loaded exactly
+    once, but the shards might differ in length by one. This is fine for evaluation, but
+    not for training, where all processes must make the same number of steps.
+    """
+    def __iter__(self):
+        if self.shuffle:
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            indices = torch.randperm(len(self.dataset), generator=generator).tolist()
+        else:
+            indices = list(range(len(self.dataset)))
+        return iter(indices[self.rank::self.num_replicas])
+
+    def __len__(self):
+        return len(range(self.rank, len(self.dataset), self.num_replicas))
+
+
+def shard_loader(loader, num_replicas, rank, pad=True):
+    """
+    Returns a copy of `loader` that loads only the `rank`-th of `num_replicas` shards of
+    its dataset (with a `DistributedSampler`). The loader's other settings are kept, and
+    shuffling loaders remain shuffling (provided that `set_epoch` is called at the
+    beginning of every epoch).
+
+    With `pad`, the shards are padded to equal lengths by repeating samples (as required
+    for training). Without, every sample is in exactly one shard (as required for
+    evaluation).
+    """
+    if isinstance(loader.sampler, DistributedSampler):
+        return loader
+    assert_(not isinstance(loader.dataset, IterableDataset),
+            "Loaders of iterable datasets can't be sharded (they have no sampler).",
+            ValueError)
+    assert_(loader.batch_size is not None,
+            "Loaders with a custom batch sampler can't be sharded.",
+            ValueError)
+    sampler_class = DistributedSampler if pad else UnpaddedDistributedSampler
+    sampler = sampler_class(loader.dataset, num_replicas=num_replicas, rank=rank,
+                            shuffle=isinstance(loader.sampler, RandomSampler))
+    return DataLoader(loader.dataset, batch_size=loader.batch_size, sampler=sampler,
+                      num_workers=loader.num_workers, collate_fn=loader.collate_fn,
+                      pin_memory=loader.pin_memory, drop_last=loader.drop_last,
+                      timeout=loader.timeout, worker_init_fn=loader.worker_init_fn,
+                      multiprocessing_context=loader.multiprocessing_context,
+                      generator=loader.generator, prefetch_factor=loader.prefetch_factor,
+                      persistent_workers=loader.persistent_workers)
+
+
+def set_epoch(loader, epoch):
+    """
+    Tells the `DistributedSampler` of `loader` (if any) about the epoch, which seeds its
+    shuffling. Without, every epoch draws the same samples in the same order.
+    """
+    sampler = getattr(loader, 'sampler', None)
+    if isinstance(sampler, DistributedSampler):
+        sampler.set_epoch(epoch)
+    return loader
+
+
+def _fit(rank, serialized_trainer_config, pickle_module_name, world_size, backend,
+         init_method, num_threads, fit_kwargs, results):
+    # Runs in the worker processes
+    from .basic import Trainer
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    pickle_module = importlib.import_module(pickle_module_name)
+    dist.init_process_group(backend, init_method=init_method,
+                            rank=rank, world_size=world_size)
+    try:
+        trainer = Trainer().set_config(pickle_module.loads(serialized_trainer_config))
+        trainer.fit(**fit_kwargs)
+        if rank == 0:
+            # The parent keeps its loaders
+            config_dict = trainer.get_config()
+            for key in ['_loaders', '_loader_iters']:
+                config_dict.pop(key, None)
+            results.put(pickle_module.dumps(config_dict))
+    finally:
+        dist.destroy_process_group()
+
+
+def launch(trainer_config, world_size, backend='gloo', init_method=None, num_threads=None,
+           fit_kwargs=None, start_method='spawn', pickle_module=pickle):
+    """
+    Fits the trainer given by `trainer_config` in `world_size` processes, and returns the
+    config of the trainer at rank 0 once all processes are done.
+    """
+    # The config is sent pickled, such that every process gets its own copy. Otherwise,
+    # torch.multiprocessing would move the tensors to shared memory, and all processes
+    # would be training the same weights.
+    serialized_trainer_config = pickle_module.dumps(trainer_config)
+    init_method = 'tcp://127.0.0.1:{}'.format(find_free_port()) \
+        if init_method is None else init_method
+    context = mp.get_context(start_method)
+    results = context.SimpleQueue()
+    processes = mp.start_processes(_fit,
+                                   args=(serialized_trainer_config, pickle_module.__name__,
+                                         world_size, backend, init_method, num_threads,
+                                         fit_kwargs or {}, results),
+                                   nprocs=world_size, join=False, start_method=start_method)
+    result = None
+    # The result must be fetched before the processes can be joined. Joining raises if any
+    # of the processes failed.
+    while not processes.join(timeout=0.1):
+        if result is None and not results.empty():
+            result = results.get()
+    if result is None and not results.empty():
+        result = results.get()
+    assert_(result is not None, "The process at rank 0 did not report back.", RuntimeError)
+    return pickle_module.loads(result)
@@ -0,0 +1,157 @@
+import importlib
+import pickle
+import queue
+import traceback
+import weakref
+from collections import namedtuple
+
+import torch
+import torch.multiprocessing as mp
+
+from ..utils.exceptions import assert_
+
+ValidationResult = namedtuple('ValidationResult',
+                              ['iteration_count', 'epoch_count',
+                               'validation_loss', 'validation_error', 'traceback'])
+
+
+def _evaluate(serialized_trainer_config, pickle_module_name, loader_name, num_threads,
+              snapshots, results):
+    # Runs in the evaluator process
+    from .basic import Trainer
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    trainer_config = importlib.import_module(pickle_module_name).loads(serialized_trainer_config)
+    trainer = Trainer().set_config(trainer_config)
+    parent = mp.parent_process()
+    while True:
+        try:
+            job = snapshots.get(timeout=1.)
+        except queue.Empty:
+            # Don't outlive the trainer's process
+            if parent is not None and not parent.is_alive():
+                return
+            continue
+        if job is None:
+            return
+        iteration_count, epoch_count, state_dict = job
+        try:
+            trainer.model.load_state_dict(state_dict)
+            del state_dict
+            trainer.validate_for(loader_name=loader_name)
+            results.put(ValidationResult(iteration_count, epoch_count,
+                                         trainer.get_state('validation_loss_averaged'),
+                                         trainer.get_state('validation_error_averaged'),
+                                         None))
+        except Exception:
+            results.put(ValidationResult(iteration_count, epoch_count,
+                                         None, None, traceback.format_exc()))
+
+
+def _shutdown(process, snapshots):
+    if process.is_alive():
+        snapshots.put(None)
+        process.join()
+
+
+class BackgroundEvaluator(object):
+    """
+    Validates snapshots of a model in a separate process, while the trainer keeps training.
+
+    The evaluator process is given a copy of the trainer (without its callbacks, logger
+    and optimizer) and the validation loader. It then waits for snapshots (i.e. state
+    dictionaries) of the model, which it loads and validates with `Trainer.validate_for`.
+    The results can be collected with `poll`.
+    """
+    def __init__(self, trainer_config, loader_name='validate', num_threads=None,
+                 max_pending=1, start_method='spawn', pickle_module=pickle):
+        """
+        Parameters
+        ----------
+        trainer_config : dict
+            Config of the trainer to validate with (see `Trainer.get_config`). It must
+            contain the loader named `loader_name`.
+        loader_name : str
+            Name of the loader to validate on.
+        num_threads : int
+            Number of threads the evaluator process may use. Leave to None to use the
+            torch default.
+        max_pending : int
+            Maximum number of snapshots that may be pending (queued or being validated) at
+            any given time. Submitting more blocks until the oldest one is validated.
+        start_method : str
+            Multiprocessing start method. 'spawn' is the safe default (the trainer might
+            be running threads, e.g. for prefetching or writing checkpoints).
+        pickle_module : module
+            Module to pickle the trainer config with (`pickle` or `dill`).
+        """
+        assert_(isinstance(max_pending, int) and max_pending >= 1,
+                "`max_pending` must be a positive integer, got {} instead."
+                .format(max_pending),
+                ValueError)
+        self.max_pending = max_pending
+        self._num_pending = 0
+        self._results = []
+        context = mp.get_context(start_method)
+        self._snapshot_queue = context.Queue()
+        self._result_queue = context.Queue()
+        # The config is pickled here, because torch.multiprocessing would otherwise move
+        # the model's tensors to shared memory - and the evaluator would be loading the
+        # snapshots into the very weights being trained.
+        serialized_trainer_config = pickle_module.dumps(trainer_config)
+        # The process is not daemonic, because the validation loader might want to start
+        # worker processes of its own. The finalizer takes care of shutting it down.
+        self._process = context.Process(target=_evaluate,
+                                        args=(serialized_trainer_config, pickle_module.__name__,
+                                              loader_name, num_threads,
+                                              self._snapshot_queue, self._result_queue),
+                                        daemon=False)
+        self._process.start()
+        self._finalizer = weakref.finalize(self, _shutdown, self._process, self._snapshot_queue)
+
+    @property
+    def num_pending(self):
+        return self._num_pending
+
+    def _fetch_result(self, block):
+        while True:
+            try:
+                return self._result_queue.get(block=block, timeout=1. if block else None)
+            except queue.Empty:
+                if not block:
+                    return None
+                assert_(self._process.is_alive(),
+                        "The evaluator process died (with exit code {})."
+                        .format(self._process.exitcode),
+                        RuntimeError)
+
+    def submit(self, state_dict, iteration_count=None, epoch_count=None):
+        """
+        Submits a model snapshot for validation. The tensors in `state_dict` must not be
+        modified after they're submitted.
+        """
+        # Backpressure
+        while self._num_pending >= self.max_pending:
+            self._results.append(self._fetch_result(block=True))
+            self._num_pending -= 1
+        self._snapshot_queue.put((iteration_count, epoch_count, state_dict))
+        self._num_pending += 1
+        return self
+
+    def poll(self, block=False):
+        """
+        Returns the results (a list of `ValidationResult`s) that have come in since the
+        last poll. If `block`, waits until all pending snapshots are validated.
+        """
+        while self._num_pending > 0:
+            result = self._fetch_result(block=block)
+            if result is None:
+                break
+            self._results.append(result)
+            self._num_pending -= 1
+        results, self._results = self._results, []
+        return results
+
+    def close(self):
+        """Waits for the evaluator to finish with all pending snapshots, and shuts it down."""
+        self._finalizer()
@@ -0,0 +1,401 @@
+"""
+Structured checkpoints.
+
+A structured checkpoint is a single file with three sections:
+
+    1. A JSON index (preceded by a magic string and its length), which lists the device
+       and offset of every storage, and the storage, dtype, offset in the storage, shape
+       and strides of every tensor in the checkpoint.
+    2. The raw storage data, each storage starting at an aligned offset. Storages shared
+       by several tensors (e.g. tied weights, or views) are stored once, and are shared
+       again when loading.
+    3. The metadata, i.e. everything that is not a tensor, pickled. Tensors are referred
+       to by their key in the index.
+
+Because the tensor data is stored raw, it can be memory-mapped when loading: tensors are
+then backed by the (copy-on-write) mapped file, and their pages are read from disk only
+when they're accessed.
+"""
+
+import io
+import json
+import pickle
+import struct
+from inspect import signature
+
+import numpy as np
+import torch
+
+from .exceptions import assert_
+
+MAGIC = b'\x93INFERNO'
+FORMAT_VERSION = 2
+DEFAULT_ALIGNMENT = 64
+_HEADER_LENGTH_FORMAT = '<Q'
+
+
+def _align(offset, alignment):
+    return -(-offset // alignment) * alignment
+
+
+def _is_plain_tensor(object_):
+    # Sparse and quantized tensors (amongst others) are left to the pickle module
+    return torch.is_tensor(object_) and object_.layout == torch.strided and \
+        not object_.is_quantized and object_.device.type != 'meta'
+
+
+def _storage_bytes(storage):
+    # Returns a flat uint8 numpy view of the storage's data (on the CPU)
+    num_bytes = storage.nbytes()
+    data = torch.empty(0, dtype=torch.uint8, device=storage.device)
+    data.set_(storage, 0, (num_bytes,), (1,))
+    return data.to('cpu').numpy()
+
+
+def _saved_device(storage, devices=None):
+    if devices and storage.device.type == 'cpu' and storage.nbytes() > 0:
+        return devices.get(storage.data_ptr(), 'cpu')
+    return str(storage.device)
+
+
+def snapshot(tensor, storages=None, devices=None):
+    """
+    Copies `tensor` to the CPU, such that it can be serialized while the original is being
+    modified (e.g. in a background thread).
+
+    Tensors that share a storage (e.g. tied weights) share it in their snapshots as well,
+    provided that the same dictionary is passed as `storages` for all of them. The
+    devices the copied storages were taken from are recorded in `devices` (if given). Pass
+    it on to `torch_save` or `save_structured` to save the snapshots as if they were on
+    these devices, such that they're loaded to them.
+    """
+    storages = {} if storages is None else storages
+    original = tensor.detach()
+    storage = original.untyped_storage()
+    if storage.nbytes() == 0:
+        copy = original.to('cpu', copy=True)
+    else:
+        identity = (str(storage.device), storage.data_ptr())
+        if identity not in storages:
+            storages[identity] = _storage_snapshot(storage)
+            if devices is not None and storage.device.type != 'cpu':
+                devices[storages[identity].data_ptr()] = str(storage.device)
+        copy = torch.empty(0, dtype=original.dtype)
+        copy.set_(storages[identity], original.storage_offset(), original.shape,
+                  original.stride())
+    if isinstance(tensor, torch.nn.Parameter):
+        copy = torch.nn.Parameter(copy, requires_grad=tensor.requires_grad)
+    return copy
+
+
+def _storage_snapshot(storage):
+    data = _storage_bytes(storage)
+    if storage.device.type == 'cpu':
+        # Storages on other devices were copied to the CPU already, this one is a view
+        data = data.copy()
+    return torch.from_numpy(data).untyped_storage()
+
+
+def _map_device(device, map_location):
+    if map_location is None:
+        return torch.device(device)
+    if isinstance(map_location, dict):
+        return torch.device(map_location.get(device, device))
+    assert_(not callable(map_location),
+            "Structured checkpoints can't be loaded with a function as `map_location`. "
+            "Please use a device, a string or a dictionary instead.",
+            NotImplementedError)
+    return torch.device(map_location)
+
+
+def save_structured(object_, file, pickle_module=pickle, alignment=DEFAULT_ALIGNMENT,
+                    devices=None):
+    """
+    Writes `object_` as a structured checkpoint to `file`.
+
+    Parameters
+    ----------
+    object_ : object
+        Object to save, e.g. a trainer config or a model.
+    file : file-like
+        File object opened for writing (in binary mode).
+    pickle_module : module
+        Module used to pickle the metadata (`pickle` or `dill`).
+    alignment : int
+        Alignment (in bytes) of the tensor data in the file.
+    devices : dict
+        Devices to save storages on the CPU as, keyed by their data pointers (see
+        `snapshot`).
+    """
+    # The tensors and storages are held on to until the checkpoint is written, such that
+    # their ids and data pointers can't be reused by temporaries created while pickling.
+    tensors = []
+    tensor_keys = {}
+    storages = []
+    storage_keys = {}
+
+    def storage_key(storage):
+        # Storages are identified by their device and data pointer. Empty storages might
+        # not have a data pointer, but there's nothing to share in them either.
+        identity = (str(storage.device), storage.data_ptr()) if storage.nbytes() > 0 \
+            else ('empty', len(storages))
+        key = storage_keys.get(identity)
+        if key is None:
+            key = storage_keys[identity] = str(len(storages))
+            storages.append(storage)
+        return key
+
+    class Pickler(pickle_module.Pickler):
+        def persistent_id(self, obj):
+            if not _is_plain_tensor(obj):
+                return None
+            key = tensor_keys.get(id(obj))
+            if key is None:
+                key = tensor_keys[id(obj)] = str(len(tensors))
+                tensors.append((obj, storage_key(obj.untyped_storage())))
+            return 'tensor', key
+
+    metadata = io.BytesIO()
+    Pickler(metadata, protocol=getattr(pickle_module, 'DEFAULT_PROTOCOL', 2)).dump(object_)
+    metadata = metadata.getvalue()
+
+    # Build the index. Offsets are relative to the beginning of the data section.
+    storage_index = {}
+    offset = 0
+    for key, storage in zip(map(str, range(len(storages))), storages):
+        num_bytes = storage.nbytes()
+        storage_index[key] = {'device': _saved_device(storage, devices),
+                              'offset': offset,
+                              'nbytes': num_bytes}
+        offset = _align(offset + num_bytes, alignment)
+    tensor_index = {}
+    for key, (tensor, key_of_storage) in zip(map(str, range(len(tensors))), tensors):
+        tensor_index[key] = {'storage': key_of_storage,
+                             'dtype': str(tensor.dtype).replace('torch.', ''),
+                             'storage_offset': tensor.storage_offset(),
+                             'shape': list(tensor.shape),
+                             'stride': list(tensor.stride()),
+                             'requires_grad': tensor.requires_grad,
+                             'parameter': isinstance(tensor, torch.nn.Parameter)}
+    header = json.dumps({'version': FORMAT_VERSION,
+                         'alignment': alignment,
+                         'storages': storage_index,
+                         'tensors': tensor_index,
+                         'metadata': {'offset': offset, 'nbytes': len(metadata)}}).encode('utf-8')
+
+    # Write
+    position = 0
+
+    def write(data, at=None):
+        nonlocal position
+        if at is not None and at > position:
+            file.write(b'\x00' * (at - position))
+            position = at
+        file.write(data)
+        position += len(data)
+
+    write(MAGIC)
+    write(struct.pack(_HEADER_LENGTH_FORMAT, len(header)))
+    write(header)
+    data_start = _align(position, alignment)
+    for key, storage in zip(map(str, range(len(storages))), storages):
+        write(_storage_bytes(storage).tobytes(), at=data_start + storage_index[key]['offset'])
+    write(metadata, at=data_start + offset)
+
+
+def read_header(path):
+    """
+    Reads the index of the structured checkpoint at `path`.
+
+    Returns
+    -------
+    tuple
+        The header (as a dictionary) and the offset of the data section in the file.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+        assert_(magic == MAGIC, "'{}' is not a structured checkpoint.".format(path), ValueError)
+        header_length, = struct.unpack(_HEADER_LENGTH_FORMAT,
+                                       f.read(struct.calcsize(_HEADER_LENGTH_FORMAT)))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        data_start = _align(f.tell(), header['alignment'])
+    assert_(header['version'] <= FORMAT_VERSION,
+            "Structured checkpoint format version {} is not supported (by this version of "
+            "inferno).".format(header['version']),
+            ValueError)
+    return header, data_start
+
+
+def is_structured(path):
+    """Whether the file at `path` is a structured checkpoint."""
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _storage_from_buffer(buffer, entry, offset):
+    # Returns a flat uint8 tensor backed by (i.e. sharing memory with) the buffer
+    if entry['nbytes'] == 0:
+        return torch.empty(0, dtype=torch.uint8)
+    if hasattr(torch, 'frombuffer'):
+        return torch.frombuffer(buffer, dtype=torch.uint8, count=entry['nbytes'],
+                                offset=offset)
+    return torch.from_numpy(buffer[offset:offset + entry['nbytes']])
+
+
+def _tensor_from_buffer(buffer, entry, offset):
+    # Tensors of version 1 checkpoints are stored contiguously, each on its own
+    dtype = getattr(torch, entry['dtype'])
+    shape = entry['shape']
+    num_elements = int(np.prod(shape))
+    if num_elements == 0:
+        return torch.empty(shape, dtype=dtype)
+    if hasattr(torch, 'frombuffer'):
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=num_elements, offset=offset)
+    else:
+        # Older torch versions can only share memory with numpy
+        numpy_dtype = torch.empty(0, dtype=dtype).numpy().dtype
+        tensor = torch.from_numpy(buffer[offset:offset + entry['nbytes']].view(numpy_dtype))
+    return tensor.view(shape)
+
+
+def load_structured(path, pickle_module=pickle, map_location=None, mmap=True):
+    """
+    Loads the structured checkpoint at `path`.
+
+    Parameters
+    ----------
+    path : str
+        Path to the checkpoint.
+    pickle_module : module
+        Module used to unpickle the metadata.
+    map_location : torch.device or str or dict
+        Specify how to remap devices. Tensors are loaded to the device they were saved
+        from if this is not provided.
+    mmap : bool
+        Whether to memory-map the tensor data. If not, the file is read to memory.
+
+    Returns
+    -------
+    object
+        The saved object.
+    """
+    header, data_start = read_header(path)
+    if mmap:
+        # Copy-on-write, such that the loaded tensors can be modified in place without
+        # touching the file
+        buffer = np.memmap(path, dtype=np.uint8, mode='c')
+    else:
+        buffer = np.fromfile(path, dtype=np.uint8)
+    tensors = {}
+    storages = {}
+
+    def get_storage(key):
+        # Storages are moved to their device once, such that they remain shared
+        if key not in storages:
+            entry = header['storages'][key]
+            storage = _storage_from_buffer(buffer, entry, data_start + entry['offset'])
+            device = _map_device(entry['device'], map_location)
+            if device.type != 'cpu':
+                storage = storage.to(device)
+            storages[key] = storage.untyped_storage()
+        return storages[key]
+
+    def get_tensor(key):
+        if key not in tensors:
+            entry = header['tensors'][key]
+            if header['version'] < 2:
+                tensor = _tensor_from_buffer(buffer, entry, data_start + entry['offset'])
+                device = _map_device(entry['device'], map_location)
+                if device.type != 'cpu':
+                    tensor = tensor.to(device)
+            else:
+                storage = get_storage(entry['storage'])
+                tensor = torch.empty(0, dtype=getattr(torch, entry['dtype']),
+                                     device=storage.device)
+                tensor.set_(storage, entry['storage_offset'], entry['shape'],
+                            entry['stride'])
+            if entry['parameter']:
+                tensor = torch.nn.Parameter(tensor, requires_grad=entry['requires_grad'])
+            elif entry['requires_grad']:
+                tensor.requires_grad_()
+            tensors[key] = tensor
+        return tensors[key]
+
+    class Unpickler(pickle_module.Unpickler):
+        def persistent_load(self, pid):
+            kind, key = pid
+            assert_(kind == 'tensor', "Unknown persistent id: {}".format(kind), ValueError)
+            return get_tensor(key)
+
+    metadata_start = data_start + header['metadata']['offset']
+    metadata = buffer[metadata_start:metadata_start + header['metadata']['nbytes']].tobytes()
+    return Unpickler(io.BytesIO(metadata)).load()
+
+
+class _DeviceTaggingPickleModule(object):
+    """
+    Stands in for a pickle module in `torch.save`. Its pickler saves the storages in
+    `devices` (keyed by their data pointers) as if they were on the devices given there.
+    """
+    # torch.save looks at the name of the pickle module (to check the version of dill)
+    __name__ = __name__
+
+    def __init__(self, pickle_module, devices):
+        # Persistent ids are rewritten as they're saved, which is only possible with the
+        # pure-python picklers (like the one of dill)
+        base = pickle_module.Pickler if issubclass(pickle_module.Pickler, pickle._Pickler) \
+            else pickle._Pickler
+
+        class Pickler(base):
+            _saving = None
+
+            def save(self, obj, save_persistent_id=True):
+                # The persistent id of `obj` (if any) is saved right after it's computed
+                self._saving = obj
+                return super(Pickler, self).save(obj, save_persistent_id)
+
+            def save_pers(self, pid):
+                # torch saves storages with ('storage', type, key, location, size)
+                storage = self._saving
+                if isinstance(storage, torch.storage.TypedStorage):
+                    storage = storage.untyped()
+                if isinstance(pid, tuple) and len(pid) == 5 and pid[0] == 'storage' and \
+                        torch.is_storage(storage) and storage.device.type == 'cpu' and \
+                        storage.nbytes() > 0 and storage.data_ptr() in devices:
+                    pid = pid[:3] + (devices[storage.data_ptr()],) + pid[4:]
+                return super(Pickler, self).save_pers(pid)
+
+        self.Pickler = Pickler
+        self.Unpickler = pickle_module.Unpickler
+
+
+def torch_save(object_, f, pickle_module=pickle, devices=None):
+    """
+    Like `torch.save`, but storages on the CPU that are in `devices` (see `snapshot`) are
+    saved as if they were on the devices given there, and are therefore loaded to them.
+    """
+    if devices:
+        pickle_module = _DeviceTaggingPickleModule(pickle_module, devices)
+    torch.save(object_, f, pickle_module=pickle_module)
+
+
+def torch_load(f, **kwargs):
+    """
+    Like `torch.load`, but allows unpickling arbitrary objects on versions of torch where
+    `weights_only` defaults to True (checkpoints contain entire trainers).
+    """
+    if 'weights_only' in signature(torch.load).parameters:
+        kwargs.setdefault('weights_only', False)
+    return torch.load(f, **kwargs)
+
+
+def load(path, pickle_module=pickle, map_location=None, mmap=True):
+    """
+    Loads a checkpoint, be it a structured checkpoint or one written by `torch.save`.
+    The tensor data of structured checkpoints is memory-mapped if `mmap` is set.
+    """
+    if is_structured(path):
+        return load_structured(path, pickle_module=pickle_module,
+                               map_location=map_location, mmap=mmap)
+    else:
+        return torch_load(path, pickle_module=pickle_module, map_location=map_location)
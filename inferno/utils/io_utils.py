@@ -32,6 +32,32 @@ def toh5(data, path, datapath='data', compression=None, chunks=None):
         f.create_dataset(datapath, data=data, compression=compression, chunks=chunks)
 
 
+def tonpy(data, path, dtype=None, max_block_size=2 ** 28):
+    """
+    Write `data` to a .npy file, or to a raw file if `path` doesn't end with '.npy'.
+    `data` can be anything with a shape, a dtype and numpy-like slicing (e.g. a h5py or z5py
+    dataset): it's copied in blocks along the first axis of at most `max_block_size` bytes,
+    such that it doesn't need to fit in memory. The result can be loaded with
+    `MemmapVolumeLoader`.
+    """
+    shape = tuple(data.shape)
+    dtype = np.dtype(data.dtype if dtype is None else dtype)
+    if path.lower().endswith('.npy'):
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    else:
+        out = np.memmap(path, mode='w+', dtype=dtype, shape=shape)
+    if len(shape) == 0:
+        out[...] = data[()]
+    else:
+        plane_size = dtype.itemsize * int(np.prod(shape[1:]))
+        block_size = max(1, max_block_size // max(plane_size, 1))
+        for start in range(0, shape[0], block_size):
+            out[start:start + block_size] = data[start:start + block_size]
+    out.flush()
+    del out
+    return path
+
+
 def fromz5(path, datapath, dataslice=None, n_threads=8):
     # we import z5py only here because we don't want to assume that it's in the env
     import z5py
@@ -1,7 +1,20 @@
+import contextlib
+import copy
+import warnings
+from collections import OrderedDict
+
 import torch
 from torch.autograd import Variable
 from .exceptions import assert_, NotTorchModuleError, ShapeError
 
+try:
+    import torch._dynamo
+    # Errors that torch.compile raises when it fails to compile (as opposed to errors
+    # raised by the model itself)
+    COMPILATION_ERRORS = (torch._dynamo.exc.TorchDynamoException,)
+except (ImportError, AttributeError):
+    COMPILATION_ERRORS = ()
+
 
 def is_model_cuda(model):
     try:
@@ -11,6 +24,60 @@ def is_model_cuda(model):
         return False
 
 
+def script_model(model):
+    """
+    Compiles `model` with TorchScript. If `model` can't be scripted as a whole, its
+    submodules are scripted (recursively) where possible, and the rest runs eagerly.
+    The result shares its parameters with `model`.
+    """
+    try:
+        with warnings.catch_warnings():
+            # torch.jit.script is deprecated in newer versions of torch
+            warnings.simplefilter('ignore', FutureWarning)
+            return torch.jit.script(model)
+    except Exception:
+        pass
+    if not model._modules:
+        return model
+    # Shallow copy, such that `model` itself is left untouched
+    partially_scripted_model = copy.copy(model)
+    partially_scripted_model._modules = OrderedDict(
+        (name, None if module is None else script_model(module))
+        for name, module in model._modules.items())
+    return partially_scripted_model
+
+
+def compile_model(model, method='auto', **compile_kwargs):
+    """
+    Compiles `model`, either with `torch.compile` (with `method = 'compile'`) or with
+    TorchScript (`method = 'script'`, see `script_model`). With `method = 'auto'`,
+    `torch.compile` is used if available. The compiled model shares its parameters with
+    `model`.
+    """
+    assert_(method in ['auto', 'compile', 'script'],
+            "`method` must be one of ['auto', 'compile', 'script'], got {} instead."
+            .format(method),
+            ValueError)
+    if method == 'auto':
+        method = 'compile' if hasattr(torch, 'compile') else 'script'
+    if method == 'compile':
+        assert_(hasattr(torch, 'compile'), "torch.compile requires torch >= 2.0.", RuntimeError)
+        return torch.compile(model, **compile_kwargs)
+    else:
+        return script_model(model)
+
+
+def compilation_errors_suppressed():
+    """
+    Context manager within which torch.compile falls back to running eagerly whatever
+    it fails to compile.
+    """
+    if COMPILATION_ERRORS:
+        return torch._dynamo.config.patch(suppress_errors=True)
+    else:
+        return contextlib.suppress()
+
+
 class ModelTester(object):
     def __init__(self, input_shape, expected_output_shape):
         self._is_cuda = False
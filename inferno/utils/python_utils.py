@@ -4,8 +4,11 @@ import warnings
 import functools
 import inspect
 import os
+import queue
+import shutil
+import tempfile
 
-from threading import current_thread, main_thread
+from threading import current_thread, main_thread, Thread, BoundedSemaphore
 
 
 def ensure_dir(directory):
@@ -24,6 +27,122 @@ def ensure_dir(directory):
     return directory
 
 
+def write_atomically(path, write_function):
+    """Write to a file such that `path` never points to a partially written file.
+
+        `write_function` is called with a temporary file (opened in binary mode) in
+        the same directory as `path`. The file is then flushed to disk and renamed
+        to `path`.
+
+    Args:
+        path (str): path of the file to write
+        write_function (callable): writes the contents to the file object it's passed
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    file_descriptor, temporary_path = tempfile.mkstemp(prefix='.{}.'.format(filename),
+                                                       suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(file_descriptor, 'wb') as f:
+            write_function(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+    return path
+
+
+def link_or_copy(source, destination):
+    """Hard-link `source` to `destination`, or copy it if that's not possible.
+
+        Any existing file at `destination` is replaced atomically.
+
+    Args:
+        source (str): path of the existing file
+        destination (str): path of the link (or copy)
+    """
+    directory, filename = os.path.split(os.path.abspath(destination))
+    temporary_path = os.path.join(directory, '.{}.{}.tmp'.format(filename, os.getpid()))
+    if os.path.lexists(temporary_path):
+        os.remove(temporary_path)
+    try:
+        os.link(source, temporary_path)
+    except OSError:
+        # E.g. the file system doesn't support hard links
+        shutil.copyfile(source, temporary_path)
+    os.replace(temporary_path, destination)
+    return destination
+
+
+class BackgroundWorker(object):
+    """Runs jobs in a background thread, one after the other.
+
+        At most `max_pending` jobs are pending (queued or running) at any time;
+        submitting more blocks until the oldest job is done. Exceptions raised
+        by a job are re-raised by the next call to `submit` or `wait`.
+    """
+    def __init__(self, max_pending=1):
+        assert max_pending >= 1, "`max_pending` must be at least 1."
+        self.max_pending = max_pending
+        self._slots = BoundedSemaphore(max_pending)
+        self._jobs = queue.Queue()
+        self._exceptions = []
+        self._thread = None
+
+    @staticmethod
+    def _work(jobs, slots, exceptions):
+        # This must not hold a reference to the worker object, such that it can be
+        # garbage collected (which stops the thread).
+        while True:
+            job = jobs.get()
+            if job is None:
+                jobs.task_done()
+                return
+            function, args, kwargs = job
+            try:
+                function(*args, **kwargs)
+            except BaseException as exception:
+                exceptions.append(exception)
+            finally:
+                slots.release()
+                jobs.task_done()
+
+    def _raise_if_failed(self):
+        if self._exceptions:
+            exception = self._exceptions.pop(0)
+            del self._exceptions[:]
+            raise exception
+
+    def submit(self, job, *args, **kwargs):
+        self._raise_if_failed()
+        # Backpressure: wait for a slot
+        self._slots.acquire()
+        if self._thread is None:
+            self._thread = Thread(target=self._work,
+                                  args=(self._jobs, self._slots, self._exceptions),
+                                  daemon=True)
+            self._thread.start()
+        self._jobs.put((job, args, kwargs))
+        return self
+
+    def __del__(self):
+        if getattr(self, '_thread', None) is not None:
+            # Let the thread finish the pending jobs and exit
+            self._jobs.put(None)
+
+    @property
+    def num_pending(self):
+        return self._jobs.unfinished_tasks
+
+    def wait(self):
+        """Blocks until all submitted jobs are done."""
+        self._jobs.join()
+        self._raise_if_failed()
+        return self
+
+
 def require_dict_kwargs(kwargs, msg=None):
     """ Ensure arguments passed kwargs are either None or a dict.
         If arguments are neither a dict nor None a RuntimeError
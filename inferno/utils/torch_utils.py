@@ -37,6 +37,37 @@ def unwrap(tensor_or_variable, to_cpu=True, as_numpy=False, extract_item=False):
         return tensor
 
 
+class DeferredUnwrap(object):
+    """
+    Defers `unwrap` (and with it, the potential device-to-host copy) of a tensor or
+    variable until its value is actually read. The value is unwrapped at most once.
+    """
+    def __init__(self, tensor_or_variable, **unwrap_kwargs):
+        # Detaching is cheap and keeps us from holding on to the graph
+        self._wrapped = unwrap(tensor_or_variable, to_cpu=False)
+        self._unwrap_kwargs = unwrap_kwargs
+        self._value = None
+        self._is_unwrapped = False
+
+    @property
+    def value(self):
+        if not self._is_unwrapped:
+            self._value = unwrap(self._wrapped, **self._unwrap_kwargs)
+            self._wrapped = None
+            self._is_unwrapped = True
+        return self._value
+
+    @property
+    def is_unwrapped(self):
+        return self._is_unwrapped
+
+    @property
+    def is_scalar(self):
+        """Whether the value is a number or a tensor with a single element."""
+        value = self._value if self._is_unwrapped else self._wrapped
+        return isinstance(value, (float, int)) or is_scalar_tensor(value)
+
+
 def is_tensor(object_):
     missed_tensor_classes = (torch.HalfTensor,)
     return torch.is_tensor(object_) or isinstance(object_, missed_tensor_classes)
@@ -1,4 +1,9 @@
 """Utilities for training."""
+import contextlib
+import queue
+import threading
+import time
+from collections import deque
 import numpy as np
 from .exceptions import assert_, FrequencyTypeError, FrequencyValueError
 
@@ -27,6 +32,48 @@ class AverageMeter(object):
         self.avg = self.sum / self.count
 
 
+class TensorAverageMeter(AverageMeter):
+    """
+    Like `AverageMeter`, but keeps the running sum of tensor values as a tensor (on the
+    device the values live on). Updating therefore doesn't synchronize with the device;
+    the values are only converted to python numbers when `val`, `sum` or `avg` is read.
+    """
+    def __init__(self):
+        # `val`, `sum` and `avg` are derived here, so AverageMeter.__init__ is not called
+        self.reset()
+
+    def reset(self):
+        self._val = 0
+        self._sum = 0
+        self.count = 0
+
+    def update(self, val, n=1):
+        if hasattr(val, 'detach'):
+            val = val.detach()
+            # Accumulate in (at least) single precision
+            if not val.is_floating_point() or val.element_size() < 4:
+                val = val.float()
+        self._val = val
+        self._sum = self._sum + val * n
+        self.count += n
+
+    @staticmethod
+    def _materialize(value):
+        return value.item() if hasattr(value, 'item') else value
+
+    @property
+    def val(self):
+        return self._materialize(self._val)
+
+    @property
+    def sum(self):
+        return self._materialize(self._sum)
+
+    @property
+    def avg(self):
+        return self.sum / self.count if self.count > 0 else 0
+
+
 class MovingAverage(object):
     """Computes the moving average of a given float."""
     def __init__(self, momentum=0):
@@ -54,6 +101,288 @@ class MovingAverage(object):
             return None
 
 
+class PhaseTimer(object):
+    """
+    Times the phases (e.g. 'forward', 'backward') of training iterations, and keeps the
+    timings of the last `window_size` iterations for rolling averages.
+
+    Phases are timed with `time` between `start_iteration` and `end_iteration`; phases
+    timed outside of an iteration are not recorded. A phase may be timed several times
+    in an iteration, in which case the durations add up.
+    """
+    def __init__(self, window_size=50, synchronize_cuda=False):
+        """
+        Parameters
+        ----------
+        window_size : int
+            Number of iterations to average over.
+        synchronize_cuda : bool
+            Whether to synchronize with the GPU before reading the clock. CUDA calls are
+            asynchronous, so without synchronizing, the time spent on the GPU is
+            attributed to whichever phase waits for it first.
+        """
+        assert_(isinstance(window_size, int) and window_size > 0,
+                "`window_size` must be a positive integer, got {} instead."
+                .format(window_size),
+                ValueError)
+        self.window_size = window_size
+        self.synchronize_cuda = synchronize_cuda
+        self._history = deque(maxlen=window_size)
+        self._iteration_started_at = None
+        self._phase_durations = {}
+        self._num_samples = 0
+
+    def _clock(self):
+        if self.synchronize_cuda:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+        return time.perf_counter()
+
+    @property
+    def in_iteration(self):
+        return self._iteration_started_at is not None
+
+    def start_iteration(self):
+        self._phase_durations = {}
+        self._num_samples = 0
+        self._iteration_started_at = self._clock()
+        return self
+
+    def end_iteration(self):
+        assert_(self.in_iteration, "No iteration was started.", RuntimeError)
+        duration = self._clock() - self._iteration_started_at
+        self._history.append((duration, self._num_samples, self._phase_durations))
+        self._iteration_started_at = None
+        return self
+
+    def count_samples(self, num_samples):
+        """Records that `num_samples` samples were processed in the current iteration."""
+        self._num_samples += num_samples
+        return self
+
+    @contextlib.contextmanager
+    def time(self, phase):
+        """Context manager that adds the time spent in its body to `phase`."""
+        if not self.in_iteration:
+            yield
+            return
+        tic = self._clock()
+        try:
+            yield
+        finally:
+            elapsed = self._clock() - tic
+            self._phase_durations[phase] = self._phase_durations.get(phase, 0.) + elapsed
+
+    def reset(self):
+        self._history.clear()
+        self._iteration_started_at = None
+        return self
+
+    @property
+    def num_iterations(self):
+        """Number of iterations in the window."""
+        return len(self._history)
+
+    @property
+    def iteration_duration(self):
+        """Average duration (in seconds) of an iteration."""
+        if not self._history:
+            return None
+        return sum(duration for duration, _, _ in self._history) / len(self._history)
+
+    def phase_durations(self):
+        """Returns a dictionary with the average duration (in seconds) of every phase."""
+        totals = {}
+        for _, _, phase_durations in self._history:
+            for phase, duration in phase_durations.items():
+                totals[phase] = totals.get(phase, 0.) + duration
+        return {phase: total / len(self._history) for phase, total in totals.items()}
+
+    @property
+    def samples_per_second(self):
+        total_duration = sum(duration for duration, _, _ in self._history)
+        if total_duration == 0:
+            return None
+        return sum(num_samples for _, num_samples, _ in self._history) / total_duration
+
+    def fraction_of_time_in(self, phases):
+        """Returns the fraction of the time that was spent in `phases`."""
+        total_duration = sum(duration for duration, _, _ in self._history)
+        if total_duration == 0:
+            return None
+        return sum(phase_durations.get(phase, 0.)
+                   for _, _, phase_durations in self._history
+                   for phase in phases) / total_duration
+
+
+def num_samples_in(loader):
+    """
+    Returns the number of samples a pass over the `torch.utils.data.DataLoader` `loader`
+    yields, as given by its sampler, batch size and `drop_last`. Returns None if that
+    can't be known in advance, e.g. for iterable datasets or custom batch samplers.
+    """
+    batch_size = getattr(loader, 'batch_size', None)
+    sampler = getattr(loader, 'sampler', None)
+    if batch_size is None or sampler is None:
+        return None
+    try:
+        num_samples = len(sampler)
+    except TypeError:
+        return None
+    if getattr(loader, 'drop_last', False):
+        num_samples = (num_samples // batch_size) * batch_size
+    return num_samples
+
+
+def _record_stream(objects, stream):
+    # Marks all CUDA tensors in `objects` (which may be nested lists, tuples or dicts) as
+    # being used on `stream`
+    if isinstance(objects, (list, tuple)):
+        for _object in objects:
+            _record_stream(_object, stream)
+    elif isinstance(objects, dict):
+        for _object in objects.values():
+            _record_stream(_object, stream)
+    elif getattr(objects, 'is_cuda', False):
+        objects.record_stream(stream)
+
+
+class BatchPrefetcher(object):
+    """
+    Stages batches from a loader in a background thread.
+
+    The worker thread loops over `loader` pass after pass (or for `num_passes` passes),
+    applies `transform` to every batch (e.g. to send it to the device and cast it) and
+    keeps up to `depth` batches queued. Iterating over the prefetcher raises
+    `StopIteration` at the end of every pass over the loader; iterating further picks up
+    the (already staged) batches of the next pass. Once `num_passes` passes are done,
+    the worker stops, and iterating further raises `StopIteration` right away.
+
+    If given, `begin_pass` is called (in the worker thread) with the number of the pass
+    before every pass over the loader, e.g. to set the epoch of a distributed sampler.
+
+    With a CUDA `stream`, `transform` runs on that stream, such that its host to device
+    copies (if they're non-blocking) overlap with the computations on the stream of the
+    consumer. The consumer's stream then waits for every batch to be staged before it's
+    handed out.
+    """
+    # Poll interval (in seconds) for the worker to check whether it should stop
+    _POLL_INTERVAL = 0.1
+
+    class _EndOfPass(object):
+        pass
+
+    class _StagedBatch(object):
+        def __init__(self, batch, event):
+            self.batch = batch
+            self.event = event
+
+    class _WorkerError(object):
+        def __init__(self, exception):
+            self.exception = exception
+
+    def __init__(self, loader, depth=2, transform=None, num_passes=None, begin_pass=None,
+                 stream=None):
+        assert_(isinstance(depth, int) and depth > 0,
+                "`depth` must be a positive integer, got {} instead.".format(depth),
+                ValueError)
+        assert_(num_passes is None or (isinstance(num_passes, int) and num_passes > 0),
+                "`num_passes` must be a positive integer, got {} instead."
+                .format(num_passes),
+                ValueError)
+        self.loader = loader
+        self.depth = depth
+        self.num_passes = num_passes
+        self._num_passes_done = 0
+        self._queue = queue.Queue(maxsize=depth)
+        self._stop_event = threading.Event()
+        # The worker must not hold a reference to self, lest the prefetcher is never
+        # garbage collected (and the thread never stopped).
+        self._thread = threading.Thread(target=self._work,
+                                        args=(loader, transform, num_passes, begin_pass,
+                                              stream, self._queue, self._stop_event),
+                                        daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def _work(cls, loader, transform, num_passes, begin_pass, stream, queue_, stop_event):
+        def put(item):
+            while not stop_event.is_set():
+                try:
+                    queue_.put(item, timeout=cls._POLL_INTERVAL)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        try:
+            num_passes_done = 0
+            while not stop_event.is_set() and \
+                    (num_passes is None or num_passes_done < num_passes):
+                if begin_pass is not None:
+                    begin_pass(num_passes_done)
+                for batch in loader:
+                    if stream is not None:
+                        import torch
+                        with torch.cuda.stream(stream):
+                            if transform is not None:
+                                batch = transform(batch)
+                            event = torch.cuda.Event()
+                            event.record(stream)
+                        batch = cls._StagedBatch(batch, event)
+                    elif transform is not None:
+                        batch = transform(batch)
+                    if not put(batch):
+                        return
+                if not put(cls._EndOfPass):
+                    return
+                num_passes_done += 1
+        except Exception as exception:
+            put(cls._WorkerError(exception))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        assert_(not self._stop_event.is_set(), "Prefetcher is closed.", RuntimeError)
+        if self.num_passes is not None and self._num_passes_done >= self.num_passes:
+            raise StopIteration
+        item = self._queue.get()
+        if item is self._EndOfPass:
+            self._num_passes_done += 1
+            raise StopIteration
+        elif isinstance(item, self._WorkerError):
+            self.close()
+            raise item.exception
+        elif isinstance(item, self._StagedBatch):
+            import torch
+            current_stream = torch.cuda.current_stream()
+            current_stream.wait_event(item.event)
+            # The memory of the batch was allocated on the staging stream, and must not be
+            # reused before the consumer's stream is done with it
+            _record_stream(item.batch, current_stream)
+            return item.batch
+        return item
+
+    def __len__(self):
+        return len(self.loader)
+
+    def close(self):
+        self._stop_event.set()
+        # Unblock the worker if it's waiting on a full queue
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def __del__(self):
+        # __init__ might not have made it this far
+        if hasattr(self, '_stop_event'):
+            self.close()
+
+
 class CLUI(object):
     """Command Line User Interface"""
 
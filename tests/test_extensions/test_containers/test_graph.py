@@ -100,6 +100,167 @@ class TestGraph(unittest.TestCase):
         model.add_output_node('output_0', previous='conv1')
         ModelTester((1, 1, 100, 100), (1, 1, 100, 100))(model)
 
+    def test_graph_execution_plan(self):
+        from inferno.extensions.containers.graph import Graph
+
+        history = []
+        model = Graph()
+        model.add_input_node('input_0')
+        model.add_node('conv0', self.DummyNamedModule('conv0', history), 'input_0')
+        model.add_node('conv1', self.DummyNamedModule('conv1', history), 'conv0')
+        model.add_node('aux', self.DummyNamedModule('aux', history), 'conv0')
+        model.add_output_node('output_0', 'conv1')
+        plan = model.execution_plan
+        # The plan is cached, and the sink 'aux' is not evaluated
+        self.assertIs(model.execution_plan, plan)
+        self.assertEqual([name for name, _, _ in plan.steps], ['conv0', 'conv1'])
+        model(torch.rand(10, 10))
+        self.assertEqual(history, ['conv0', 'conv1'])
+        # Changing the topology invalidates the plan
+        model.add_node('conv2', self.DummyNamedModule('conv2', history, 2),
+                       ['conv1', 'aux'])
+        self.assertIsNot(model.execution_plan, plan)
+        model.add_output_node('output_1', 'conv2')
+        self.assertEqual(len(model(torch.rand(10, 10))), 2)
+        self.assertEqual(history[2:], ['conv0', 'conv1', 'aux', 'conv2'])
+        # So does changing the internal graph directly, or through `apply_on_graph`
+        model.graph.remove_node('output_1')
+        self.assertEqual([name for name, _, _ in model.execution_plan.steps],
+                         ['conv0', 'conv1'])
+        model.add_output_node('output_1', 'conv2')
+        self.assertEqual(len(model.execution_plan.output_slots), 2)
+
+        def demote_output_1(graph):
+            graph.graph.node['output_1']['is_output_node'] = False
+
+        model.apply_on_graph(demote_output_1)
+        self.assertEqual([name for name, _, _ in model.execution_plan.steps],
+                         ['conv0', 'conv1'])
+
+    def test_graph_output_pruning(self):
+        from inferno.extensions.containers.graph import Graph
+
+        history = []
+        model = Graph()
+        model.add_input_node('input_0')
+        model.add_node('conv0', self.DummyNamedModule('conv0', history), 'input_0')
+        model.add_node('seg', self.DummyNamedModule('seg', history), 'conv0')
+        model.add_node('aux', self.DummyNamedModule('aux', history), 'conv0')
+        model.add_output_node('seg_output', 'seg')
+        model.add_output_node('aux_output', 'aux')
+        input = torch.rand(10, 10)
+        self.assertEqual(len(model(input)), 2)
+        self.assertEqual(history, ['conv0', 'seg', 'aux'])
+        # Only the ancestors of the requested outputs are evaluated
+        del history[:]
+        output = model(input, outputs=['seg_output'])
+        self.assertTrue(torch.equal(output, input))
+        self.assertEqual(history, ['conv0', 'seg'])
+        # Outputs are returned in the requested order
+        del history[:]
+        model.select_outputs(['aux_output', 'seg_output'])
+        self.assertEqual(model.selected_outputs, ['aux_output', 'seg_output'])
+        self.assertEqual(len(model(input)), 2)
+        self.assertEqual(history, ['conv0', 'seg', 'aux'])
+        # Plans are cached per output set
+        model.select_outputs('aux_output')
+        plan = model.execution_plan
+        self.assertIs(model.get_execution_plan('aux_output'), plan)
+        self.assertIsNot(model.get_execution_plan('seg_output'), plan)
+        del history[:]
+        model(input)
+        self.assertEqual(history, ['conv0', 'aux'])
+        with self.assertRaises(ValueError):
+            model.select_outputs('conv0')
+        model.select_outputs(None)
+        self.assertEqual(model.selected_outputs, ['seg_output', 'aux_output'])
+
+    def test_graph_frees_intermediates(self):
+        import weakref
+        import torch.nn as nn
+        from inferno.extensions.containers.graph import Graph
+
+        references = {}
+
+        class AddOne(nn.Module):
+            def __init__(self, name):
+                super(AddOne, self).__init__()
+                self.name = name
+
+            def forward(self, input):
+                output = input + 1
+                references[self.name] = weakref.ref(output)
+                return output
+
+        class CheckFreed(AddOne):
+            def forward(self, input):
+                # The output of 'conv0' was only consumed by 'conv1'
+                references['conv0_alive'] = references['conv0']() is not None
+                return super(CheckFreed, self).forward(input)
+
+        model = Graph()
+        model.add_input_node('input_0')
+        model.add_node('conv0', AddOne('conv0'), 'input_0')
+        model.add_node('conv1', AddOne('conv1'), 'conv0')
+        model.add_node('conv2', CheckFreed('conv2'), 'conv1')
+        model.add_output_node('output_0', 'conv2')
+        output = model(torch.zeros(3))
+        self.assertTrue(torch.equal(output, torch.full((3,), 3.)))
+        self.assertFalse(references['conv0_alive'])
+
+    def test_graph_concurrent_branches(self):
+        import copy
+        import time
+        import torch.nn as nn
+        from inferno.extensions.containers.graph import Graph
+        from inferno.extensions.layers.reshape import Concatenate
+
+        class SlowLinear(nn.Linear):
+            def forward(self, input):
+                # Sleeping releases the GIL, like torch ops do
+                time.sleep(0.05)
+                return super(SlowLinear, self).forward(input)
+
+        model = Graph()
+        model.add_input_node('input')
+        for branch in range(4):
+            model.add_node('branch{}'.format(branch), SlowLinear(8, 8), 'input')
+        model.add_node('cat', Concatenate(dim=1),
+                       ['branch{}'.format(branch) for branch in range(4)])
+        model.add_output_node('output', 'cat')
+        self.assertEqual(model.execution_plan.width, 4)
+        input = torch.rand(2, 8)
+        expected = model(input)
+        self.assertIsNone(model.concurrency_stats)
+
+        model.set_concurrency()
+        output = model(input)
+        self.assertTrue(torch.equal(output, expected))
+        stats = model.concurrency_stats
+        self.assertEqual(stats['num_threads'], 4)
+        self.assertGreater(stats['max_concurrent_nodes'], 1)
+        self.assertGreater(stats['parallelism'], 1.5)
+        # Grad mode carries over to the threads
+        output.sum().backward()
+        self.assertIsNotNone(model.branch0.weight.grad)
+        with torch.no_grad():
+            self.assertFalse(model(input).requires_grad)
+        # And so does inference mode
+        with torch.inference_mode():
+            self.assertTrue(model(input).is_inference())
+        # Copies get their own thread pool
+        self.assertTrue(torch.equal(copy.deepcopy(model)(input), expected))
+        model.set_concurrency(0)
+        self.assertTrue(torch.equal(model(input), expected))
+        # The thread pool is shut down with the graph
+        model.set_concurrency()
+        model(input)
+        executor = model._executor
+        del model
+        import gc
+        gc.collect()
+        self.assertTrue(executor._shutdown)
+
     @unittest.skipUnless(torch.cuda.is_available(), "No cuda.")
     def test_graph_device_transfers(self):
         from inferno.extensions.containers.graph import Graph
@@ -0,0 +1,95 @@
+import unittest
+import json
+import os
+from shutil import rmtree
+
+import numpy as np
+import h5py
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class TestBlockwisePrediction(unittest.TestCase):
+    shape = (20, 24, 28)
+
+    def setUp(self):
+        try:
+            os.mkdir('./tmp')
+        except OSError:
+            pass
+        self.data = np.random.rand(*self.shape).astype('float32')
+        with h5py.File('./tmp/blockwise_input.h5', 'w') as f:
+            f.create_dataset('data', data=self.data, chunks=(8, 8, 8))
+        torch.manual_seed(42)
+        self.model = nn.Conv3d(1, 2, 3, padding=1)
+        # The prediction for the whole (reflect-padded) volume
+        padded = np.pad(self.data, 1, mode='reflect')
+        with torch.no_grad():
+            self.expected = F.conv3d(torch.from_numpy(padded)[None, None],
+                                     self.model.weight, self.model.bias)[0].numpy()
+
+    def tearDown(self):
+        try:
+            rmtree('./tmp')
+        except OSError:
+            pass
+
+    def _predict(self, **kwargs):
+        from inferno.io.volumetric import predict_blockwise
+        return predict_blockwise(self.model, './tmp/blockwise_input.h5', 'data',
+                                 './tmp/blockwise_output.h5', 'prediction',
+                                 halo=1, out_channels=2, **kwargs)
+
+    def _prediction(self):
+        with h5py.File('./tmp/blockwise_output.h5', 'r') as f:
+            return f['prediction'][:]
+
+    def test_blockwise_slices(self):
+        from inferno.io.volumetric.blockwise import blockwise_slices
+        blocks = blockwise_slices((10, 7), (4, 4))
+        self.assertEqual(len(blocks), 6)
+        self.assertEqual(blocks[-1], (slice(8, 10), slice(4, 7)))
+        covered = np.zeros((10, 7), dtype='int')
+        for block in blocks:
+            covered[block] += 1
+        self.assertTrue((covered == 1).all())
+
+    def test_in_process(self):
+        # Blocks default to the chunks of the input (8, 8, 8): 3 * 3 * 4 blocks
+        self.assertEqual(self._predict(num_workers=0), 36)
+        self.assertTrue(np.allclose(self._prediction(), self.expected, atol=1e-5))
+
+    def test_workers_and_resume(self):
+        self.assertEqual(self._predict(num_workers=2, block_shape=(8, 16, 16)), 12)
+        prediction = self._prediction()
+        self.assertTrue(np.allclose(prediction, self.expected, atol=1e-5))
+        # Nothing is left to do
+        self.assertEqual(self._predict(num_workers=2, block_shape=(8, 16, 16)), 0)
+        # Pretend the job was interrupted after the first 5 blocks
+        journal_path = './tmp/blockwise_output.h5.journal'
+        with open(journal_path, 'r') as f:
+            lines = f.readlines()
+        with open(journal_path, 'w') as f:
+            f.writelines(lines[:6])
+        with h5py.File('./tmp/blockwise_output.h5', 'a') as f:
+            f['prediction'][...] = 0
+        self.assertEqual(self._predict(num_workers=0, block_shape=(8, 16, 16)), 7)
+        prediction = self._prediction()
+        # Only the remaining blocks are predicted again
+        from inferno.io.volumetric.blockwise import blockwise_slices
+        done = {json.loads(line)['block'] for line in lines[1:6]}
+        for block_id, block in enumerate(blockwise_slices(self.shape, (8, 16, 16))):
+            block = (slice(None),) + block
+            if block_id in done:
+                self.assertTrue((prediction[block] == 0).all())
+            else:
+                self.assertTrue(np.allclose(prediction[block], self.expected[block],
+                                            atol=1e-5))
+        # The blocking can't change when resuming
+        with self.assertRaises(ValueError):
+            self._predict(num_workers=0, block_shape=(8, 8, 8))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import os
+from shutil import rmtree
+
+import numpy as np
+import h5py
+
+
+class TestChunkCache(unittest.TestCase):
+    shape = (40, 50, 60)
+
+    def setUp(self):
+        try:
+            os.mkdir('./tmp')
+        except OSError:
+            pass
+        self.data = np.random.rand(*self.shape).astype('float32')
+        with h5py.File('./tmp/chunked.h5', 'w') as f:
+            f.create_dataset('data', data=self.data, chunks=(10, 10, 10))
+
+    def tearDown(self):
+        try:
+            rmtree('./tmp')
+        except OSError:
+            pass
+
+    def test_cache(self):
+        from inferno.io.volumetric.chunk_cache import ChunkCache
+        with h5py.File('./tmp/chunked.h5', 'r') as f:
+            cache = ChunkCache(f['data'], max_size=10 ** 8)
+            self.assertEqual(cache.chunks, (10, 10, 10))
+            for slices in [np.s_[5:25, 0:10, 13:14], np.s_[:, :, :], np.s_[3:39:4, 1:2, 55:60],
+                           np.s_[30:40, 45:50, 0:0]]:
+                self.assertTrue(np.array_equal(cache[slices], self.data[slices]))
+            # The whole volume was read once, everything else came from the cache
+            self.assertEqual(cache.misses, 4 * 5 * 6)
+            self.assertEqual(cache.cache_info()['size'], self.data.nbytes)
+            # With room for 2 chunks only, chunks get evicted
+            cache = ChunkCache(f['data'], max_size=2 * 4000)
+            self.assertTrue(np.array_equal(cache[0:20, 0:10, 0:10], self.data[0:20, 0:10, 0:10]))
+            self.assertTrue(np.array_equal(cache[0:30, 0:10, 0:10], self.data[0:30, 0:10, 0:10]))
+            self.assertEqual(cache.cache_info()['num_chunks'], 2)
+            self.assertEqual((cache.hits, cache.misses, cache.evictions), (2, 3, 1))
+
+    def test_lazy_loader_with_cache(self):
+        from inferno.io.volumetric import LazyHDF5VolumeLoader
+        kwargs = dict(window_size=[20, 20, 20], stride=[10, 10, 10], padding=[[5, 5]] * 3,
+                      padding_mode='constant', return_index_spec=True)
+        loader = LazyHDF5VolumeLoader('./tmp/chunked.h5', 'data', **kwargs)
+        cached_loader = LazyHDF5VolumeLoader('./tmp/chunked.h5', 'data',
+                                             chunk_cache_size=10 ** 8, **kwargs)
+        self.assertIsNone(loader.chunk_cache)
+        for (batch, index), (cached_batch, _) in zip(loader, cached_loader):
+            self.assertTrue(np.array_equal(batch, cached_batch))
+        # With 50% overlap, most chunks are read from the cache
+        info = cached_loader.chunk_cache.cache_info()
+        self.assertEqual(info['misses'], 4 * 5 * 6)
+        self.assertGreater(info['hits'], 4 * info['misses'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -19,10 +19,11 @@ except ImportError:
 class TestLazyVolumeLoader(unittest.TestCase):
 
     def tearDown(self):
-        try:
-            os.remove('tmp.h5')
-        except OSError:
-            pass
+        for path in ('tmp.h5', 'tmp2.h5'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
 
     @unittest.skipUnless(WITH_H5PY, "Need h5py")
     def test_h5_loader(self):
@@ -112,6 +113,46 @@ class TestLazyVolumeLoader(unittest.TestCase):
             self.assertEqual(batch.shape, expected.shape)
             self.assertTrue(np.allclose(batch, expected))
 
+    @unittest.skipUnless(WITH_H5PY, "Need h5py")
+    def test_h5_loader_file_handles(self):
+        import pickle
+        import torch.multiprocessing as mp
+        from torch.utils.data import DataLoader
+        from inferno.io.volumetric.lazy_volume_loader import LazyHDF5VolumeLoader, \
+            file_handle_pool
+        shape = (40, 40)
+        data = np.arange(np.prod(shape)).reshape(shape)
+        for path in ('tmp.h5', 'tmp2.h5'):
+            with h5py.File(path, 'w') as f:
+                f.create_dataset('data', data=data)
+        loaders = [LazyHDF5VolumeLoader(path, 'data', window_size=[10, 10], stride=[10, 10])
+                   for path in ('tmp.h5', 'tmp2.h5')]
+        # At most one file is kept open
+        max_open_files = file_handle_pool.max_open_files
+        file_handle_pool.max_open_files = 1
+        try:
+            for index in range(len(loaders[0])):
+                for loader in loaders:
+                    self.assertTrue(np.array_equal(loader[index],
+                                                   data[loader.base_sequence[index]]))
+                    self.assertEqual(len(file_handle_pool), 1)
+        finally:
+            file_handle_pool.max_open_files = max_open_files
+        # The loaders pickle without their file handles
+        unpickled = pickle.loads(pickle.dumps(loaders[0]))
+        self.assertTrue(np.array_equal(unpickled[3], loaders[0][3]))
+        # Forked and spawned workers open the files again
+        for context in ('fork', 'spawn'):
+            if context not in mp.get_all_start_methods():
+                continue
+            batches = DataLoader(loaders[0], batch_size=4, num_workers=2,
+                                 multiprocessing_context=context)
+            self.assertTrue(np.array_equal(np.concatenate([batch.numpy() for batch in batches]),
+                                           np.stack([data[window]
+                                                     for window in loaders[0].base_sequence])))
+        file_handle_pool.close_all()
+        self.assertEqual(len(file_handle_pool), 0)
+
 
 if __name__ == '__main__':
     unittest.main()
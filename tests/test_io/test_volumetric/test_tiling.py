@@ -0,0 +1,163 @@
+import unittest
+import os
+from shutil import rmtree
+
+import numpy as np
+import h5py
+import torch
+import torch.nn as nn
+
+
+class Scale(nn.Module):
+    """Predicts two channels, the input and the input times two."""
+    def forward(self, input):
+        return torch.cat([input, 2 * input], dim=1)
+
+
+class TestTiling(unittest.TestCase):
+    shape = (20, 30, 30)
+    window_size = (8, 12, 12)
+    stride = (5, 7, 7)
+
+    def setUp(self):
+        self.data = np.random.rand(*self.shape).astype('float32')
+
+    def _loader(self, **kwargs):
+        from inferno.io.volumetric import VolumeLoader
+        from inferno.io.transform.generic import AsTorchBatch
+        return VolumeLoader(self.data, window_size=self.window_size, stride=self.stride,
+                            transforms=AsTorchBatch(3), **kwargs)
+
+    def test_blending_window(self):
+        from inferno.io.volumetric.tiling import blending_window
+        for mode in ['gaussian', 'linear', 'constant']:
+            weights = blending_window((5, 6), mode=mode)
+            self.assertEqual(weights.shape, (5, 6))
+            self.assertTrue((weights > 0).all())
+            self.assertAlmostEqual(float(weights.max()), 1.)
+            # Symmetric
+            self.assertTrue(np.allclose(weights, weights[::-1, ::-1]))
+        gaussian = blending_window((9,), mode='gaussian')
+        self.assertEqual(int(np.argmax(gaussian)), 4)
+        self.assertLess(gaussian[0], gaussian[2])
+
+    def test_identity_is_reconstructed(self):
+        from inferno.io.volumetric import predict_tiled
+        for blending in ['gaussian', 'linear', 'constant']:
+            for halo in [None, 1]:
+                prediction = predict_tiled(nn.Sequential(), self._loader(),
+                                           blending=blending, halo=halo, batch_size=3)
+                # AsTorchBatch adds a channel axis
+                self.assertEqual(prediction.shape, (1,) + self.shape)
+                self.assertTrue(np.allclose(prediction[0], self.data, atol=1e-5))
+
+    def test_padding_and_channels(self):
+        from inferno.io.volumetric import predict_tiled
+        loader = self._loader(padding=[[2, 3], [4, 4], [0, 1]], return_index_spec=True)
+        prediction = predict_tiled(Scale(), loader, halo=[1, 2, 2], batch_size=2)
+        self.assertEqual(prediction.shape, (2,) + self.shape)
+        self.assertTrue(np.allclose(prediction[0], self.data, atol=1e-5))
+        self.assertTrue(np.allclose(prediction[1], 2 * self.data, atol=1e-5))
+
+    def test_with_trainer(self):
+        from inferno.trainers.basic import Trainer
+        from inferno.io.volumetric import predict_tiled
+        prediction = predict_tiled(Trainer(Scale()), self._loader(), batch_size=4,
+                                   postprocess=lambda output: output[:, 1:])
+        self.assertEqual(prediction.shape, (1,) + self.shape)
+        self.assertTrue(np.allclose(prediction[0], 2 * self.data, atol=1e-5))
+
+    def test_blending_weights(self):
+        from inferno.io.volumetric import TiledPredictor
+        # Two windows overlapping in the middle, predicting 0 and 1
+        stitcher = TiledPredictor((10,), blending='linear')
+        stitcher.accumulate(np.zeros(6), (slice(0, 6),))
+        stitcher.accumulate(np.ones(6), (slice(4, 10),))
+        prediction = stitcher.finalize()
+        self.assertTrue((prediction[:4] == 0).all())
+        self.assertTrue((prediction[6:] == 1).all())
+        # Across the overlap, the prediction goes from the first to the second window
+        self.assertTrue(0 < prediction[4] < 0.5 < prediction[5] < 1)
+        # Voxels not covered by a window are zero
+        stitcher = TiledPredictor((10,))
+        stitcher.accumulate(np.ones(4), (slice(0, 4),))
+        self.assertTrue((stitcher.finalize()[4:] == 0).all())
+        self.assertEqual(stitcher.coverage.sum(), 4)
+
+    def test_normalization_in_blocks(self):
+        from inferno.io.volumetric import TiledPredictor
+        from inferno.io.volumetric.tiling import blending_window
+        loader = self._loader(padding=[[2, 3], [4, 4], [0, 1]])
+        predictions = [np.random.rand(*self.window_size).astype('float32')
+                       for _ in loader.base_sequence]
+        stitched = []
+        for block_size in [None, 30 * 30, 1]:
+            stitcher = TiledPredictor(self.shape, padding=loader.padding, halo=[1, 2, 2])
+            if block_size is not None:
+                # Blocks of one row, and blocks of one row despite the rows being larger
+                stitcher.BLOCK_SIZE = block_size
+            stitcher.accumulate_batch(predictions, loader.base_sequence)
+            self.assertEqual(stitcher.weights.shape, self.shape)
+            stitched.append(stitcher.finalize())
+        for other in stitched[1:]:
+            self.assertTrue(np.allclose(stitched[0], other))
+        # The weights are the sum of the blending windows
+        stitcher = TiledPredictor((10,), blending='linear')
+        stitcher.accumulate(np.ones(6), (slice(0, 6),))
+        stitcher.accumulate(np.ones(6), (slice(4, 10),))
+        weights = np.zeros(10, dtype='float32')
+        weights[:6] += blending_window((6,), mode='linear')
+        weights[4:] += blending_window((6,), mode='linear')
+        self.assertTrue(np.allclose(stitcher.weights, weights))
+
+    def test_blocks_visit_overlapping_windows(self):
+        from inferno.io.volumetric import TiledPredictor
+        stitcher = TiledPredictor((40, 4))
+        for start in reversed(range(0, 36, 2)):
+            stitcher.accumulate(np.ones((4, 4)), (slice(start, start + 4), slice(0, 4)))
+        stitcher.BLOCK_SIZE = 4 * 4
+        for block in stitcher._blocks():
+            windows = stitcher._windows_overlapping(block)
+            expected = [window for window in stitcher._windows
+                        if window[0][0].start < block[0].stop and
+                        window[0][0].stop > block[0].start]
+            self.assertEqual(windows, expected)
+        # All voxels but the last 2 rows are covered
+        self.assertEqual(stitcher.coverage.sum(), 38 * 4)
+        self.assertTrue(np.allclose(stitcher.finalize()[:38], 1))
+
+
+class TestLazyTiling(unittest.TestCase):
+    shape = (20, 30, 30)
+
+    def setUp(self):
+        try:
+            os.mkdir('./tmp')
+        except OSError:
+            pass
+        self.data = np.random.rand(*self.shape).astype('float32')
+        with h5py.File('./tmp/tiling.h5', 'w') as f:
+            f.create_dataset('data', data=self.data)
+
+    def tearDown(self):
+        try:
+            rmtree('./tmp')
+        except OSError:
+            pass
+
+    def test_lazy_loader(self):
+        from inferno.io.volumetric import LazyHDF5VolumeLoader, predict_tiled
+        from inferno.io.transform.generic import AsTorchBatch
+        data_slice = (slice(2, 18), slice(None), slice(5, 30))
+        loader = LazyHDF5VolumeLoader('./tmp/tiling.h5', 'data',
+                                      window_size=[8, 12, 12], stride=[4, 6, 6],
+                                      padding=[[2, 2], [3, 3], [1, 1]],
+                                      data_slice=data_slice,
+                                      transforms=AsTorchBatch(3))
+        prediction = predict_tiled(nn.Sequential(), loader, halo=1, batch_size=5)
+        self.assertEqual(prediction.shape, (1,) + self.data[data_slice].shape)
+        self.assertTrue(np.allclose(prediction[0], self.data[data_slice], atol=1e-5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -22,6 +22,61 @@ class TestVolumeLoader(unittest.TestCase):
             self.assertEqual(batch.shape, expected.shape)
             self.assertTrue(np.allclose(batch, expected))
 
+    def test_virtual_padding(self):
+        from inferno.io.volumetric import VolumeLoader
+        data = np.random.rand(7, 9)
+        channels = np.random.rand(3, 7, 9)
+        for mode in ('constant', 'edge', 'reflect', 'symmetric', 'wrap', 'mean'):
+            # Padding may be larger than the volume
+            for padding in ([[3, 12], [2, 2]], [1, 4]):
+                pad_width = [[pad, pad] if isinstance(pad, int) else pad for pad in padding]
+                for volume, is_multichannel in [(data, False), (channels, True)]:
+                    loader = VolumeLoader(volume, window_size=(4, 5), stride=(3, 2),
+                                          padding=padding, padding_mode=mode,
+                                          is_multichannel=is_multichannel)
+                    leading = (slice(None),) if is_multichannel else ()
+                    expected = np.pad(volume, [[0, 0]] * is_multichannel + pad_width,
+                                      mode=mode)
+                    self.assertEqual(loader.shape, expected.shape[-2:])
+                    for window, slices in zip(loader, loader.base_sequence):
+                        self.assertTrue(np.array_equal(window, expected[leading + slices]))
+        # The volume is not padded, and windows in the interior are views of it
+        loader = VolumeLoader(self.data, window_size=(10, 10, 10), stride=(10, 10, 10),
+                              padding=[5, 5, 5])
+        self.assertIs(loader.volume, self.data)
+        self.assertTrue(np.shares_memory(loader[1 + 11 + 11 * 11], self.data))
+        self.assertFalse(np.shares_memory(loader[0], self.data))
+
+    def test_sliding_windows(self):
+        from inferno.io.volumetric.volumetric_utils import SlidingWindows, \
+            slidingwindowslices
+        for shape, window_size, stride, ds in [((100, 100, 100), (10, 10, 10), (10, 10, 10), 1),
+                                               ((37, 50), (8, 11), (5, 7), [1, 2]),
+                                               ((20, 30), (20, 9), (4, 9), 1)]:
+            expected = list(slidingwindowslices(list(shape), window_size, stride,
+                                                shuffle=False, ds=ds))
+            windows = SlidingWindows(list(shape), window_size, stride, ds=ds)
+            self.assertEqual(len(windows), len(expected))
+            self.assertEqual(list(windows), expected)
+            self.assertEqual(windows[-1], expected[-1])
+            self.assertEqual(list(windows[1:17:2]), expected[1:17:2])
+            self.assertEqual(windows[2:][-2], expected[2:][-2])
+            with self.assertRaises(IndexError):
+                windows[len(expected)]
+
+    def test_sync_and_zip(self):
+        from inferno.io.volumetric import VolumeLoader
+        from inferno.io.core import Zip
+        raw = VolumeLoader(self.data, window_size=(10, 10, 10), stride=(5, 5, 5))
+        labels = VolumeLoader(self.data > 0.5, window_size=(10, 10, 10), stride=(10, 10, 10))
+        zipped = Zip(raw, labels, sync=True)
+        self.assertIs(labels.base_sequence, raw.base_sequence)
+        self.assertEqual(len(zipped), 19 ** 3)
+        raw_batch, label_batch = zipped[len(zipped) - 1]
+        self.assertTrue(np.array_equal(label_batch, raw_batch > 0.5))
+        self.assertEqual(zipped.base_sequence[-1],
+                         (raw.base_sequence[-1], labels.base_sequence[-1]))
+
 
 class TestHDF5VolumeLoader(unittest.TestCase):
     shape = (100, 100, 100)
@@ -52,6 +107,62 @@ class TestHDF5VolumeLoader(unittest.TestCase):
             self.assertTrue(np.allclose(batch, expected))
 
 
+class TestMemmapVolumeLoader(unittest.TestCase):
+    shape = (30, 40, 50)
+
+    def setUp(self):
+        try:
+            os.mkdir('./tmp')
+        except OSError:
+            pass
+        self.data = np.random.rand(*self.shape).astype('float32')
+
+    def tearDown(self):
+        try:
+            rmtree('./tmp')
+        except OSError:
+            pass
+
+    def _check_windows(self, loader, data):
+        for window, slices in zip(loader, loader.base_sequence):
+            self.assertTrue(np.array_equal(window, data[slices]))
+            # Windows are views of the memory map
+            self.assertTrue(np.shares_memory(window, loader.volume))
+
+    def test_npy_and_raw(self):
+        import pickle
+        from torch.utils.data import DataLoader
+        from inferno.io.volumetric import MemmapVolumeLoader
+        from inferno.utils.io_utils import tonpy
+        # Convert in blocks of 4 planes
+        tonpy(self.data, './tmp/data.npy', max_block_size=4 * 40 * 50 * 4)
+        tonpy(self.data, './tmp/data.raw')
+        npy_loader = MemmapVolumeLoader('./tmp/data.npy', window_size=(10, 20, 20),
+                                        stride=(10, 10, 10))
+        raw_loader = MemmapVolumeLoader('./tmp/data.raw', dtype='float32', shape=self.shape,
+                                        data_slice=':, 10:, :', window_size=(10, 20, 20),
+                                        stride=(10, 10, 10))
+        self.assertIsInstance(npy_loader.volume, np.memmap)
+        self._check_windows(npy_loader, self.data)
+        self._check_windows(raw_loader, self.data[:, 10:])
+        # Pickling maps the file again instead of copying the data
+        pickled = pickle.dumps(raw_loader)
+        self.assertLess(len(pickled), self.data.nbytes // 10)
+        self._check_windows(pickle.loads(pickled), self.data[:, 10:])
+        batches = DataLoader(npy_loader, batch_size=3, num_workers=2)
+        self.assertTrue(np.array_equal(np.concatenate([batch.numpy() for batch in batches]),
+                                       np.stack([self.data[slices]
+                                                 for slices in npy_loader.base_sequence])))
+        with self.assertRaises(ValueError):
+            MemmapVolumeLoader('./tmp/data.raw', window_size=(10, 20, 20), stride=(10, 10, 10))
+        # Padding is computed per window, the volume stays memory mapped
+        padded_loader = MemmapVolumeLoader('./tmp/data.npy', window_size=(10, 20, 20),
+                                           stride=(10, 10, 10), padding=[2, 2, 2])
+        self.assertIsInstance(padded_loader.volume, np.memmap)
+        expected = np.pad(self.data, 2, mode='reflect')
+        for window, slices in zip(padded_loader, padded_loader.base_sequence):
+            self.assertTrue(np.array_equal(window, expected[slices]))
+
 
 if __name__ == '__main__':
     unittest.main()
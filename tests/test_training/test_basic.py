@@ -2,7 +2,45 @@ from unittest import TestCase, skipUnless
 import torch
 from unittest import main
 import time
+import os
 from os.path import join, dirname
+from inferno.trainers.callbacks.base import Callback
+
+
+class RecordValidationRuns(Callback):
+    def __init__(self):
+        super(RecordValidationRuns, self).__init__()
+        self.validated_at = []
+
+    def end_of_validation_run(self, validated_at_iteration=None, **_):
+        self.validated_at.append(validated_at_iteration)
+
+
+class CheckReplicasInSync(Callback):
+    def __init__(self):
+        super(CheckReplicasInSync, self).__init__()
+        self.replicas_in_sync = None
+
+    def end_of_fit(self, **_):
+        import torch.distributed as dist
+        parameters = torch.cat([parameter.detach().flatten()
+                                for parameter in self.trainer.model.parameters()])
+        gathered = [torch.zeros_like(parameters) for _ in range(dist.get_world_size())]
+        dist.all_gather(gathered, parameters)
+        self.replicas_in_sync = all(torch.equal(parameters, other) for other in gathered)
+
+
+class SlowToPickle(object):
+    # Blocks pickling (but not deep-copying) until released
+    release = None
+    timed_out = None
+
+    def __deepcopy__(self, memo):
+        return SlowToPickle()
+
+    def __reduce__(self):
+        SlowToPickle.timed_out = not SlowToPickle.release.wait(timeout=5)
+        return SlowToPickle, ()
 
 
 class TestTrainer(TestCase):
@@ -106,6 +144,403 @@ class TestTrainer(TestCase):
 
         trainer.fit()
 
+    def test_prefetch(self):
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+
+        dataset = TensorDataset(torch.rand(20, 3, 32, 32), torch.randint(10, (20,)))
+        loader = DataLoader(dataset, batch_size=4)
+
+        def fit(prefetch_depth):
+            trainer = Trainer(self._make_test_model())\
+                .build_criterion('CrossEntropyLoss')\
+                .build_optimizer('Adam')\
+                .set_max_num_epochs(3)\
+                .bind_loader('train', loader)\
+                .prefetch(depth=prefetch_depth)
+            trainer.fit()
+            return trainer
+
+        trainer = fit(2)
+        reference_trainer = fit(0)
+        self.assertEqual(trainer.epoch_count, 3)
+        self.assertEqual(trainer.iteration_count, reference_trainer.iteration_count)
+
+    def test_phase_timings(self):
+        import json
+        from shutil import rmtree
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+        from inferno.trainers.callbacks.timing import PhaseTimingExporter
+
+        dataset = TensorDataset(torch.rand(20, 3, 32, 32), torch.randint(10, (20,)))
+        loader = DataLoader(dataset, batch_size=4)
+        export_directory = join(self.ROOT_DIR, 'phase_timings')
+        trainer = Trainer(self._make_test_model())\
+            .build_criterion('CrossEntropyLoss')\
+            .build_optimizer('Adam')\
+            .build_metric('CategoricalError')\
+            .set_max_num_epochs(2)\
+            .bind_loader('train', loader)\
+            .record_phase_timings(window_size=5)\
+            .register_callback(PhaseTimingExporter(join(export_directory, 'timings.jsonl'),
+                                                   frequency=2))\
+            .register_callback(PhaseTimingExporter(join(export_directory, 'timings.prom'),
+                                                   format='prometheus', frequency=2,
+                                                   labels={'run': 'test'}))
+        trainer.fit()
+        for phase in Trainer.PHASES:
+            self.assertGreater(trainer.get_state('{}_time'.format(phase)), 0)
+        iteration_time = trainer.get_state('iteration_time')
+        self.assertLessEqual(sum(trainer.get_state('{}_time'.format(phase))
+                                 for phase in Trainer.PHASES), iteration_time)
+        self.assertAlmostEqual(trainer.get_state('samples_per_second'), 4 / iteration_time)
+        self.assertGreater(trainer.get_state('data_wait_fraction'), 0)
+        self.assertLess(trainer.get_state('data_wait_fraction'), 1)
+        with open(join(export_directory, 'timings.jsonl')) as f:
+            records = [json.loads(line) for line in f]
+        # Exported every other iteration
+        self.assertGreater(len(records), 0)
+        self.assertTrue(all(record['iteration_count'] % 2 == 0 for record in records))
+        self.assertIn('forward_time', records[0])
+        with open(join(export_directory, 'timings.prom')) as f:
+            prometheus_text = f.read()
+        self.assertIn('inferno_phase_time_seconds{phase="backward",run="test"}',
+                      prometheus_text)
+        self.assertIn('inferno_iteration_count{{run="test"}} {!r}'
+                      .format(float(records[-1]['iteration_count'])), prometheus_text)
+        rmtree(export_directory)
+        # Without recording, there are no timings
+        trainer.record_phase_timings(False)
+        self.assertIsNone(trainer.phase_timer)
+
+    def test_predict(self):
+        import numpy as np
+        from shutil import rmtree
+        from torch.utils.data.dataset import TensorDataset
+        from inferno.trainers.basic import Trainer
+        from inferno.io.sinks import MemorySink, HDF5Sink, NpyMemmapSink
+
+        inputs = torch.rand(10, 3, 32, 32)
+        dataset = TensorDataset(inputs, torch.randint(10, (10,)))
+        model = self._make_test_model()
+        with torch.no_grad():
+            expected = model.eval()(inputs).softmax(1).numpy()
+        trainer = Trainer(model).train_mode()
+
+        # Stream
+        predictions = list(trainer.predict(dataset, num_inputs=1, batch_size=4,
+                                           postprocess=lambda output: output.softmax(1)))
+        self.assertEqual([len(prediction) for prediction in predictions], [4, 4, 2])
+        np.testing.assert_allclose(torch.cat(predictions).numpy(), expected, rtol=1e-5)
+        # The trainer is back to training, and gradients are not disabled
+        self.assertTrue(model.training)
+        self.assertTrue(torch.is_grad_enabled())
+
+        # Sinks
+        directory = join(self.ROOT_DIR, 'predictions')
+        os.makedirs(directory, exist_ok=True)
+        sinks = [MemorySink(),
+                 HDF5Sink(join(directory, 'predictions.h5')),
+                 NpyMemmapSink(join(directory, 'predictions.npy'))]
+        for sink in sinks:
+            with sink:
+                for _ in trainer.prefetch(2).predict(dataset, num_inputs=1, batch_size=4,
+                                                     postprocess=lambda output:
+                                                     output.softmax(1),
+                                                     sink=sink):
+                    pass
+        np.testing.assert_allclose(sinks[0].result, expected, rtol=1e-5)
+        import h5py
+        with h5py.File(join(directory, 'predictions.h5'), 'r') as f:
+            np.testing.assert_allclose(f['predictions'][:], expected, rtol=1e-5)
+        np.testing.assert_allclose(np.load(join(directory, 'predictions.npy'), mmap_mode='r'),
+                                   expected, rtol=1e-5)
+        # The number of samples is given by the sampler (and drop_last), not the dataset
+        from torch.utils.data import DataLoader, SequentialSampler, Subset
+        loader = DataLoader(dataset, batch_size=2, drop_last=True,
+                            sampler=SequentialSampler(Subset(dataset, range(7))))
+        with NpyMemmapSink(join(directory, 'subset.npy')) as sink:
+            for _ in trainer.predict(loader, num_inputs=1, sink=sink,
+                                     postprocess=lambda output: output.softmax(1)):
+                pass
+        np.testing.assert_allclose(np.load(join(directory, 'subset.npy'), mmap_mode='r'),
+                                   expected[:6], rtol=1e-5)
+        rmtree(directory)
+
+    def test_validate_in_background(self):
+        from shutil import rmtree
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+
+        save_directory = join(self.ROOT_DIR, 'background_validation_saves')
+        train_loader = DataLoader(TensorDataset(torch.rand(20, 3, 32, 32),
+                                                torch.randint(10, (20,))), batch_size=4)
+        validate_loader = DataLoader(TensorDataset(torch.rand(8, 3, 32, 32),
+                                                   torch.randint(10, (8,))), batch_size=4)
+        recorder = RecordValidationRuns()
+        trainer = Trainer(self._make_test_model())\
+            .build_criterion('CrossEntropyLoss')\
+            .build_optimizer('Adam')\
+            .bind_loader('train', train_loader)\
+            .bind_loader('validate', validate_loader)\
+            .validate_every((4, 'iterations'))\
+            .save_to_directory(save_directory)\
+            .save_at_best_validation_score()\
+            .set_max_num_iterations(12)\
+            .register_callback(recorder)\
+            .validate_in_background(num_threads=1)
+        trainer.fit()
+        trainer.close_background_evaluator()
+        # All snapshots were validated (in order), and the results recorded
+        self.assertEqual(recorder.validated_at, [4, 8, 12])
+        # The evaluator works on a copy of the model, and not on the weights being trained
+        self.assertFalse(any(parameter.is_shared() for parameter in trainer.model.parameters()))
+        self.assertIsNotNone(trainer.get_state('validation_loss_averaged'))
+        self.assertIsNotNone(trainer._best_validation_score)
+        self.assertTrue(os.path.exists(join(save_directory, 'best_checkpoint.pytorch')))
+        rmtree(save_directory)
+
+    def test_accumulate_gradients(self):
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+
+        dataset = TensorDataset(torch.rand(8, 4), torch.rand(8, 1))
+        net = torch.nn.Linear(4, 1)
+
+        def fit(batch_size, num_accumulated_batches):
+            model = torch.nn.Linear(4, 1)
+            model.load_state_dict(net.state_dict())
+            trainer = Trainer(model)\
+                .build_criterion('MSELoss')\
+                .build_optimizer('SGD', lr=0.1)\
+                .set_max_num_iterations(2)\
+                .bind_loader('train', DataLoader(dataset, batch_size=batch_size))\
+                .accumulate_gradients(num_accumulated_batches)
+            trainer.fit()
+            return trainer
+
+        trainer = fit(batch_size=2, num_accumulated_batches=2)
+        reference_trainer = fit(batch_size=4, num_accumulated_batches=1)
+        # Iterations count optimizer steps, not batches
+        self.assertEqual(trainer.iteration_count, 2)
+        for parameter, reference_parameter in zip(trainer.model.parameters(),
+                                                  reference_trainer.model.parameters()):
+            self.assertTrue(torch.allclose(parameter, reference_parameter, atol=1e-6))
+        self.assertAlmostEqual(trainer.get_state('training_loss').item(),
+                               reference_trainer.get_state('training_loss').item(), places=5)
+
+    def test_accumulate_gradients_end_of_epoch(self):
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+
+        # 3 batches of 2 per epoch, i.e. every other window is cut short by the end of the
+        # epoch. This makes for the same updates as batches of 4 and 2.
+        dataset = TensorDataset(torch.rand(6, 4), torch.rand(6, 1))
+        net = torch.nn.Linear(4, 1)
+
+        def fit(batch_size, num_accumulated_batches, prefetch_depth=0):
+            model = torch.nn.Linear(4, 1)
+            model.load_state_dict(net.state_dict())
+            trainer = Trainer(model)\
+                .build_criterion('MSELoss')\
+                .build_optimizer('SGD', lr=0.1)\
+                .set_max_num_iterations(4)\
+                .bind_loader('train', DataLoader(dataset, batch_size=batch_size))\
+                .accumulate_gradients(num_accumulated_batches)\
+                .prefetch(prefetch_depth)
+            trainer.fit()
+            return trainer
+
+        reference_trainer = fit(batch_size=4, num_accumulated_batches=1)
+        for prefetch_depth in [0, 2]:
+            trainer = fit(batch_size=2, num_accumulated_batches=2,
+                          prefetch_depth=prefetch_depth)
+            self.assertEqual(trainer.iteration_count, 4)
+            self.assertEqual(trainer.epoch_count, reference_trainer.epoch_count)
+            for parameter, reference_parameter in zip(trainer.model.parameters(),
+                                                      reference_trainer.model.parameters()):
+                self.assertTrue(torch.allclose(parameter, reference_parameter, atol=1e-6))
+            self.assertAlmostEqual(trainer.get_state('training_loss').item(),
+                                   reference_trainer.get_state('training_loss').item(),
+                                   places=5)
+
+    def test_distributed(self):
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+
+        dataset = TensorDataset(torch.rand(16, 4), torch.rand(16, 1))
+        net = torch.nn.Linear(4, 1)
+
+        def fit(batch_size, num_processes=None):
+            model = torch.nn.Linear(4, 1)
+            model.load_state_dict(net.state_dict())
+            trainer = Trainer(model)\
+                .build_criterion('MSELoss')\
+                .build_optimizer('SGD', lr=0.1)\
+                .set_max_num_iterations(3)\
+                .bind_loader('train', DataLoader(dataset, batch_size=batch_size))\
+                .bind_loader('validate', DataLoader(dataset, batch_size=batch_size))\
+                .validate_every((3, 'iterations'))
+            if num_processes is not None:
+                trainer.distributed(num_processes=num_processes, num_threads=1)
+            trainer.fit()
+            return trainer
+
+        # Two processes with batches of 2 each average their gradients, which makes for
+        # batches of 4
+        trainer = fit(batch_size=2, num_processes=2)
+        reference_trainer = fit(batch_size=4)
+        self.assertEqual(trainer.iteration_count, 3)
+        self.assertIsNone(trainer.distributed_model)
+        for parameter, reference_parameter in zip(trainer.model.parameters(),
+                                                  reference_trainer.model.parameters()):
+            self.assertTrue(torch.allclose(parameter, reference_parameter, atol=1e-6))
+        # Validation results are averaged over both processes (i.e. the entire dataset)
+        self.assertAlmostEqual(trainer.get_state('validation_loss_averaged'),
+                               reference_trainer.get_state('validation_loss_averaged'),
+                               places=5)
+
+    def test_distributed_gradient_callback(self):
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+        from inferno.trainers.callbacks.essentials import GradientClip
+
+        dataset = TensorDataset(torch.rand(16, 4), torch.rand(16, 1))
+        net = torch.nn.Linear(4, 1)
+
+        def fit(batch_size, num_processes=None):
+            model = torch.nn.Linear(4, 1)
+            model.load_state_dict(net.state_dict())
+            trainer = Trainer(model)\
+                .build_criterion('MSELoss')\
+                .build_optimizer('SGD', lr=0.1)\
+                .set_max_num_iterations(3)\
+                .bind_loader('train', DataLoader(dataset, batch_size=batch_size))\
+                .register_callback(GradientClip(clip_norm=1e-3))
+            if num_processes is not None:
+                trainer.distributed(num_processes=num_processes, num_threads=1)
+                trainer.register_callback(CheckReplicasInSync())
+            trainer.fit()
+            return trainer
+
+        # The gradients are clipped at every rank, so the replicas don't drift apart
+        trainer = fit(batch_size=2, num_processes=2)
+        reference_trainer = fit(batch_size=4)
+        check, = [callback for callback in
+                  trainer.callbacks._callback_registry[trainer.callbacks.END_OF_FIT]
+                  if isinstance(callback, CheckReplicasInSync)]
+        self.assertTrue(check.replicas_in_sync)
+        for parameter, reference_parameter in zip(trainer.model.parameters(),
+                                                  reference_trainer.model.parameters()):
+            self.assertTrue(torch.allclose(parameter, reference_parameter, atol=1e-6))
+
+    def test_compile(self):
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+
+        dataset = TensorDataset(torch.rand(8, 3, 32, 32), torch.randint(10, (8,)))
+
+        def failing_backend(graph_module, example_inputs):
+            raise RuntimeError("Nope.")
+
+        for compile_kwargs in [{'backend': 'eager'},
+                               {'backend': failing_backend},
+                               {'method': 'script'}]:
+            model = self._make_test_model()
+            initial_weight = model[0].weight.detach().clone()
+            trainer = Trainer(model)\
+                .build_criterion('CrossEntropyLoss')\
+                .build_optimizer('Adam')\
+                .set_max_num_iterations(2)\
+                .bind_loader('train', DataLoader(dataset, batch_size=4))\
+                .compile(**compile_kwargs)
+            trainer.fit()
+            # The compiled model trains the model's parameters
+            self.assertIsNot(trainer.compiled_model, trainer.model)
+            self.assertFalse(torch.equal(trainer.model[0].weight, initial_weight))
+            # Checkpoints contain the uncompiled model
+            self.assertIsNone(trainer.get_config()['_compiled_model'])
+            self.assertIs(trainer.get_config()['_model'], model)
+
+    def test_mixed_precision(self):
+        import pickle
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+
+        dataset = TensorDataset(torch.rand(8, 3, 32, 32), torch.randint(10, (8,)))
+        loader = DataLoader(dataset, batch_size=4)
+
+        for precision, autocast_dtype in [('mixed', torch.bfloat16), ('half', torch.float16)]:
+            trainer = Trainer(self._make_test_model())\
+                .build_criterion('CrossEntropyLoss')\
+                .build_optimizer('Adam')\
+                .build_metric('CategoricalError')\
+                .set_max_num_iterations(4)\
+                .bind_loader('train', loader)\
+                .set_precision(precision)
+            self.assertEqual(trainer.autocast_dtype, autocast_dtype)
+            trainer.fit()
+            # Parameters remain in full precision, and so do predictions (for losses
+            # and metrics)
+            for parameter in trainer.model.parameters():
+                self.assertEqual(parameter.dtype, torch.float32)
+            self.assertEqual(trainer.get_state('training_prediction').dtype, torch.float32)
+            if autocast_dtype is torch.float16:
+                # The loss scaler should be checkpointed with the trainer
+                self.assertIsNotNone(trainer.grad_scaler)
+                config = pickle.loads(pickle.dumps(trainer.get_config()))
+                loaded_trainer = Trainer().set_config(config)
+                self.assertEqual(loaded_trainer.grad_scaler.get_scale(),
+                                 trainer.grad_scaler.get_scale())
+            else:
+                self.assertIsNone(trainer.grad_scaler)
+
+    def test_lazy_state(self):
+        from torch.utils.data.dataset import TensorDataset
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+        from inferno.utils.torch_utils import DeferredUnwrap
+
+        dataset = TensorDataset(torch.rand(8, 3, 32, 32), torch.randint(10, (8,)))
+        loader = DataLoader(dataset, batch_size=4)
+        trainer = Trainer(self._make_test_model())\
+            .build_criterion('CrossEntropyLoss')\
+            .build_optimizer('Adam')\
+            .set_max_num_iterations(2)\
+            .bind_loader('train', loader)
+        trainer.fit()
+        # States are unwrapped only when read
+        self.assertIsInstance(trainer._state['training_prediction'], DeferredUnwrap)
+        prediction = trainer.get_state('training_prediction')
+        self.assertTrue(torch.is_tensor(prediction))
+        self.assertFalse(prediction.requires_grad)
+        self.assertEqual(tuple(prediction.shape), (4, 10))
+        # States that are not scalars are dropped at the start of the next iteration if
+        # they haven't been read by then, but the scalars are kept
+        trainer._release_deferred_states()
+        self.assertIsNotNone(trainer.get_state('training_prediction'))
+        self.assertIsNotNone(trainer.get_state('training_loss'))
+        trainer.fit(max_num_iterations=3)
+        trainer._release_deferred_states()
+        self.assertIsNone(trainer.get_state('training_prediction'))
+        self.assertIsNone(trainer.get_state('training_inputs'))
+        self.assertIsNotNone(trainer.get_state('training_loss'))
+        # Only the declared states are retained
+        trainer.retain_states(['training_loss']).fit(max_num_iterations=4)
+        self.assertIsNone(trainer.get_state('training_prediction'))
+        self.assertIsNone(trainer.get_state('training_inputs'))
+        self.assertIsNotNone(trainer.get_state('training_loss'))
+
     def test_serialization(self):
         from inferno.trainers.basic import Trainer
         import os
@@ -165,6 +600,104 @@ class TestTrainer(TestCase):
         # Instantiate new trainer and load
         trainer = Trainer().load(from_directory=self.ROOT_DIR, filename='dummy.pytorch')
 
+    def test_save_asynchronously(self):
+        import os
+        from shutil import rmtree
+        from inferno.trainers.basic import Trainer
+        save_directory = join(self.ROOT_DIR, 'async_saves')
+        trainer = Trainer(self._make_test_model())\
+            .build_optimizer('Adam')\
+            .save_to_directory(save_directory)\
+            .save_asynchronously(max_pending_saves=1)
+        trainer._is_iteration_with_best_validation_score = True
+        trainer.save()
+        trainer.save()
+        trainer.wait_for_pending_saves()
+        checkpoint_path = join(save_directory, 'checkpoint.pytorch')
+        best_checkpoint_path = join(save_directory, 'best_checkpoint.pytorch')
+        self.assertGreater(os.path.getsize(checkpoint_path), 0)
+        # The best checkpoint was stashed at the first save, and the second save replaced
+        # (and didn't overwrite) the checkpoint
+        self.assertTrue(os.path.exists(best_checkpoint_path))
+        self.assertNotEqual(os.stat(checkpoint_path).st_ino,
+                            os.stat(best_checkpoint_path).st_ino)
+        # No temporary files are left behind
+        self.assertEqual(sorted(os.listdir(save_directory)),
+                         ['best_checkpoint.pytorch', 'checkpoint.pytorch'])
+        rmtree(save_directory)
+
+    def test_save_asynchronously_snapshot(self):
+        import threading
+        from shutil import rmtree
+        from inferno.trainers.basic import Trainer
+        save_directory = join(self.ROOT_DIR, 'async_snapshot_saves')
+        model = self._make_test_model()
+        model.slow_to_pickle = SlowToPickle()
+        trainer = Trainer(model)\
+            .build_optimizer('Adam')\
+            .save_to_directory(save_directory)\
+            .save_asynchronously()
+        SlowToPickle.release = threading.Event()
+        weights = [parameter.detach().clone() for parameter in model.parameters()]
+        trainer.save()
+        # The training thread is back before the checkpoint is serialized, and may
+        # modify the model without affecting the checkpoint
+        with torch.no_grad():
+            for parameter in model.parameters():
+                parameter.add_(1.)
+        SlowToPickle.release.set()
+        trainer.wait_for_pending_saves()
+        self.assertFalse(SlowToPickle.timed_out)
+        loaded_trainer = Trainer().load(from_directory=save_directory)
+        for parameter, weight in zip(loaded_trainer.model.parameters(), weights):
+            self.assertTrue(torch.equal(parameter, weight))
+        # The optimizer of the checkpoint optimizes the parameters of its model
+        self.assertEqual({id(parameter) for parameter in loaded_trainer.model.parameters()},
+                         {id(parameter)
+                          for group in loaded_trainer.optimizer.param_groups
+                          for parameter in group['params']})
+        rmtree(save_directory)
+
+    def test_structured_checkpoint(self):
+        from shutil import rmtree
+        from inferno.trainers.basic import Trainer
+        from inferno.utils import checkpoint_utils as cu
+        save_directory = join(self.ROOT_DIR, 'structured_saves')
+        trainer = Trainer(self._make_test_model())\
+            .build_optimizer('Adam')\
+            .build_criterion('CrossEntropyLoss')\
+            .save_every(1, to_directory=save_directory, checkpoint_format='structured')
+        # Take a step to populate the optimizer state
+        trainer.apply_model_and_loss([torch.rand(2, 3, 32, 32)], torch.LongTensor([1, 2]),
+                                     mode='train')
+        trainer.optimizer.step()
+        trainer.update_state('training_inputs', torch.rand(2, 3, 32, 32), lazy=True)
+        trainer.save().save_model()
+        checkpoint_path = join(save_directory, 'checkpoint.pytorch')
+        self.assertTrue(cu.is_structured(checkpoint_path))
+        header, _ = cu.read_header(checkpoint_path)
+        num_parameters = len(list(trainer.model.parameters()))
+        self.assertGreaterEqual(len(header['tensors']), num_parameters)
+        # Load (memory-mapped) and compare
+        loaded = Trainer().load(from_directory=save_directory)
+        self.assertEqual(loaded.checkpoint_format, 'structured')
+        for expected, got in zip(trainer.model.parameters(), loaded.model.parameters()):
+            self.assertIsInstance(got, torch.nn.Parameter)
+            self.assertTrue(torch.equal(expected, got))
+        self.assertEqual(len(loaded.optimizer.state), num_parameters)
+        # The optimizer still refers to the model's parameters
+        self.assertIs(next(iter(loaded.optimizer.param_groups[0]['params'])),
+                      next(loaded.model.parameters()))
+        # Transient states are not checkpointed
+        self.assertIsNone(loaded.get_state('training_inputs'))
+        # Weights can be modified in place without touching the checkpoint
+        with torch.no_grad():
+            next(loaded.model.parameters()).zero_()
+        reloaded = Trainer().load_model(from_directory=save_directory)
+        for expected, got in zip(trainer.model.parameters(), reloaded.model.parameters()):
+            self.assertTrue(torch.equal(expected, got))
+        rmtree(save_directory)
+
     @skipUnless(torch.cuda.device_count() >= 2, "Not enough cuda devices for test_multi_gpu_setup.")
     def test_multi_gpu_setup(self):
         from torch.nn import CrossEntropyLoss
@@ -52,6 +52,85 @@ class CallbackMechTest(unittest.TestCase):
         with self.assertRaises(AssertionError):
             callback_engine.register_callback(WrongDummyCallback())
 
+    def test_priority(self):
+        calls = []
+
+        class Recorder(Callback):
+            def __init__(self, name):
+                super(Recorder, self).__init__()
+                self.name = name
+
+            def end_of_training_iteration(self, **_):
+                calls.append(self.name)
+
+        callback_engine = CallbackEngine().bind_trainer(Trainer())
+        callback_engine.register_callback(Recorder('first'))
+        callback_engine.register_callback(Recorder('second'))
+        callback_engine.register_callback(Recorder('urgent'), priority=10)
+        callback_engine.register_callback(Recorder('last'), priority=-1)
+        callback_engine.call(callback_engine.END_OF_TRAINING_ITERATION)
+        self.assertEqual(calls, ['urgent', 'first', 'second', 'last'])
+        # Triggers without callbacks are fine, but unknown triggers aren't
+        callback_engine.call(callback_engine.BEGIN_OF_FIT)
+        with self.assertRaises(AssertionError):
+            callback_engine.call('end_of_iteration')
+
+    def test_timings(self):
+        callback_engine = CallbackEngine().bind_trainer(Trainer()).record_timings()
+        callback_engine.register_callback(DummyCallback())
+        for _ in range(3):
+            callback_engine.call(callback_engine.END_OF_TRAINING_ITERATION)
+        callback_timings = callback_engine.get_timings(per='callback')
+        trigger_timings = callback_engine.get_timings(per='trigger')
+        self.assertIn('end_of_training_iteration', callback_timings['DummyCallback'])
+        self.assertGreaterEqual(trigger_timings['end_of_training_iteration'], 0.)
+        # Callbacks of the same class are timed separately
+        other_callback = DummyCallback()
+        callback_engine.register_callback(other_callback)
+        callback_engine.call(callback_engine.END_OF_TRAINING_ITERATION)
+        self.assertEqual(callback_engine.get_callback_name(other_callback), 'DummyCallback#2')
+        self.assertEqual(sorted(callback_engine.get_timings(per='callback')),
+                         ['DummyCallback', 'DummyCallback#2'])
+        callback_engine.record_timings(False)
+        with self.assertRaises(RuntimeError):
+            callback_engine.get_timings()
+
+    def test_missing_trigger_method(self):
+        class EndOfEpochCallback(Callback):
+            def __init__(self):
+                super(EndOfEpochCallback, self).__init__()
+                self.num_calls = 0
+
+            def end_of_epoch(self, **_):
+                self.num_calls += 1
+
+        callback_engine = CallbackEngine().bind_trainer(Trainer())
+        callback = EndOfEpochCallback()
+        # Registered at a trigger it has no method for
+        callback_engine.register_callback(callback, trigger=callback_engine.END_OF_FIT)
+        callback_engine.register_callback(callback, trigger=callback_engine.END_OF_EPOCH)
+        self.assertEqual(callback_engine._dispatch_table[callback_engine.END_OF_FIT], ())
+        callback_engine.call(callback_engine.END_OF_FIT)
+        callback_engine.call(callback_engine.END_OF_EPOCH)
+        self.assertEqual(callback.num_calls, 1)
+
+    def test_rank_zero_only(self):
+        class LoggingCallback(DummyCallback):
+            RANK_ZERO_ONLY = True
+
+        callback_engine = CallbackEngine().bind_trainer(Trainer())
+        callback, logging_callback = DummyCallback(), LoggingCallback()
+        callback_engine.register_callback(callback)
+        callback_engine.register_callback(logging_callback)
+        callback_engine.skip_rank_zero_only_callbacks()
+        dispatched = [dispatched_callback for dispatched_callback, _ in
+                      callback_engine._dispatch_table[callback_engine.END_OF_TRAINING_ITERATION]]
+        self.assertEqual(dispatched, [callback])
+        callback_engine.skip_rank_zero_only_callbacks(False)
+        dispatched = [dispatched_callback for dispatched_callback, _ in
+                      callback_engine._dispatch_table[callback_engine.END_OF_TRAINING_ITERATION]]
+        self.assertEqual(dispatched, [callback, logging_callback])
+
     def test_instance_registry(self):
         class Foo(Callback):
             pass
@@ -0,0 +1,62 @@
+import unittest
+import torch
+
+
+class TestDistributed(unittest.TestCase):
+    def _dataset(self, num_samples):
+        from torch.utils.data.dataset import TensorDataset
+        return TensorDataset(torch.arange(num_samples).float().view(-1, 1),
+                             torch.zeros(num_samples, 1))
+
+    def test_shard_loader_settings(self):
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.distributed import shard_loader
+
+        generator = torch.Generator()
+        loader = DataLoader(self._dataset(8), batch_size=2, shuffle=True, num_workers=1,
+                            generator=generator, prefetch_factor=3, persistent_workers=True,
+                            multiprocessing_context='spawn')
+        sharded = shard_loader(loader, num_replicas=2, rank=1)
+        self.assertIs(sharded.generator, generator)
+        self.assertEqual(sharded.prefetch_factor, 3)
+        self.assertTrue(sharded.persistent_workers)
+        self.assertIs(sharded.multiprocessing_context, loader.multiprocessing_context)
+        self.assertTrue(sharded.sampler.shuffle)
+
+    def test_unpadded_shards(self):
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.distributed import shard_loader
+
+        loader = DataLoader(self._dataset(5), batch_size=2)
+        shards = [shard_loader(loader, num_replicas=2, rank=rank, pad=False)
+                  for rank in range(2)]
+        self.assertEqual([len(shard.sampler) for shard in shards], [3, 2])
+        samples = [int(sample) for shard in shards
+                   for inputs, _ in shard for sample in inputs.flatten()]
+        self.assertEqual(sorted(samples), list(range(5)))
+        # Padded shards repeat a sample
+        padded_shards = [shard_loader(loader, num_replicas=2, rank=rank)
+                         for rank in range(2)]
+        self.assertEqual([len(shard.sampler) for shard in padded_shards], [3, 3])
+
+    def test_shuffling_across_epochs(self):
+        from torch.utils.data.dataloader import DataLoader
+        from inferno.trainers.basic import Trainer
+        from inferno.trainers.distributed import shard_loader
+
+        loader = DataLoader(self._dataset(32), batch_size=16, shuffle=True)
+        for prefetch_depth in [0, 2]:
+            trainer = Trainer(torch.nn.Linear(1, 1))\
+                .bind_loader('train', shard_loader(loader, num_replicas=2, rank=0))\
+                .prefetch(prefetch_depth)
+            fetch = trainer.fetch_next_prefetched_batch if prefetch_depth > 0 \
+                else trainer.fetch_next_batch
+            # One batch per epoch
+            orders = [fetch('train')[0].flatten().tolist() for _ in range(3)]
+            self.assertEqual(trainer.epoch_count, 2)
+            self.assertNotEqual(orders[0], orders[1])
+            self.assertNotEqual(orders[1], orders[2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import io
+import os
+import tempfile
+import unittest
+
+import torch
+from inferno.utils import checkpoint_utils as cu
+
+
+class StructuredCheckpointTest(unittest.TestCase):
+    def _save_and_load(self, object_, **load_kwargs):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            cu.save_structured(object_, f)
+        try:
+            return cu.load(f.name, **load_kwargs)
+        finally:
+            os.remove(f.name)
+
+    def test_round_trip(self):
+        shared = torch.rand(3, 4)
+        object_ = {'float': shared,
+                   'same_float': shared,
+                   'transposed': torch.rand(4, 5).t(),
+                   'bfloat16': torch.rand(7).to(torch.bfloat16),
+                   'bool': torch.rand(2, 2) > 0.5,
+                   'scalar': torch.tensor(3),
+                   'empty': torch.zeros(0, 3),
+                   'parameter': torch.nn.Parameter(torch.rand(2)),
+                   'not_a_tensor': [1, 'two', 3.]}
+        for mmap in [True, False]:
+            loaded = self._save_and_load(object_, mmap=mmap)
+            for key, value in object_.items():
+                if torch.is_tensor(value):
+                    self.assertEqual(loaded[key].dtype, value.dtype)
+                    self.assertTrue(torch.equal(loaded[key], value))
+                else:
+                    self.assertEqual(loaded[key], value)
+            self.assertIs(loaded['float'], loaded['same_float'])
+            self.assertIsInstance(loaded['parameter'], torch.nn.Parameter)
+            self.assertTrue(loaded['parameter'].requires_grad)
+
+    def test_alignment(self):
+        buffer = io.BytesIO()
+        cu.save_structured([torch.rand(3), torch.rand(5)], buffer, alignment=128)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(buffer.getvalue())
+        try:
+            header, data_start = cu.read_header(f.name)
+        finally:
+            os.remove(f.name)
+        self.assertEqual(data_start % 128, 0)
+        for entry in header['storages'].values():
+            self.assertEqual(entry['offset'] % 128, 0)
+
+    def test_tied_weights(self):
+        model = torch.nn.Sequential(torch.nn.Embedding(10, 4), torch.nn.Linear(4, 10))
+        # Tie the weights with a different parameter object (and a view) on the same storage
+        model[1].weight = torch.nn.Parameter(model[0].weight.data[:])
+        object_ = {'state_dict': model.state_dict(),
+                   'view': model[0].weight.data[2:, 1:]}
+        buffer = io.BytesIO()
+        cu.save_structured(object_, buffer)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(buffer.getvalue())
+        try:
+            header, _ = cu.read_header(f.name)
+            self.assertEqual(len(header['tensors']), 4)
+            self.assertEqual(len(header['storages']), 2)
+            for mmap in [True, False]:
+                loaded = cu.load(f.name, mmap=mmap)
+                embedding = loaded['state_dict']['0.weight']
+                linear = loaded['state_dict']['1.weight']
+                self.assertTrue(torch.equal(linear, model[1].weight.data))
+                self.assertTrue(torch.equal(loaded['view'], object_['view']))
+                self.assertEqual(embedding.untyped_storage().data_ptr(),
+                                 linear.untyped_storage().data_ptr())
+                embedding.add_(1)
+                self.assertTrue(torch.equal(embedding, linear))
+                self.assertTrue(torch.equal(loaded['view'], embedding[2:, 1:]))
+        finally:
+            os.remove(f.name)
+
+    def test_snapshot_tied_weights(self):
+        weight = torch.rand(3, 4)
+        storages = {}
+        snapshots = [cu.snapshot(weight, storages), cu.snapshot(weight.t(), storages)]
+        self.assertEqual(len(storages), 1)
+        self.assertTrue(torch.equal(snapshots[1], weight.t()))
+        self.assertEqual(snapshots[0].untyped_storage().data_ptr(),
+                         snapshots[1].untyped_storage().data_ptr())
+        weight.add_(1)
+        self.assertFalse(torch.equal(snapshots[0], weight))
+
+    def test_saved_devices(self):
+        tensor = torch.rand(3)
+        devices = {tensor.untyped_storage().data_ptr(): 'cuda:1'}
+        object_ = {'tensor': tensor, 'other': torch.rand(2)}
+        # Pickled checkpoints tag the storages with the device
+        buffer = io.BytesIO()
+        cu.torch_save(object_, buffer, devices=devices)
+        buffer.seek(0)
+        locations = []
+
+        def map_location(storage, location):
+            locations.append(location)
+            return storage
+        loaded = cu.torch_load(buffer, map_location=map_location)
+        self.assertEqual(sorted(locations), ['cpu', 'cuda:1'])
+        self.assertTrue(torch.equal(loaded['tensor'], tensor))
+        # Structured checkpoints list it in the index
+        buffer = io.BytesIO()
+        cu.save_structured(object_, buffer, devices=devices)
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(buffer.getvalue())
+        try:
+            header, _ = cu.read_header(f.name)
+            self.assertEqual(sorted(entry['device'] for entry in header['storages'].values()),
+                             ['cpu', 'cuda:1'])
+            loaded = cu.load(f.name, map_location={'cuda:1': 'cpu'})
+            self.assertTrue(torch.equal(loaded['tensor'], tensor))
+        finally:
+            os.remove(f.name)
+        # Without, nothing changes
+        buffer = io.BytesIO()
+        torch.save(object_, buffer)
+        buffer.seek(0)
+        locations = []
+        cu.torch_load(buffer, map_location=map_location)
+        self.assertEqual(locations, ['cpu', 'cpu'])
+
+    def test_pickled_checkpoint(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            torch.save({'tensor': torch.ones(3)}, f)
+        try:
+            self.assertFalse(cu.is_structured(f.name))
+            self.assertTrue(torch.equal(cu.load(f.name)['tensor'], torch.ones(3)))
+        finally:
+            os.remove(f.name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 import inferno.utils.train_utils as tu
 import numpy as np
+import torch
 
 
 class FrequencyTest(unittest.TestCase):
@@ -43,5 +44,79 @@ class FrequencyTest(unittest.TestCase):
             duration.match(epoch_count=2)
 
 
+class TensorAverageMeterTest(unittest.TestCase):
+    def test_average(self):
+        import torch
+        meter = tu.TensorAverageMeter()
+        self.assertEqual(meter.avg, 0)
+        meter.update(torch.tensor(1.).half(), n=2)
+        meter.update(torch.tensor(4.), n=1)
+        meter.update(1., n=1)
+        # The sum is kept as a (single precision) tensor, until it's read
+        self.assertTrue(torch.is_tensor(meter._sum))
+        self.assertEqual(meter._sum.dtype, torch.float32)
+        self.assertEqual(meter.count, 4)
+        self.assertEqual(meter.val, 1.)
+        self.assertEqual(meter.sum, 7.)
+        self.assertAlmostEqual(meter.avg, 7. / 4)
+        meter.reset()
+        self.assertEqual(meter.count, 0)
+        self.assertEqual(meter.sum, 0)
+
+
+class BatchPrefetcherTest(unittest.TestCase):
+    def test_passes(self):
+        prefetcher = tu.BatchPrefetcher(list(range(5)), depth=2, transform=lambda x: 2 * x)
+        self.assertEqual(len(prefetcher), 5)
+        self.assertEqual(list(prefetcher), [0, 2, 4, 6, 8])
+        # The next pass should pick up where the last one left off
+        self.assertEqual(list(prefetcher), [0, 2, 4, 6, 8])
+        prefetcher.close()
+
+    def test_single_pass(self):
+        prefetcher = tu.BatchPrefetcher(list(range(5)), depth=2, num_passes=1)
+        self.assertEqual(list(prefetcher), [0, 1, 2, 3, 4])
+        # The worker is done, and so is the prefetcher
+        prefetcher._thread.join(timeout=5)
+        self.assertFalse(prefetcher._thread.is_alive())
+        self.assertEqual(list(prefetcher), [])
+        prefetcher.close()
+
+    def test_num_samples_in(self):
+        from torch.utils.data import DataLoader, SubsetRandomSampler
+        dataset = list(range(10))
+        self.assertEqual(tu.num_samples_in(DataLoader(dataset, batch_size=4)), 10)
+        self.assertEqual(tu.num_samples_in(DataLoader(dataset, batch_size=4,
+                                                      drop_last=True)), 8)
+        sampler = SubsetRandomSampler(list(range(7)))
+        self.assertEqual(tu.num_samples_in(DataLoader(dataset, batch_size=4,
+                                                      sampler=sampler)), 7)
+        self.assertIsNone(tu.num_samples_in(DataLoader(dataset,
+                                                       batch_sampler=[[0, 1], [2]])))
+
+    @unittest.skipUnless(torch.cuda.is_available(), "Need CUDA.")
+    def test_stream(self):
+        stream = torch.cuda.Stream()
+        batches = [torch.rand(3).pin_memory() for _ in range(5)]
+        prefetcher = tu.BatchPrefetcher(batches, depth=2, stream=stream,
+                                        transform=lambda x: x.cuda(non_blocking=True) * 2)
+        for batch, staged in zip(batches, prefetcher):
+            self.assertTrue(staged.is_cuda)
+            self.assertTrue(torch.equal(staged.cpu(), batch * 2))
+        prefetcher.close()
+
+    def test_worker_error(self):
+        def transform(x):
+            if x == 2:
+                raise KeyError(x)
+            return x
+
+        prefetcher = tu.BatchPrefetcher(list(range(5)), depth=2, transform=transform)
+        self.assertEqual(next(prefetcher), 0)
+        self.assertEqual(next(prefetcher), 1)
+        with self.assertRaises(KeyError):
+            next(prefetcher)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file